@@ -0,0 +1,168 @@
+"""Local stand-in for a network of scan targets.
+
+Every emulated host is a loopback address (127.77.0.0/16; Linux routes all of 127.0.0.0/8 to
+the loopback interface) with its own mix of ports:
+
+- open ports are asyncio listeners; well-known ports greet with a banner or answer HTTP
+  requests, after an optional service delay, others accept and stay silent;
+- closed ports have no listener, so the kernel answers with a RST;
+- filtered ports are listeners whose accept queue is full and never drained, so the kernel
+  drops further SYNs and the probe times out.
+
+Network latency and packet loss cannot be faked on loopback from user space; `isolate_network`
+moves the process into a private network namespace whose loopback interface gets a netem
+qdisc (needs root, `unshare` and the sch_netem kernel module).
+"""
+import asyncio
+import contextlib
+import ipaddress
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+FIRST_HOST = ipaddress.ip_address('127.77.0.1')
+_NETNS_MARK = 'NETWORK_SCANNER_BENCH_NETNS'
+
+# Port: (greeting sent on connect, reply sent to any request); None for nothing
+SERVICES: Dict[int, Tuple[bytes | None, bytes | None]] = {
+    21: (b"220 (vsFTPd 3.0.5)\r\n", None),
+    22: (b"SSH-2.0-OpenSSH_8.9p1 Ubuntu-3ubuntu0.6\r\n", None),
+    25: (b"220 mail.example.com ESMTP Postfix (Ubuntu)\r\n", None),
+    80: (None, b"HTTP/1.1 200 OK\r\nServer: nginx/1.24.0\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"),
+    110: (b"+OK Dovecot (Ubuntu) ready.\r\n", None),
+    143: (b"* OK [CAPABILITY IMAP4rev1] Dovecot (Ubuntu) ready.\r\n", None),
+    8080: (None, b"HTTP/1.1 404 Not Found\r\nServer: Apache/2.4.58 (Ubuntu)\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"),
+}
+
+class EmulatedNetwork:
+    """A farm of emulated hosts, each with `open_ports` open and `filtered_ports` filtered ports
+    drawn (reproducibly, from `seed`) out of `ports`; every other port of `ports` is closed.
+
+    Use as an async context manager, or serve it from a child process with `in_subprocess`, so
+    its sockets and memory stay out of measurements of the scanning process.
+    """
+
+    def __init__(self, hosts: int, ports: Sequence[int], open_ports: int = 5, filtered_ports: int = 0,
+                 service_delay: float = 0.0, seed: int = 1):
+        if open_ports + filtered_ports > len(ports):
+            raise ValueError("More open and filtered ports than ports per host")
+        self.service_delay = service_delay
+        self.addresses = [str(FIRST_HOST + index) for index in range(hosts)]
+        self.layout: Dict[str, Dict[int, str]] = {}
+        rng = random.Random(seed)
+        # Hosts favour the well-known ports, like real ones do
+        favoured = [port for port in SERVICES if port in set(ports)]
+        for address in self.addresses:
+            chosen = rng.sample(favoured, min(len(favoured), rng.randint(0, open_ports)))
+            others = [port for port in ports if port not in chosen]
+            chosen += rng.sample(others, open_ports - len(chosen) + filtered_ports)
+            self.layout[address] = {port: 'open' if index < open_ports else 'filtered' for index, port in enumerate(chosen)}
+        self._servers: List[asyncio.AbstractServer] = []
+        self._sockets: List[socket.socket] = []
+        self._clients: set = set()
+
+    def expected(self, address: str, state: str = 'open') -> List[int]:
+        return sorted(port for port, port_state in self.layout[address].items() if port_state == state)
+
+    async def __aenter__(self) -> 'EmulatedNetwork':
+        try:
+            for address, ports in self.layout.items():
+                for port, state in ports.items():
+                    if state == 'open':
+                        self._servers.append(await asyncio.start_server(self._serve, address, port, backlog=1024))
+                    else:
+                        self._sockets.extend(_black_hole(address, port))
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        logger.info(f"Emulating {len(self.addresses)} hosts with {len(self._servers)} open and {len(self._sockets) // 2} filtered ports")
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for server in self._servers:
+            server.close()
+        for writer in list(self._clients):
+            writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        for sock in self._sockets:
+            sock.close()
+        self._servers, self._sockets = [], []
+
+    @contextlib.contextmanager
+    def in_subprocess(self) -> Iterator['EmulatedNetwork']:
+        context = multiprocessing.get_context('spawn')
+        ready, stop = context.Event(), context.Event()
+        process = context.Process(target=_serve_network, args=(self, ready, stop), daemon=True)
+        process.start()
+        try:
+            while not ready.wait(0.1):
+                if not process.is_alive():
+                    raise RuntimeError(f"The emulated network exited with code {process.exitcode} before it was up")
+            yield self
+        finally:
+            stop.set()
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        greeting, reply = SERVICES.get(writer.get_extra_info('sockname')[1], (None, None))
+        try:
+            if self.service_delay:
+                await asyncio.sleep(self.service_delay)
+            if greeting:
+                writer.write(greeting)
+                await writer.drain()
+            while await reader.read(4096):
+                if reply:
+                    writer.write(reply)
+                    await writer.drain()
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+def _serve_network(network: EmulatedNetwork, ready, stop) -> None:
+    async def serve() -> None:
+        async with network:
+            ready.set()
+            while not stop.is_set():
+                await asyncio.sleep(0.1)
+    asyncio.run(serve())
+
+def _black_hole(address: str, port: int) -> Tuple[socket.socket, socket.socket]:
+    """A listener that drops every SYN: with a backlog of 0 its queue holds one connection,
+    which is made here and never accepted."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((address, port))
+    listener.listen(0)
+    filler = socket.create_connection((address, port))
+    return listener, filler
+
+def isolate_network(latency_ms: float, loss_percent: float) -> None:
+    """Re-run this process in a private network namespace whose loopback interface delays every
+    packet by `latency_ms` (so a round trip takes twice that) and drops `loss_percent` of them."""
+    if os.environ.get(_NETNS_MARK) != '1':
+        os.environ[_NETNS_MARK] = '1'
+        try:
+            os.execvp('unshare', ['unshare', '--net', sys.executable, *sys.argv])
+        except OSError as e:
+            raise RuntimeError(f"Could not enter a network namespace (needs root and unshare): {str(e)}")
+    commands = [['ip', 'link', 'set', 'lo', 'up'],
+                ['tc', 'qdisc', 'add', 'dev', 'lo', 'root', 'netem', 'delay', f'{latency_ms}ms', 'loss', f'{loss_percent}%']]
+    for command in commands:
+        done = subprocess.run(command, capture_output=True, text=True)
+        if done.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed: {done.stderr.strip()}")
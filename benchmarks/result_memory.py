@@ -0,0 +1,73 @@
+"""Memory held by the ScanResults of a large inventory scan.
+
+Builds synthetic results shaped like a real sweep (most hosts down, live hosts with a few
+identified services) and reports the heap they occupy, measured with tracemalloc.
+
+    python benchmarks/result_memory.py --hosts 100000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scan_result import PortDetailTable, ScanResult  # noqa: E402
+
+SERVICES = [
+    {'port': 22, 'state': 'open', 'service': 'ssh', 'version': '8.9p1', 'product': 'OpenSSH',
+     'info': 'Ubuntu-3ubuntu0.6 protocol 2.0', 'cpe': 'cpe:/a:openbsd:openssh:8.9p1'},
+    {'port': 80, 'state': 'open', 'service': 'http', 'version': '1.24.0', 'product': 'nginx'},
+    {'port': 443, 'state': 'open', 'service': 'https', 'version': 'Unknown'},
+    {'port': 3306, 'state': 'open', 'service': 'mysql', 'version': '8.0.36', 'product': 'MySQL'},
+    {'port': 6379, 'state': 'open', 'service': 'redis', 'version': 'Unknown', 'product': 'Redis key-value store'},
+    {'port': 8080, 'state': 'open', 'service': 'http-proxy', 'version': 'Unknown', 'banner': 'HTTP/1.1 404 Not Found'},
+    {'port': 53, 'protocol': 'udp', 'state': 'open', 'service': 'domain', 'version': '9.18.19-1'},
+]
+
+def _fresh(value):
+    # Scans decode every banner anew, so equal strings of different hosts are distinct objects
+    return (value + ' ')[:-1] if isinstance(value, str) else value
+
+def build(hosts: int, up_share: float, seed: int):
+    rng = random.Random(seed)
+    results = []
+    details = PortDetailTable()  # As a scan does, one table for all of its results
+    for index in range(hosts):
+        host = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+        if rng.random() >= up_share:
+            results.append(ScanResult(host=host, state='down', ports=[], scan_time=0.0, os_guess='Unknown (host down)'))
+            continue
+        ports = [{key: _fresh(value) for key, value in record.items()}
+                 for record in rng.sample(SERVICES, rng.randint(1, 4))]
+        results.append(ScanResult(host=host, state='up', ports=ports, scan_time=rng.uniform(0.5, 5.0),
+                                  os_guess=_fresh('Linux 3.x - 6.x (92%)'),
+                                  port_counts={'open': len(ports), 'closed': 990 - len(ports), 'filtered': 10},
+                                  details=details))
+    return results
+
+def measure(hosts: int, up_share: float, seed: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = build(hosts, up_share, seed)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del results
+    return used
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=100000, help="Number of results to build")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic inventory")
+    args = parser.parse_args()
+    print(f"{'live hosts':>10}  {'MiB per 100k hosts':>18}  {'bytes per host':>14}")
+    for up_share in (0.1, 0.5, 1.0):
+        used = measure(args.hosts, up_share, args.seed)
+        print(f"{up_share:>10.0%}  {used * 100000 / args.hosts / 2 ** 20:>18.1f}  {used / args.hosts:>14.0f}")
+
+if __name__ == '__main__':
+    main()
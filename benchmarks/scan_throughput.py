@@ -0,0 +1,224 @@
+"""Scan throughput against an emulated network, reproducible offline.
+
+Runs `Scanner.scan`, `run_scan`, service detection and `compare_scan_results` against the
+hosts of `emulator.EmulatedNetwork` and reports, for each, the work done per second, the
+p50/p99 latency of its unit of work (a connect probe, a service detection, a comparison),
+the peak growth of the resident set and the peak number of open file descriptors.
+
+Only the open ports the emulator gives a service (`emulator.SERVICES`) ever answer; the others
+accept and stay silent, so service detection runs every probe on them until it times out and
+they take the whole SERVICE_DETECTION_BUDGET. Their share sets the service benchmark's latency,
+and the check reports how many of the ports could be identified at all.
+
+    python benchmarks/scan_throughput.py --hosts 64 --ports 1-1000 --open 5 --filtered 2
+    sudo python benchmarks/scan_throughput.py --latency 5 --loss 1   # in a private network namespace
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emulator import SERVICES, EmulatedNetwork, isolate_network  # noqa: E402
+from config import get_config  # noqa: E402
+from network_scanner import ScanResult, Scanner, run_scan  # noqa: E402
+from port_spec import parse_ports  # noqa: E402
+from service_detection import ServiceDetector, load_service_database  # noqa: E402
+
+BENCHMARKS = ('scan', 'run_scan', 'service', 'compare')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+class ResourceSampler:
+    """Polls the growth of the process's resident set and open file descriptors while a benchmark runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_rss = self.peak_fds = 0
+        self._baseline = self._baseline_fds = 0
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def rss() -> int:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+
+    @staticmethod
+    def fds() -> int:
+        return len(os.listdir('/proc/self/fd'))
+
+    def _sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, self.rss() - self._baseline)
+        self.peak_fds = max(self.peak_fds, self.fds() - self._baseline_fds)
+
+    async def _poll(self) -> None:
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> 'ResourceSampler':
+        self._baseline, self._baseline_fds = self.rss(), self.fds()
+        self._task = asyncio.create_task(self._poll())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+        self._sample()
+
+@contextlib.contextmanager
+def timed(owner: Any, name: str, latencies: List[float]) -> Iterator[None]:
+    """Record the duration of every call of the coroutine method `owner.name` while active."""
+    original = getattr(owner, name)
+
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    setattr(owner, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(owner, name, original)
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+async def measure(name: str, unit: str, work: Callable[[List[float]], Any], items: Callable[[Any], int],
+                  check: Callable[[Any], str] = lambda outcome: '') -> Dict[str, Any]:
+    latencies: List[float] = []
+    async with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        outcome = await work(latencies)
+        elapsed = time.perf_counter() - started
+    done = items(outcome)
+    return {'benchmark': name, 'unit': unit, 'items': done, 'seconds': round(elapsed, 3),
+            'rate': round(done / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2), 'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'peak_rss_mib': round(sampler.peak_rss / 2 ** 20, 1), 'peak_fds': sampler.peak_fds, 'check': check(outcome)}
+
+def accuracy(network: EmulatedNetwork, results: List[ScanResult]) -> str:
+    """How many of the emulated open ports the scan reported, and how many it invented."""
+    expected = sum(len(network.expected(address)) for address in network.addresses)
+    found = wrong = 0
+    for result in results:
+        reported = {port['port'] for port in result.ports}
+        truth = set(network.expected(result.host))
+        found += len(reported & truth)
+        wrong += len(reported - truth)
+    return f"open {found}/{expected}" + (f", {wrong} wrong" if wrong else '')
+
+def comparison_reports(results: List[ScanResult]) -> tuple:
+    """A report of `results` and a previous one that differs in a few ports of every host."""
+    current = {'hosts': [result.to_dict() for result in results]}
+    previous = {'hosts': []}
+    for index, host in enumerate(current['hosts']):
+        ports = host['ports'][1:] if index % 2 else host['ports'] + [{'port': 65000, 'state': 'open', 'service': 'unknown'}]
+        previous['hosts'].append({**host, 'ports': ports})
+    return current, previous
+
+async def run(args: argparse.Namespace, network: EmulatedNetwork) -> List[Dict[str, Any]]:
+    port_spec = parse_ports(args.ports)
+    probes = args.hosts * len(port_spec)
+    rows = []
+    targets = network.addresses
+    results: List[ScanResult] = []
+
+    if 'scan' in args.benchmarks:
+        async def scan(latencies):
+            scanner = Scanner(discovery=False, connect_timeout=args.timeout)
+            with timed(scanner, '_connect', latencies):
+                results.extend(await scanner.scan(targets, port_spec))
+            return results
+        rows.append(await measure('Scanner.scan', 'ports', scan, lambda _: probes, lambda found: accuracy(network, found)))
+
+    if 'run_scan' in args.benchmarks:
+        async def whole(latencies):
+            # run_scan builds its own scanner, so the probes are timed on the class
+            with timed(Scanner, '_connect', latencies):
+                return await run_scan(targets, port_spec, discovery=False)
+        rows.append(await measure('run_scan', 'ports', whole, lambda _: probes, lambda found: accuracy(network, found)))
+
+    if 'service' in args.benchmarks:
+        open_ports = [(address, port) for address in targets for port in network.expected(address)]
+        answering = sum(1 for _, port in open_ports if port in SERVICES)
+
+        async def detect(latencies):
+            detector = ServiceDetector(load_service_database(), get_config('SERVICE_PROBE_TIMEOUT'),
+                                       get_config('SERVICE_DETECTION_BUDGET'), get_config('SERVICE_PROBE_INTENSITY'))
+            with timed(detector, 'detect', latencies):
+                return await asyncio.gather(*[detector.detect(address, port) for address, port in open_ports])
+        rows.append(await measure('service detection', 'ports', detect, len,
+                                  lambda found: f"identified {sum(1 for details in found if details.get('service'))}/{len(found)}"
+                                                f" ({answering} answer, the rest are silent)"))
+
+    if 'compare' in args.benchmarks:
+        try:
+            from scan_comparison import compare_scan_results
+        except ImportError as e:
+            logging.warning(f"Skipping compare_scan_results: {str(e)}")
+        else:
+            if not results:
+                # The comparison works on the reports of a real scan of the network
+                results = await Scanner(discovery=False, connect_timeout=args.timeout).scan(targets, port_spec)
+            current, previous = comparison_reports(results)
+
+            async def compare(latencies):
+                changes = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    changes = compare_scan_results(current, previous)
+                    latencies.append(time.perf_counter() - started)
+                return changes
+            rows.append(await measure('compare_scan_results', 'hosts', compare, lambda _: args.repeat * len(results),
+                                      lambda changes: f"{len(changes)} changes"))
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=64, help="Emulated hosts (default: 64)")
+    parser.add_argument("--ports", default="1-1000", help="TCP ports scanned on every host (default: 1-1000)")
+    parser.add_argument("--open", type=int, default=5, help="Open ports per host (default: 5)")
+    parser.add_argument("--filtered", type=int, default=2, help="Filtered ports per host (default: 2)")
+    parser.add_argument("--service-delay", type=float, default=0.0, help="Seconds an open port waits before its banner or reply")
+    parser.add_argument("--latency", type=float, default=0.0, help="One-way packet delay in ms (network namespace, needs root and netem)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Packet loss in percent (network namespace, needs root and netem)")
+    parser.add_argument("--timeout", type=float, default=None, help="Initial connect timeout (default: CONNECT_TIMEOUT)")
+    parser.add_argument("--repeat", type=int, default=100, help="Comparisons run by the compare benchmark (default: 100)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the emulated port layout")
+    parser.add_argument("--benchmarks", nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    # The scanner's modules configure logging at import time; per-host progress lines only get in the way here
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.latency or args.loss:
+        try:
+            isolate_network(args.latency, args.loss)
+        except RuntimeError as e:
+            parser.error(str(e))
+    network = EmulatedNetwork(args.hosts, list(parse_ports(args.ports).tcp_ports), args.open, args.filtered,
+                              args.service_delay, args.seed)
+    with network.in_subprocess():
+        rows = asyncio.run(run(args, network))
+
+    print(f"{'benchmark':<22} {'items':>8} {'seconds':>8} {'per sec':>10} {'p50 ms':>8} {'p99 ms':>8} {'+RSS MiB':>8} {'+fds':>6}  check")
+    for row in rows:
+        print(f"{row['benchmark']:<22} {row['items']:>8} {row['seconds']:>8.2f} {row['rate']:>10.1f} {row['p50_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['peak_rss_mib']:>8.1f} {row['peak_fds']:>6}  {row['check']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, IO, Iterator, List, Sequence, Tuple
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+class HostProgress:
+    """Checkpoint view of one host being port-scanned.
+
+    Ports fall into fixed ranges of `chunk_size` ports; a range whose ports all got a verdict
+    is journaled with its state tally and open ports, and is not probed again on resume.
+    """
+
+    def __init__(self, checkpoint: 'ScanCheckpoint', index: int, totals: Dict[int, int],
+                 restored: Dict[int, Dict[str, Any]]):
+        self._checkpoint = checkpoint
+        self._index = index
+        self._totals = totals
+        self._restored = restored
+        self._running: Dict[int, Dict[str, Any]] = {}
+
+    def is_finished(self, port: int) -> bool:
+        return port // self._checkpoint.chunk_size in self._restored
+
+    @property
+    def open_ports(self) -> List[Dict[str, Any]]:
+        """Open port records of the ranges finished before the resume."""
+        return [record for chunk in self._restored.values() for record in chunk['open']]
+
+    @property
+    def port_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for chunk in self._restored.values():
+            for port_state, count in chunk['counts'].items():
+                counts[port_state] = counts.get(port_state, 0) + count
+        return counts
+
+    def port_done(self, port: int, record: Dict[str, Any] | None) -> None:
+        """Account for one finished probe; journals its range once every port of the range has a verdict.
+
+        A port without a record (the probe failed, or the host's deadline passed first) leaves
+        its range pending, so a resumed scan probes the range again.
+        """
+        if not record:
+            return
+        chunk = port // self._checkpoint.chunk_size
+        running = self._running.setdefault(chunk, {'done': 0, 'counts': {}, 'open': []})
+        running['done'] += 1
+        running['counts'][record['state']] = running['counts'].get(record['state'], 0) + 1
+        if record['state'] == 'open':
+            running['open'].append(record)
+        if running['done'] == self._totals[chunk]:
+            del self._running[chunk]
+            self._checkpoint._write({'type': 'ports', 'index': self._index, 'chunk': chunk,
+                                     'counts': running['counts'], 'open': running['open']})
+
+class ScanCheckpoint:
+    """Append-only journal of a scan's progress, so an interrupted scan can be resumed.
+
+    The first line holds the scan parameters, from which `resume` rebuilds the same target
+    order (including the seed of a randomized order). Each later line is a finished host,
+    identified by its index in that order, or a finished port range of a host still being
+    scanned. Lines are flushed as they are written and synced every CHECKPOINT_INTERVAL
+    seconds; a crash can at worst leave a truncated last line, which is discarded on resume.
+    """
+
+    def __init__(self, path: str, params: Dict[str, Any], chunk_size: int, stream: IO[str]):
+        self.path = path
+        self.params = params
+        self.chunk_size = chunk_size
+        self._stream = stream
+        self._done: set = set()
+        self._partial: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self._totals: Dict[int, int] | None = None
+        self._resumed_at = 0  # Journal length when it was reopened; later entries are this run's
+        self._sync_interval = get_config('CHECKPOINT_INTERVAL')
+        self._synced = time.monotonic()
+
+    @classmethod
+    def create(cls, path: str, params: Dict[str, Any]) -> 'ScanCheckpoint':
+        chunk_size = get_config('CHECKPOINT_PORT_CHUNK')
+        checkpoint = cls(path, params, chunk_size, open(path, 'w'))
+        checkpoint._write({'type': 'scan', 'params': params, 'chunk_size': chunk_size})
+        checkpoint.sync()
+        return checkpoint
+
+    @classmethod
+    def resume(cls, path: str) -> 'ScanCheckpoint':
+        """Reopen a checkpoint for appending, with the progress it records."""
+        stream = open(path, 'r+')
+        header = None
+        done = set()
+        partial: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        intact = 0
+        for line in iter(stream.readline, ''):
+            if not line.endswith('\n'):
+                break  # Cut off by a crash
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            intact = stream.tell()
+            if entry['type'] == 'scan':
+                header = entry
+            elif entry['type'] == 'host':
+                done.add(entry['index'])
+                partial.pop(entry['index'], None)
+            elif entry['index'] not in done:
+                partial.setdefault(entry['index'], {})[entry['chunk']] = entry
+        if header is None:
+            stream.close()
+            raise ValueError(f"{path} is not a scan checkpoint")
+        stream.seek(intact)
+        stream.truncate()
+        checkpoint = cls(path, header['params'], header['chunk_size'], stream)
+        checkpoint._done = done
+        checkpoint._partial = partial
+        checkpoint._resumed_at = intact
+        logger.info(f"Resuming from {path}: {len(done)} hosts finished, {len(partial)} partially scanned")
+        return checkpoint
+
+    def is_done(self, index: int) -> bool:
+        return index in self._done
+
+    def completed(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(index, result) of every host finished before the resume, read back from the journal."""
+        with open(self.path, 'r') as f:
+            while f.tell() < self._resumed_at:
+                entry = json.loads(f.readline())
+                if entry['type'] == 'host':
+                    yield entry['index'], entry['result']
+
+    def track(self, index: int, ports: Sequence[int]) -> HostProgress:
+        """Start (or continue) journaling the port ranges of host `index`."""
+        if self._totals is None:
+            self._totals = {}
+            for port in ports:
+                chunk = port // self.chunk_size
+                self._totals[chunk] = self._totals.get(chunk, 0) + 1
+        return HostProgress(self, index, self._totals, self._partial.pop(index, {}))
+
+    def record_host(self, index: int, result: Dict[str, Any]) -> None:
+        self._done.add(index)
+        self._partial.pop(index, None)
+        self._write({'type': 'host', 'index': index, 'result': result})
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        self._stream.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._stream.flush()
+        if time.monotonic() - self._synced >= self._sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        os.fsync(self._stream.fileno())
+        self._synced = time.monotonic()
+
+    def close(self) -> None:
+        if not self._stream.closed:
+            self.sync()
+            self._stream.close()
@@ -1,29 +1,63 @@
 import argparse
 import asyncio
+import contextlib
 import json
-from typing import List, Any
+import sys
+from typing import Iterable, List, Any
 
 from config import NetworkScannerConfig, get_config, validate_config
-from network_scanner import Scanner, ScanResult
+from network_scanner import SCAN_MODES, NDJSONWriter, Scanner, ScanResult, load_results_from_file
+from port_spec import PortSpec, parse_ports
 from scan_comparison import compare_scan_results
+from targets import expand_targets
 from logging_config import setup_logging, get_logger
+from metrics import METRICS, log_stats
+from profiler import profile
 
 logger = get_logger(__name__)
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Network Scanner CLI")
-    parser.add_argument('--targets', nargs='+', help='IP addresses or ranges to scan')
-    parser.add_argument('--ports', help='Ports to scan (e.g., "80,443,8080" or "1-1000")')
+    parser.add_argument('--targets', nargs='+', help='IP addresses, hostnames, CIDR blocks, ranges or @file to scan')
+    parser.add_argument('--exclude', nargs='+', default=[], help='Targets to leave out, in the same syntax as --targets')
+    parser.add_argument('--randomize-hosts', action='store_true', help='Scan targets in a random permutation')
+    parser.add_argument('--ports', help='Ports to scan (e.g., "80,443,8080", "1-1000", "top-100" or "T:80,U:53")')
+    parser.add_argument('--scan-type', choices=SCAN_MODES, default='connect', help='TCP connect scan or raw SYN half-open scan (requires root)')
+    parser.add_argument('--skip-discovery', action='store_true', help='Treat every target as up and skip host discovery')
     parser.add_argument('--config', help='Path to configuration file')
     parser.add_argument('--compare', help='Path to previous scan results for comparison')
-    parser.add_argument('--output', help='Output file for scan results')
+    parser.add_argument('--output', help='Output file for scan results (\'-\' for stdout with ndjson)')
+    parser.add_argument('--output-format', choices=('json', 'ndjson'), default='json', help='JSON array at the end, or NDJSON streamed per host')
+    parser.add_argument('--profile', help='Profile the scan with a sampling profiler and write collapsed stacks (for flame graphs) to this file')
     parser.add_argument('--verbose', '-v', action='count', default=0, help='Increase output verbosity')
     return parser.parse_args()
 
-async def run_scan(targets: List[str], ports: str) -> List[ScanResult]:
-    scanner = Scanner()
+async def run_scan(targets: Iterable[str], ports: str | PortSpec, scan_mode: str = 'connect', discovery: bool = True) -> List[ScanResult]:
+    scanner = Scanner(scan_mode=scan_mode, discovery=discovery)
     return await scanner.scan(targets, ports)
 
+async def stream_scan(targets: Iterable[str], ports: PortSpec, scan_mode: str, discovery: bool, output: str | None,
+                      verbosity: int, keep_results: bool) -> List[ScanResult]:
+    """Scan while writing NDJSON as results arrive; only keeps results in memory when asked to."""
+    scanner = Scanner(scan_mode=scan_mode, discovery=discovery)
+    stream = None
+    if output:
+        stream = sys.stdout if output == '-' else open(output, 'w')
+    writer = NDJSONWriter(stream) if stream else None
+    results = []
+    try:
+        async for event in scanner.iter_scan(targets, ports):
+            if writer:
+                writer.write(event)
+            if isinstance(event, ScanResult):
+                print_scan_results([event], verbosity)
+                if keep_results:
+                    results.append(event)
+    finally:
+        if stream and stream is not sys.stdout:
+            stream.close()
+    return results
+
 def save_results(results: List[ScanResult], filename: str) -> None:
     try:
         with open(filename, 'w') as f:
@@ -34,9 +68,7 @@ def save_results(results: List[ScanResult], filename: str) -> None:
 
 def load_previous_results(filename: str) -> List[ScanResult]:
     try:
-        with open(filename, 'r') as f:
-            data = json.load(f)
-            return [ScanResult.from_dict(item) for item in data]
+        return load_results_from_file(filename)
     except IOError as e:
         logger.error(f"Error loading previous results from {filename}: {str(e)}")
         return []
@@ -47,6 +79,8 @@ def print_scan_results(results: List[ScanResult], verbosity: int) -> None:
         logger.info(f"Host: {result.host}")
         logger.info(f"  State: {result.state}")
         logger.info(f"  Scan Time: {result.scan_time:.2f} seconds")
+        if result.port_counts:
+            logger.info(f"  Closed: {result.port_counts['closed']}, Filtered: {result.port_counts['filtered']}")
         if verbosity > 0:
             logger.info(f"  OS Guess: {result.os_guess}")
         if verbosity > 1:
@@ -81,25 +115,37 @@ async def main() -> None:
             return
 
         targets = args.targets or config.SCAN_TARGETS
-        ports = args.ports or config.SCAN_PORTS
+        ports = parse_ports(args.ports or config.SCAN_PORTS)
 
         if not targets:
             logger.error("No targets specified. Please provide targets via CLI or config file.")
             return
 
-        logger.info(f"Starting scan on targets: {targets}, ports: {ports}")
+        logger.info(f"Starting scan on targets: {targets}, ports: {ports.spec}")
         start_time = time.time()
-        results = await run_scan(targets, ports)
+        expanded_targets = expand_targets(targets, args.exclude, randomize=args.randomize_hosts)
+        interval = get_config('STATS_INTERVAL')
+        stats = asyncio.create_task(log_stats(interval, logger.info)) if interval else None
+        try:
+            async with profile(args.profile) if args.profile else contextlib.nullcontext():
+                if args.output_format == 'ndjson':
+                    results = await stream_scan(expanded_targets, ports, args.scan_type, not args.skip_discovery, args.output,
+                                                args.verbose, keep_results=bool(args.compare))
+                else:
+                    results = await run_scan(expanded_targets, ports, args.scan_type, not args.skip_discovery)
+                if args.output_format == 'json':
+                    print_scan_results(results, args.verbose)
+                    if args.output:
+                        save_results(results, args.output)
+                        logger.info(f"Results saved to {args.output}")
+        finally:
+            if stats is not None:
+                stats.cancel()
+        logger.info(METRICS.summary())
         end_time = time.time()
         scan_duration = end_time - start_time
         logger.info(f"Scan completed successfully in {scan_duration:.2f} seconds")
 
-        print_scan_results(results, args.verbose)
-
-        if args.output:
-            save_results(results, args.output)
-            logger.info(f"Results saved to {args.output}")
-
         if args.compare:
             previous_results = load_previous_results(args.compare)
             changes = compare_scan_results(results, previous_results)
@@ -14,6 +14,39 @@ class NetworkScannerConfig(BaseModel):
     LOG_LEVEL: str = Field("INFO", description="Logging level")
     SCAN_TARGETS: List[str] = Field(["localhost"], description="Default targets to scan")
     SCAN_PORTS: str = Field("1-1000", description="Default ports to scan")
+    MAX_IN_FLIGHT: int = Field(1000, ge=1, le=65535, description="Maximum number of in-flight connect probes shared across all targets")
+    MAX_PROBES_PER_HOST: int = Field(64, ge=1, description="Maximum number of in-flight probes against any single host")
+    MAX_PACKET_RATE: float = Field(0, ge=0, description="Probe packets per second across the whole scan (0 for no limit)")
+    CONNECT_TIMEOUT: float = Field(1.0, gt=0, description="Initial probe timeout in seconds, before any RTT has been measured")
+    MIN_RTT_TIMEOUT: float = Field(0.05, gt=0, description="Lower bound in seconds for the adaptive per-host probe timeout")
+    MAX_RTT_TIMEOUT: float = Field(5.0, gt=0, description="Upper bound in seconds for the adaptive per-host probe timeout")
+    MAX_RETRIES: int = Field(2, ge=0, le=10, description="Retransmissions for probes that timed out without any answer")
+    SERVICE_PROBE_TIMEOUT: float = Field(3.0, gt=0, description="Longest wait in seconds for the answer to one service probe")
+    SERVICE_DETECTION_BUDGET: float = Field(6.0, gt=0, description="Total time in seconds spent identifying the service on one open port")
+    SERVICE_PROBE_INTENSITY: int = Field(7, ge=0, le=9, description="Highest probe rarity sent to ports no probe is registered for")
+    OS_FINGERPRINTS_FILE: str = Field("", description="OS fingerprint database to load instead of the bundled os_fingerprints.json")
+    SERVICE_PROBES_FILE: str = Field("", description="Service probe database to load instead of the bundled service_probes.json")
+    MAX_CONCURRENT_HOSTS: int = Field(256, ge=1, description="Hosts whose port sweeps may run at the same time")
+    TARGET_BATCH_SIZE: int = Field(4096, ge=1, description="Targets expanded, resolved and discovered together before port scanning")
+    DISCOVERY_METHODS: List[str] = Field(["icmp", "syn"], description="Host discovery probes tried in order (icmp, syn, ack, connect)")
+    DISCOVERY_PORTS: List[int] = Field([80, 443, 22], description="Ports used by TCP discovery pings")
+    HOST_TIMEOUT: float = Field(0, ge=0, description="Longest time in seconds spent on one host after discovery (0 for no limit); also ends a batch's SYN and UDP sweeps")
+    DISCOVERY_TIMEOUT: float = Field(0, ge=0, description="Longest time in seconds host discovery may take for one target batch (0 for no limit)")
+    PORT_SCAN_TIMEOUT: float = Field(0, ge=0, description="Longest time in seconds spent probing the ports of one host (0 for no limit); a batch's SYN and UDP sweeps stop once it has passed")
+    SERVICE_SCAN_TIMEOUT: float = Field(0, ge=0, description="Longest time in seconds spent identifying the services of one host (0 for no limit)")
+    OS_DETECTION_TIMEOUT: float = Field(0, ge=0, description="Longest time in seconds spent fingerprinting the OS of one host (0 for no limit)")
+    DNS_CONCURRENCY: int = Field(64, ge=1, description="DNS queries the resolver runs at the same time")
+    DNS_CACHE_SIZE: int = Field(65536, ge=1, description="DNS answers kept in the process-wide cache; the least recently used are dropped first")
+    REVERSE_DNS: bool = Field(False, description="Look up the host name of every live address for the results")
+    CHECKPOINT_INTERVAL: float = Field(10.0, gt=0, description="Longest time in seconds between syncs of a scan checkpoint to disk")
+    CHECKPOINT_PORT_CHUNK: int = Field(1024, ge=1, le=65536, description="Width of the port ranges a host's progress is checkpointed in")
+    FILTERED_OPEN_RATIO: float = Field(0.7, gt=0, le=1, description="Share of open ports above which a host is reported as filtered")
+    FILTER_SAMPLE_SIZE: int = Field(24, ge=0, description="Random ports of a host probed before the rest to spot accept-all middleboxes early (0 to disable)")
+    FILTER_CANARY_PORTS: int = Field(3, ge=0, le=16, description="Rarely open ports probed with the sample; open canaries betray an accept-all device")
+    METRICS_MAX_HOSTS: int = Field(256, ge=1, description="Hosts with their own connect latency histogram; older hosts are folded into one series")
+    PROFILE_INTERVAL: float = Field(0.005, gt=0, description="Seconds between the stack samples of the sampling profiler")
+    PROFILE_OUTPUT: str = Field("web_profile.folded", description="File the web process writes collapsed stacks to when profiling is toggled off at /profile")
+    STATS_INTERVAL: float = Field(10, ge=0, description="Seconds between the stats lines logged by the command line tools (0 to disable)")
 
     @validator('OUTPUT_FORMAT')
     def validate_output_format(cls, v):
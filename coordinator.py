@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+from network_scanner import SCAN_MODES, Scanner, ScanResult
+from port_spec import parse_ports
+from scan_result import PortDetailTable
+from sharding import merge_results
+from targets import TargetSpec
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        targets TEXT NOT NULL,
+        exclude TEXT NOT NULL,
+        ports TEXT NOT NULL,
+        scan_mode TEXT NOT NULL,
+        discovery INTEGER NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS work_units (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        target_start INTEGER NOT NULL,
+        target_stop INTEGER NOT NULL,
+        port_shard INTEGER NOT NULL,
+        port_shards INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        lease_expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        FOREIGN KEY (job_id) REFERENCES jobs (id)
+    );
+    CREATE INDEX IF NOT EXISTS work_units_state ON work_units (job_id, state);
+    CREATE TABLE IF NOT EXISTS unit_results (
+        unit_id INTEGER NOT NULL,
+        host_index INTEGER NOT NULL,
+        result TEXT NOT NULL,
+        FOREIGN KEY (unit_id) REFERENCES work_units (id)
+    );
+'''
+
+UNIT_STATES = ('pending', 'leased', 'done', 'failed')
+
+class WorkUnit(NamedTuple):
+    """A slice of a job: targets [target_start, target_stop) over one port shard."""
+    id: int
+    job_id: int
+    targets: List[str]
+    exclude: List[str]
+    ports: str
+    scan_mode: str
+    discovery: bool
+    target_start: int
+    target_stop: int
+    port_shard: int
+    port_shards: int
+
+class WorkQueue:
+    """Scan jobs split into leased work units, kept in a SQLite file that every node can open.
+
+    A lease is a deadline: a worker that stops renewing it (crashed, hung, partitioned) loses
+    the unit once the deadline passes and the next `lease` call hands it to another worker.
+    Results are accepted only from the worker that currently holds the lease.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never lease the same unit
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def create_job(self, targets: Sequence[str], ports: str, user_id: int = 0, exclude: Sequence[str] = (),
+                   scan_mode: str = 'connect', discovery: bool = True, unit_size: int = 256, port_shards: int = 1) -> int:
+        """Register a job and split it into units of `unit_size` targets times `port_shards` port shards."""
+        total = TargetSpec(targets, exclude).count
+        parse_ports(ports)  # Reject a bad port spec now rather than in every worker
+        with self._transaction() as db:
+            cursor = db.execute('INSERT INTO jobs (user_id, targets, exclude, ports, scan_mode, discovery, created) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (user_id, json.dumps(list(targets)), json.dumps(list(exclude)), ports, scan_mode,
+                                 int(discovery), time.time()))
+            job_id = cursor.lastrowid
+            db.executemany('INSERT INTO work_units (job_id, target_start, target_stop, port_shard, port_shards) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           ((job_id, start, min(start + unit_size, total), shard, port_shards)
+                            for start in range(0, total, unit_size) for shard in range(port_shards)))
+        logger.info(f"Job {job_id}: {total} targets in {-(-total // unit_size) * port_shards} work units")
+        return job_id
+
+    def lease(self, worker: str, lease_seconds: float) -> WorkUnit | None:
+        """Lease the oldest unit that is pending or whose lease has expired."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE work_units SET state = 'failed', error = 'lease expired too often' "
+                       "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            row = db.execute("SELECT u.id, u.job_id, j.targets, j.exclude, j.ports, j.scan_mode, j.discovery, "
+                             "u.target_start, u.target_stop, u.port_shard, u.port_shards "
+                             "FROM work_units u JOIN jobs j ON j.id = u.job_id "
+                             "WHERE u.state = 'pending' OR (u.state = 'leased' AND u.lease_expires < ?) "
+                             "ORDER BY u.id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE work_units SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (worker, now + lease_seconds, row[0]))
+        unit_id, job_id, targets, exclude, ports, scan_mode, discovery, start, stop, shard, shards = row
+        return WorkUnit(unit_id, job_id, json.loads(targets), json.loads(exclude), ports, scan_mode, bool(discovery),
+                        start, stop, shard, shards)
+
+    def renew(self, unit_id: int, worker: str, lease_seconds: float) -> bool:
+        """Extend a lease; False when the worker no longer holds it."""
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE work_units SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                                (time.time() + lease_seconds, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id: int, worker: str, results: Sequence[Tuple[int, Dict[str, Any]]]) -> bool:
+        """Store a unit's results; False (and nothing stored) when the lease was lost meanwhile."""
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE work_units SET state = 'done', lease_expires = NULL "
+                                "WHERE id = ? AND worker = ? AND state = 'leased'", (unit_id, worker))
+            if cursor.rowcount != 1:
+                return False
+            db.executemany('INSERT INTO unit_results (unit_id, host_index, result) VALUES (?, ?, ?)',
+                           ((unit_id, index, json.dumps(result)) for index, result in results))
+        return True
+
+    def fail(self, unit_id: int, worker: str, error: str) -> None:
+        """Give a unit back after an error; it is retried until it has used up its attempts."""
+        with self._transaction() as db:
+            db.execute("UPDATE work_units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "worker = NULL, lease_expires = NULL, error = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                       (self.max_attempts, error, unit_id, worker))
+
+    def progress(self, job_id: int | None = None) -> Dict[str, int]:
+        """Unit count per state, for one job or for the whole queue."""
+        query = 'SELECT state, COUNT(*) FROM work_units' + (' WHERE job_id = ?' if job_id is not None else '') + ' GROUP BY state'
+        with self._lock:
+            rows = self._db.execute(query, (job_id,) if job_id is not None else ()).fetchall()
+        counts = dict.fromkeys(UNIT_STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def job(self, job_id: int) -> Dict[str, Any]:
+        with self._lock:
+            row = self._db.execute('SELECT user_id, targets, exclude, ports, scan_mode, discovery FROM jobs WHERE id = ?',
+                                   (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No scan job {job_id}")
+        user_id, targets, exclude, ports, scan_mode, discovery = row
+        return {'user_id': user_id, 'targets': json.loads(targets), 'exclude': json.loads(exclude), 'ports': ports,
+                'scan_mode': scan_mode, 'discovery': bool(discovery)}
+
+    def results(self, job_id: int) -> List[ScanResult]:
+        """Results of every finished unit, port shards merged per host, in target order."""
+        with self._lock:
+            rows = self._db.execute('SELECT r.host_index, r.result FROM unit_results r '
+                                    'JOIN work_units u ON u.id = r.unit_id WHERE u.job_id = ? ORDER BY r.host_index',
+                                    (job_id,)).fetchall()
+        by_host: Dict[int, List[ScanResult]] = {}
+        details = PortDetailTable()
+        for index, result in rows:
+            by_host.setdefault(index, []).append(ScanResult.from_dict(json.loads(result), details))
+        return [parts[0] if len(parts) == 1 else merge_results(parts, details) for _, parts in sorted(by_host.items())]
+
+class ScanWorker:
+    """Leases units from a WorkQueue, scans them and reports back, renewing the lease meanwhile."""
+
+    def __init__(self, queue: WorkQueue, worker_id: str | None = None, lease_seconds: float = 60.0,
+                 poll_interval: float = 1.0, exit_when_idle: bool = True):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+
+    async def run(self) -> int:
+        """Process units until the queue is drained (or forever); returns the number completed."""
+        completed = 0
+        while True:
+            unit = await asyncio.to_thread(self.queue.lease, self.worker_id, self.lease_seconds)
+            if unit is None:
+                progress = await asyncio.to_thread(self.queue.progress)
+                if self.exit_when_idle and not progress['pending'] and not progress['leased']:
+                    logger.info(f"Worker {self.worker_id}: queue drained after {completed} units")
+                    return completed
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if await self._process(unit):
+                completed += 1
+
+    async def _process(self, unit: WorkUnit) -> bool:
+        logger.info(f"Worker {self.worker_id}: unit {unit.id} of job {unit.job_id}, targets "
+                    f"{unit.target_start}-{unit.target_stop - 1}, port shard {unit.port_shard + 1}/{unit.port_shards}")
+        lease_lost = asyncio.Event()
+        scan = asyncio.create_task(self._scan(unit))
+        heartbeat = asyncio.create_task(self._heartbeat(unit, scan, lease_lost))
+        try:
+            results = await scan
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                raise
+            logger.warning(f"Worker {self.worker_id}: lost the lease on unit {unit.id}, abandoning it")
+            return False
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id}: unit {unit.id} failed: {str(e)}")
+            await asyncio.to_thread(self.queue.fail, unit.id, self.worker_id, str(e))
+            return False
+        finally:
+            heartbeat.cancel()
+        if not await asyncio.to_thread(self.queue.complete, unit.id, self.worker_id, results):
+            logger.warning(f"Worker {self.worker_id}: unit {unit.id} was re-leased before it finished; results dropped")
+            return False
+        return True
+
+    async def _heartbeat(self, unit: WorkUnit, scan: asyncio.Task, lease_lost: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.renew, unit.id, self.worker_id, self.lease_seconds):
+                lease_lost.set()
+                scan.cancel()
+                return
+
+    async def _scan(self, unit: WorkUnit) -> List[Tuple[int, Dict[str, Any]]]:
+        spec = TargetSpec(unit.targets, unit.exclude)
+        ports = parse_ports(unit.ports)
+        if unit.port_shards > 1:
+            ports = ports.subset(unit.port_shard, unit.port_shards)
+        scanner = Scanner(scan_mode=unit.scan_mode, discovery=unit.discovery)
+        results = []
+        async for index, event in scanner._iter_scan_indexed(spec.iter_range(unit.target_start, unit.target_stop), ports):
+            if isinstance(event, ScanResult):
+                results.append((unit.target_start + index, event.to_dict()))
+        return results
+
+class ScanCoordinator:
+    """Submits jobs to a WorkQueue, waits for the workers to finish them and stores the results in ScanDatabase."""
+
+    def __init__(self, queue: WorkQueue, database=None):
+        self.queue = queue
+        self.database = database
+
+    def submit(self, targets: Sequence[str], ports: str, **options: Any) -> int:
+        return self.queue.create_job(targets, ports, **options)
+
+    async def wait(self, job_id: int, poll_interval: float = 1.0) -> List[ScanResult]:
+        """Block until no unit of the job is pending or leased, then aggregate (and save) its results."""
+        while True:
+            progress = await asyncio.to_thread(self.queue.progress, job_id)
+            if not progress['pending'] and not progress['leased']:
+                break
+            logger.info(f"Job {job_id}: {progress['done']} done, {progress['leased']} leased, "
+                        f"{progress['pending']} pending, {progress['failed']} failed")
+            await asyncio.sleep(poll_interval)
+        if progress['failed']:
+            logger.error(f"Job {job_id}: {progress['failed']} work units failed; their targets are missing from the results")
+        results = await asyncio.to_thread(self.queue.results, job_id)
+        if self.database is not None:
+            job = self.queue.job(job_id)
+            await self.database.save_scan_results(job['user_id'], job['targets'], job['ports'],
+                                                  [result.to_dict() for result in results])
+            logger.info(f"Job {job_id}: saved {len(results)} host results to the scan database")
+        return results
+
+def run_worker(queue_path: str, lease_seconds: float = 60.0, exit_when_idle: bool = True) -> int:
+    """Process entry point for a worker, local or on another node sharing the queue file."""
+    queue = WorkQueue(queue_path)
+    try:
+        return asyncio.run(ScanWorker(queue, lease_seconds=lease_seconds, exit_when_idle=exit_when_idle).run())
+    finally:
+        queue.close()
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Distributed scan coordinator")
+    parser.add_argument("--queue", default="scan_queue.db", help="Shared SQLite work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("submit", "local"):
+        command = commands.add_parser(name, help="Submit a job" if name == "submit" else "Submit a job and run it with local worker processes")
+        command.add_argument("-t", "--targets", nargs="+", required=True, help="Targets, in the network_scanner syntax")
+        command.add_argument("--exclude", nargs="+", default=[], help="Targets to leave out")
+        command.add_argument("-p", "--ports", default="1-100", help="Ports to scan")
+        command.add_argument("-s", "--scan-type", choices=SCAN_MODES, default="connect", help="Connect or SYN scan")
+        command.add_argument("-Pn", "--skip-discovery", action="store_true", help="Skip host discovery")
+        command.add_argument("--unit-size", type=int, default=256, help="Targets per work unit")
+        command.add_argument("--port-shards", type=int, default=1, help="Work units per target slice, each with a share of the ports")
+        command.add_argument("--user-id", type=int, default=0, help="Owner of the results in the scan database")
+        command.add_argument("--database", help="ScanDatabase file to store the aggregated results in")
+    commands.choices["submit"].add_argument("--wait", action="store_true", help="Wait for the job to finish and aggregate it")
+    commands.choices["local"].add_argument("-w", "--workers", type=int, default=4, help="Local worker processes")
+    worker = commands.add_parser("worker", help="Run a worker against the queue")
+    worker.add_argument("--lease", type=float, default=60.0, help="Lease duration in seconds")
+    worker.add_argument("--forever", action="store_true", help="Keep polling when the queue is empty")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        await asyncio.to_thread(run_worker, args.queue, args.lease, not args.forever)
+        return
+
+    queue = WorkQueue(args.queue)
+    database = None
+    if args.database:
+        from database import ScanDatabase
+        database = ScanDatabase(args.database)
+        await database.connect()
+    coordinator = ScanCoordinator(queue, database)
+    job_id = coordinator.submit(args.targets, args.ports, user_id=args.user_id, exclude=args.exclude,
+                                scan_mode=args.scan_type, discovery=not args.skip_discovery,
+                                unit_size=args.unit_size, port_shards=args.port_shards)
+    processes = []
+    try:
+        if args.command == "local":
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=run_worker, args=(args.queue,)) for _ in range(args.workers)]
+            for process in processes:
+                process.start()
+        if args.command == "local" or args.wait:
+            results = await coordinator.wait(job_id)
+            logger.info(f"Job {job_id} finished: {sum(result.state == 'up' for result in results)} of {len(results)} hosts up")
+        else:
+            logger.info(f"Submitted job {job_id}; start workers with: python coordinator.py --queue {args.queue} worker")
+    finally:
+        for process in processes:
+            process.join()
+        if database is not None:
+            await database.close()
+        queue.close()
+
+if __name__ == '__main__':
+    asyncio.run(main())
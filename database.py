@@ -2,6 +2,13 @@ import aiosqlite
 import json
 from typing import List, Dict, Any
 from datetime import datetime
+from timing import PhaseReport
+
+# Columns added to existing tables since their first version: (table, column, type)
+COLUMN_MIGRATIONS = [
+    ('scan_results', 'scan_time', 'REAL'),
+    ('scan_results', 'timings', 'TEXT'),
+]
 
 class ScanDatabase:
     def __init__(self, db_file: str = 'scan_results.db'):
@@ -37,11 +44,21 @@ class ScanDatabase:
                     host TEXT NOT NULL,
                     state TEXT NOT NULL,
                     ports TEXT NOT NULL,
+                    scan_time REAL,
+                    timings TEXT,
                     FOREIGN KEY (scan_id) REFERENCES scans (id)
                 )
             ''')
+            await self._migrate(cursor)
             await self.db.commit()
 
+    async def _migrate(self, cursor):
+        """Add the columns that databases created by older versions lack."""
+        for table, column, column_type in COLUMN_MIGRATIONS:
+            await cursor.execute(f'PRAGMA table_info({table})')
+            if column not in [row[1] for row in await cursor.fetchall()]:
+                await cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
     async def save_scan_results(self, user_id: int, targets: List[str], ports: str, results: List[Dict[str, Any]]):
         """Save scan results to the database."""
         timestamp = datetime.now().isoformat()
@@ -50,8 +67,9 @@ class ScanDatabase:
                                  (user_id, timestamp, json.dumps(targets), ports))
             scan_id = cursor.lastrowid
             for result in results:
-                await cursor.execute('INSERT INTO scan_results (scan_id, host, state, ports) VALUES (?, ?, ?, ?)',
-                                     (scan_id, result['host'], result['state'], json.dumps(result['ports'])))
+                await cursor.execute('INSERT INTO scan_results (scan_id, host, state, ports, scan_time, timings) VALUES (?, ?, ?, ?, ?, ?)',
+                                     (scan_id, result['host'], result['state'], json.dumps(result['ports']),
+                                      result.get('scan_time'), json.dumps(result.get('timings') or {})))
             await self.db.commit()
 
     async def get_scan_history(self, user_id: int) -> List[Dict[str, Any]]:
@@ -66,11 +84,20 @@ class ScanDatabase:
             if not await cursor.fetchone():
                 return []  # User doesn't have permission to view this scan
 
-        async with self.db.execute('SELECT host, state, ports FROM scan_results WHERE scan_id = ?', (scan_id,)) as cursor:
+        async with self.db.execute('SELECT host, state, ports, scan_time, timings FROM scan_results WHERE scan_id = ?', (scan_id,)) as cursor:
             rows = await cursor.fetchall()
             results = []
             for row in rows:
-                result = dict(zip(['host', 'state', 'ports'], row))
+                result = dict(zip(['host', 'state', 'ports', 'scan_time', 'timings'], row))
                 result['ports'] = json.loads(result['ports'])
+                # Rows stored before phase timings were recorded have none
+                result['timings'] = json.loads(result['timings']) if result['timings'] else {}
                 results.append(result)
             return results
+
+    async def get_phase_report(self, scan_id: int, user_id: int) -> List[Dict[str, Any]]:
+        """Mean phase times per network segment of a scan (see timing.PhaseReport)."""
+        report = PhaseReport()
+        for result in await self.get_scan_results(scan_id, user_id):
+            report.add(result['host'], result['timings'])
+        return report.rows()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from typing import Dict, List, Sequence, Set
+
+from metrics import METRICS
+from packets import ICMP_ECHO_REPLY, ICMPV6_ECHO_REPLY, TCP_ACK, TCP_SYN, address_family, icmp_echo, parse_icmp_reply, parse_icmpv6_reply
+from probe_scheduler import ProbeScheduler
+from raw_listener import RawTCPListener
+from syn_scan import SynScanner
+from timing import HostTimingTable
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_METHODS = ('icmp', 'syn', 'ack', 'connect')
+RAW_METHODS = ('icmp', 'syn', 'ack')
+
+class HostDiscovery:
+    """Concurrent liveness check over a whole target set, run before any port sweep.
+
+    Methods are tried in order and each one only probes the hosts that earlier methods
+    could not confirm. Raw methods (icmp, syn, ack) need root; without it they are replaced
+    by the unprivileged connect ping.
+    """
+
+    def __init__(self, methods: Sequence[str], ports: Sequence[int], timing: HostTimingTable,
+                 retries: int = 1, scheduler: ProbeScheduler | None = None, listener: RawTCPListener | None = None):
+        unknown = set(methods) - set(DISCOVERY_METHODS)
+        if unknown:
+            raise ValueError(f"Unknown discovery methods: {', '.join(sorted(unknown))}")
+        self.methods = list(methods)
+        self.ports = list(ports)
+        self.timing = timing
+        self.retries = retries
+        self._scheduler = scheduler or ProbeScheduler(256, 8)
+        self._listener = listener
+
+    async def discover(self, addresses: Sequence[str], timeout: float = 0) -> Dict[str, str]:
+        """Return {address: 'up'|'down'|'timeout'} for every address.
+
+        With a `timeout`, discovery stops when it runs out; hosts confirmed by then are up and
+        the unconfirmed rest is reported as 'timeout' rather than 'down'.
+        """
+        remaining: Set[str] = set(addresses)
+        methods = self.methods
+        if hasattr(os, 'geteuid') and os.geteuid() != 0 and any(m in RAW_METHODS for m in methods):
+            logger.warning("Raw discovery methods need root privileges; using connect pings instead")
+            methods = [m for m in methods if m not in RAW_METHODS] or ['connect']
+        deadline = time.monotonic() + timeout if timeout else None
+        timed_out = False
+        for method in methods:
+            if not remaining:
+                break
+            started = time.time()
+            # Methods add hosts as they answer, so a method cut short still contributes
+            alive: Set[str] = set()
+            try:
+                await asyncio.wait_for(getattr(self, f"_{method}_ping")(sorted(remaining), alive),
+                                       timeout=max(0.0, deadline - time.monotonic()) if deadline else None)
+            except asyncio.TimeoutError:
+                timed_out = True
+            remaining -= alive
+            logger.info(f"Discovery via {method}: {len(alive)} hosts up in {time.time() - started:.2f} seconds, {len(remaining)} unconfirmed")
+            if timed_out:
+                logger.warning(f"Discovery ran out of time after {timeout:g} seconds; {len(remaining)} hosts left unconfirmed")
+                break
+        unconfirmed = 'timeout' if timed_out else 'down'
+        return {address: unconfirmed if address in remaining else 'up' for address in addresses}
+
+    def _wait_time(self, addresses: Sequence[str], attempt: int = 0) -> float:
+        return max((self.timing.timeout_for(address, attempt) for address in addresses), default=self.timing.initial_timeout)
+
+    async def _icmp_ping(self, addresses: List[str], alive: Set[str]) -> None:
+        loop = asyncio.get_running_loop()
+        ident = random.getrandbits(16)
+        sent_at: Dict[str, float] = {}
+        all_answered = asyncio.Event()
+        sockets: Dict[int, socket.socket] = {}
+
+        def on_readable(family: int, sock: socket.socket) -> None:
+            while True:
+                try:
+                    if family == socket.AF_INET6:
+                        # Raw ICMPv6 sockets deliver the message without its IPv6 header
+                        data, source = sock.recvfrom(65535)
+                        reply, expected = parse_icmpv6_reply(data, source[0]), ICMPV6_ECHO_REPLY
+                    else:
+                        reply, expected = parse_icmp_reply(sock.recv(65535)), ICMP_ECHO_REPLY
+                except (BlockingIOError, InterruptedError):
+                    return
+                if reply is None or reply.type != expected or reply.ident != ident or reply.src not in sent_at:
+                    continue
+                if reply.src not in alive:
+                    METRICS.reply('icmp', 'echo-reply')
+                    alive.add(reply.src)
+                    self.timing.record(reply.src, time.monotonic() - sent_at[reply.src])
+                    if len(alive) == len(addresses):
+                        all_answered.set()
+
+        try:
+            for family in sorted({address_family(address) for address in addresses}):
+                sock = socket.socket(family, socket.SOCK_RAW,
+                                     socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP)
+                sockets[family] = sock
+                sock.setblocking(False)
+                loop.add_reader(sock.fileno(), on_readable, family, sock)
+            for attempt in range(self.retries + 1):
+                pending = [address for address in addresses if address not in alive]
+                if not pending:
+                    break
+                for seq, address in enumerate(pending):
+                    await self._scheduler.rate.acquire()
+                    sent_at[address] = time.monotonic()
+                    family = address_family(address)
+                    try:
+                        await loop.sock_sendto(sockets[family], icmp_echo(ident, seq & 0xffff, b'network-scanner', family),
+                                               (address, 0))
+                        METRICS.sent('icmp', retry=attempt > 0)
+                    except OSError as e:
+                        logger.debug(f"Could not send ICMP echo to {address}: {str(e)}")
+                try:
+                    await asyncio.wait_for(all_answered.wait(), timeout=self._wait_time(pending, attempt))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for sock in sockets.values():
+                loop.remove_reader(sock.fileno())
+                sock.close()
+
+    async def _tcp_ping(self, addresses: List[str], alive: Set[str], flags: int) -> None:
+        scanner = SynScanner(timeout=self._wait_time(addresses), retries=self.retries, listener=self._listener,
+                             rate=self._scheduler.rate)
+        try:
+            await scanner.scan(addresses, self.ports, flags=flags)
+        finally:
+            alive.update(scanner.answered_hosts())
+
+    async def _syn_ping(self, addresses: List[str], alive: Set[str]) -> None:
+        await self._tcp_ping(addresses, alive, TCP_SYN)
+
+    async def _ack_ping(self, addresses: List[str], alive: Set[str]) -> None:
+        await self._tcp_ping(addresses, alive, TCP_ACK)
+
+    async def _connect_ping(self, addresses: List[str], alive: Set[str]) -> None:
+        loop = asyncio.get_running_loop()
+
+        async def ping(address: str, port: int) -> bool:
+            # Both an accepted and a refused connection prove the host is there
+            for attempt in range(self.retries + 1):
+                sock = socket.socket(address_family(address), socket.SOCK_STREAM)
+                sock.setblocking(False)
+                try:
+                    async with self._scheduler.slot(address):
+                        # Time the connect alone; the wait for a slot and the rate limit is no RTT
+                        started = time.monotonic()
+                        try:
+                            await asyncio.wait_for(loop.sock_connect(sock, (address, port)),
+                                                   timeout=self.timing.timeout_for(address, attempt))
+                        except ConnectionRefusedError:
+                            pass
+                        rtt = time.monotonic() - started
+                except asyncio.TimeoutError:
+                    continue
+                except OSError:
+                    return False
+                finally:
+                    sock.close()
+                self.timing.record(address, rtt)
+                return True
+            return False
+
+        async def ping_host(address: str) -> None:
+            results = await asyncio.gather(*[ping(address, port) for port in self.ports])
+            if any(results):
+                alive.add(address)
+
+        await asyncio.gather(*[ping_host(address) for address in addresses])
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import math
+import os
+import time
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Hosts whose latency series were evicted to stay within METRICS_MAX_HOSTS
+OTHER_HOSTS = 'other'
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """Monotonic count, one series per combination of label values."""
+
+    __slots__ = ('name', 'help', 'label_names', 'values')
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+class Histogram:
+    """Bucketed observations per value of one label, keeping at most `max_series` series.
+
+    The least recently observed series are folded into the 'other' series, so a scan of a
+    large network cannot grow the metrics without bound.
+    """
+
+    __slots__ = ('name', 'help', 'label_name', 'buckets', 'max_series', '_series')
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], label_name: str, max_series: int):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self.max_series = max(1, max_series)
+        # Label value -> [count per bucket (the last one is +Inf), sum]
+        self._series: OrderedDict[str, List] = OrderedDict()
+
+    def observe(self, value: float, label: str) -> None:
+        series = self._series.get(label)
+        if series is None:
+            if len(self._series) - (OTHER_HOSTS in self._series) >= self.max_series:
+                self._fold_oldest()
+            series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+        elif label != OTHER_HOSTS:
+            self._series.move_to_end(label)
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _fold_oldest(self) -> None:
+        oldest = next((label for label in self._series if label != OTHER_HOSTS), None)
+        if oldest is None:
+            return
+        counts, total = self._series.pop(oldest)
+        other = self._series.setdefault(OTHER_HOSTS, [[0] * (len(self.buckets) + 1), 0.0])
+        other[0] = [a + b for a, b in zip(other[0], counts)]
+        other[1] += total
+
+    def quantile(self, share: float) -> float | None:
+        """Upper bound of the bucket holding the `share` quantile across all series."""
+        counts = [sum(series[0][index] for series in self._series.values()) for index in range(len(self.buckets) + 1)]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            seen += count
+            if seen >= share * total:
+                return bound
+        return math.inf
+
+    def render(self, by_label: bool = True) -> List[str]:
+        """The series in the text format; without `by_label`, one series summing them all."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        if by_label:
+            series = [((self.label_name,), (label,), counts, total) for label, (counts, total) in self._series.items()]
+        elif self._series:
+            counts = [sum(counts[index] for counts, _ in self._series.values()) for index in range(len(self.buckets) + 1)]
+            series = [((), (), counts, sum(total for _, total in self._series.values()))]
+        else:
+            series = []
+        for names, values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names + ('le',), values + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(names, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(names, values)} {cumulative}")
+        return lines
+
+class RateMeter:
+    """Events per second, exponentially averaged over `window` seconds."""
+
+    __slots__ = ('window', '_value', '_updated')
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self._value = 0.0
+        self._updated = time.monotonic()
+
+    def _decay(self) -> None:
+        now = time.monotonic()
+        self._value *= math.exp(-(now - self._updated) / self.window)
+        self._updated = now
+
+    def add(self, count: float = 1) -> None:
+        self._decay()
+        self._value += count
+
+    @property
+    def rate(self) -> float:
+        self._decay()
+        return self._value / self.window
+
+def open_fds() -> int | None:
+    """File descriptors open in this process; None where /proc is not available."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+class ScanMetrics:
+    """Counters and gauges of the scans running in this process, rendered in the Prometheus text format."""
+
+    def __init__(self, max_hosts: int | None = None):
+        self.probes_sent = Counter('scanner_probes_sent_total', 'Probes sent, by probe type', ('type',))
+        self.replies = Counter('scanner_replies_total', 'Probe outcomes, by probe type and reply', ('type', 'reply'))
+        self.retries = Counter('scanner_retries_total', 'Probes retransmitted after going unanswered', ('type',))
+        self.timeouts = Counter('scanner_timeouts_total', 'Probes that drew no answer before their timeout', ('type',))
+        self.rate_limited = Counter('scanner_rate_limit_wait_seconds_total', 'Time spent waiting for the packet rate limit')
+        self.connect_latency = Histogram('scanner_connect_latency_seconds', 'Round trip time of answered connect probes, by host',
+                                         LATENCY_BUCKETS, 'host', max_hosts or get_config('METRICS_MAX_HOSTS'))
+        self.send_rate = RateMeter()
+        self._schedulers = weakref.WeakSet()
+
+    def track(self, scheduler) -> None:
+        """Include a ProbeScheduler's in-flight and queued probes in the gauges."""
+        self._schedulers.add(scheduler)
+
+    def sent(self, kind: str, count: int = 1, retry: bool = False) -> None:
+        self.probes_sent.inc(kind, amount=count)
+        self.send_rate.add(count)
+        if retry:
+            self.retries.inc(kind, amount=count)
+
+    def reply(self, kind: str, reply: str, count: int = 1) -> None:
+        if not count:
+            return
+        self.replies.inc(kind, reply, amount=count)
+        if reply == 'timeout':
+            self.timeouts.inc(kind, amount=count)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(scheduler.in_flight for scheduler in self._schedulers)
+
+    @property
+    def queued(self) -> int:
+        return sum(scheduler.queued for scheduler in self._schedulers)
+
+    def gauges(self) -> Dict[str, Tuple[str, float | None]]:
+        return {
+            'scanner_in_flight_probes': ('Probes holding an in-flight slot', self.in_flight),
+            'scanner_queued_probes': ('Probes waiting for an in-flight slot', self.queued),
+            'scanner_send_rate': ('Probes sent per second, averaged over the last seconds', self.send_rate.rate),
+            'scanner_open_fds': ('File descriptors open in the scanner process', open_fds()),
+        }
+
+    def render(self, per_host: bool = True) -> str:
+        """The metrics in the Prometheus text format; without `per_host`, the latency histogram
+        is one series for all hosts, so the output does not reveal which addresses were scanned."""
+        lines: List[str] = []
+        for metric in (self.probes_sent, self.replies, self.retries, self.timeouts, self.rate_limited):
+            lines.extend(metric.render())
+        lines.extend(self.connect_latency.render(by_label=per_host))
+        for name, (help, value) in self.gauges().items():
+            if value is not None:
+                lines.extend((f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_number(value)}"))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """One line for periodic progress output."""
+        replies: Dict[str, float] = {}
+        for (_, reply), count in self.replies.values.items():
+            replies[reply] = replies.get(reply, 0) + count
+        p50, p99 = self.connect_latency.quantile(0.5), self.connect_latency.quantile(0.99)
+        latency = f", connect p50 <={p50 * 1000:g}ms p99 <={p99 * 1000:g}ms" if p50 is not None else ''
+        fds = open_fds()
+        return (f"Stats: {self.probes_sent.total():.0f} probes sent ({self.send_rate.rate:.0f}/s), "
+                f"{self.in_flight} in flight, {self.queued} queued, "
+                f"replies {' '.join(f'{reply}={count:.0f}' for reply, count in sorted(replies.items())) or 'none'}, "
+                f"{self.retries.total():.0f} retries, rate-limited {self.rate_limited.total():.1f}s{latency}"
+                + (f", {fds} fds" if fds is not None else ''))
+
+METRICS = ScanMetrics()
+
+async def log_stats(interval: float, log: Callable[[str], None] = logger.info) -> None:
+    """Log the stats line every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        log(METRICS.summary())
@@ -0,0 +1,68 @@
+import logging
+import math
+import random
+from typing import Any, Dict, List, Sequence, Tuple
+
+from port_spec import MAX_PORT, TOP_TCP_PORTS
+
+logger = logging.getLogger(__name__)
+
+# Canaries come from the dynamic port range, where services almost never listen
+CANARY_RANGE = (49200, MAX_PORT)
+_CONFIDENCE_Z = 1.96  # 95% two-sided
+
+def wilson_lower_bound(successes: int, trials: int, z: float = _CONFIDENCE_Z) -> float:
+    """Lower end of the Wilson score interval for a binomial proportion."""
+    if trials == 0:
+        return 0.0
+    share = successes / trials
+    centre = share + z * z / (2 * trials)
+    spread = z * math.sqrt(share * (1 - share) / trials + z * z / (4 * trials * trials))
+    return (centre - spread) / (1 + z * z / trials)
+
+class AcceptAllDetector:
+    """Spots hosts behind an accept-all middlebox (SYN proxy, tarpit, ...) before their full sweep.
+
+    A random sample of the host's ports is probed first, together with a few canary ports
+    that are almost never open. A real host refuses the canaries; a device that completes
+    every handshake accepts them like any other port. The host is judged filtered when all
+    canaries are open and, with 95% confidence, more than `open_ratio` of its ports are.
+    """
+
+    def __init__(self, sample_size: int, canaries: int, open_ratio: float, rng: random.Random | None = None):
+        self.sample_size = sample_size
+        self.canaries = canaries
+        self.open_ratio = open_ratio
+        self._rng = rng or random.Random()
+        self._common = frozenset(TOP_TCP_PORTS)
+
+    def plan(self, ports: Sequence[int]) -> Tuple[List[int], List[int]]:
+        """(sample, canaries) to probe before the rest of `ports`; both empty when the host has
+        too few ports for a sample to save anything. Canaries are not taken from `ports`, unless
+        the ports leave no room for them."""
+        if not self.sample_size or len(ports) < 2 * self.sample_size:
+            return [], []
+        sample = self._rng.sample(ports, self.sample_size)
+        scanned = set(ports)
+        canaries: List[int] = []
+        for _ in range(self.canaries * 8):
+            if len(canaries) == self.canaries:
+                break
+            port = self._rng.randint(*CANARY_RANGE)
+            if port not in scanned and port not in self._common and port not in canaries:
+                canaries.append(port)
+        if len(canaries) < self.canaries:
+            # Every candidate is being scanned anyway (a full range); take unsampled ports of the host
+            chosen = set(sample)
+            spare = [port for port in range(CANARY_RANGE[0], CANARY_RANGE[1] + 1)
+                     if port in scanned and port not in chosen and port not in canaries]
+            canaries += self._rng.sample(spare, min(len(spare), self.canaries - len(canaries)))
+        return sample, canaries
+
+    def is_accept_all(self, sample: Sequence[Dict[str, Any] | None], canaries: Sequence[Dict[str, Any] | None]) -> bool:
+        """Verdict from the probe records (None for ports that could not be probed)."""
+        if any(not record or record['state'] != 'open' for record in canaries):
+            return False
+        answered = [record for record in sample if record]
+        opened = sum(1 for record in answered if record['state'] == 'open')
+        return wilson_lower_bound(opened, len(answered)) > self.open_ratio
@@ -1,373 +1,710 @@
-
 import asyncio
 import socket
-import struct
-from typing import List, Dict, Any
+from array import array
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, IO, Iterable, Iterator, NamedTuple, Sequence, Tuple
+from checkpoint import HostProgress, ScanCheckpoint
 from config import get_config
+from discovery import HostDiscovery
+from targets import expand_targets
+from os_fingerprint import DEFAULT_FINGERPRINTS_FILE, fingerprint_from_reply, load_os_database
+from os_fingerprint import describe as describe_fingerprint
+from packets import TCP_RST, address_family, ip_packet, source_address_for, tcp_segment
+from metrics import METRICS, log_stats
+from middlebox import AcceptAllDetector
+from port_spec import PortSpec, parse_ports
+from profiler import profile
+from scan_result import OS_NO_OPEN_PORT, OS_NOT_PROBED, PORT_STATES, PortDetailTable, PortFinding, ScanResult
+from sharding import DiscoveryRelay
+from probe_scheduler import ProbeScheduler, TokenBucket
+from service_detection import DEFAULT_PROBES_FILE, ServiceDetector, load_service_database
+from raw_listener import RawTCPListener
+from resolver import Resolver
+from syn_scan import SynScanner
+from timing import PHASES, HostDeadline, HostTimingTable, PhaseReport, PhaseTimer
+from udp_scan import UDPScanner
+import errno
 import logging
 import time
 import argparse
+import contextlib
+import itertools
 import json
 import random
+import sys
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class ScanResult:
-    def __init__(self, host: str, state: str, ports: List[Dict[str, Any]], scan_time: float, os_guess: str):
-        self.host = host
-        self.state = state
-        self.ports = ports
-        self.scan_time = scan_time
-        self.os_guess = os_guess
-
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            'host': self.host,
-            'state': self.state,
-            'ports': self.ports,
-            'scan_time': self.scan_time,
-            'os_guess': self.os_guess
-        }
+def _count_port_states(records: List[Dict[str, Any] | None]) -> Dict[str, int]:
+    counts = dict.fromkeys(PORT_STATES, 0)
+    for record in records:
+        if record:
+            counts[record['state']] += 1
+    return counts
+
+class SweepStates(NamedTuple):
+    """One host's answers to a batch-wide sweep: its ports that answered other than closed, by port
+    (a state for SYN, a record for UDP), how many ports were closed and whether the sweep ran out of time."""
+    ports: Dict[int, Any]
+    closed: int
+    timed_out: bool = False
+
+def _count_syn_states(port_states: SweepStates, total_ports: int) -> Dict[str, int]:
+    counts = dict.fromkeys(PORT_STATES, 0)
+    for port_state in port_states.ports.values():
+        counts[port_state] += 1
+    counts['closed'] = port_states.closed
+    counts['filtered'] = total_ports - counts['open'] - counts['closed']
+    return counts
+
+def _batched(targets: Iterable[str], size: int) -> Iterator[List[str]]:
+    """Pull targets lazily in fixed-size batches so huge ranges are never fully materialised."""
+    iterator = iter(targets)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+async def _run_bounded(items: Iterable[Any], workers: int, work: Callable[[Any], Awaitable[None]]) -> None:
+    """Run `work` on every item with at most `workers` calls at once, pulling items lazily."""
+    iterator = iter(items)
+
+    async def worker() -> None:
+        for item in iterator:
+            await work(item)
+
+    await asyncio.gather(*[worker() for _ in range(max(1, workers))])
+
+def _raise_fd_limit(wanted: int) -> int:
+    """Raise the soft open-file limit towards `wanted` and return the usable in-flight budget."""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    reserve = 64  # Keep descriptors free for logging, output files and the event loop itself
+    if soft != resource.RLIM_INFINITY and soft < wanted + reserve:
+        new_soft = wanted + reserve if hard == resource.RLIM_INFINITY else min(wanted + reserve, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not raise open file limit to {new_soft}: {str(e)}")
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(1, min(wanted, soft - reserve))
+
+SCAN_MODES = ('connect', 'syn')
+
+# MSS 1460, SACK permitted, timestamps, NOP, window scale 10
+OS_PROBE_OPTIONS = bytes.fromhex('020405b40402080a00000001000000000103030a')
 
 class Scanner:
-    def _extract_tcp_options(self, options: bytes) -> Dict[str, Any]:
-        i = 0
-        extracted_options = {}
-        while i < len(options) and i < 40:  # Limit to first 40 bytes to avoid application data
-            if i + 1 >= len(options):
-                break
-            opt_type = options[i]
-            opt_length = options[i+1] if opt_type != 1 else 1  # NOP has no length field
-
-            if opt_type == 0:  # End of options
-                break
-            elif opt_type == 1:  # NOP
-                i += 1
-                continue
-            elif opt_type == 2 and opt_length == 4:  # MSS
-                extracted_options['MSS'] = struct.unpack('!H', options[i+2:i+4])[0]
-            elif opt_type == 3 and opt_length == 3:  # Window Scale
-                extracted_options['WScale'] = options[i+2]
-            elif opt_type == 4 and opt_length == 2:  # SACK Permitted
-                extracted_options['SACK'] = True
-            elif opt_type == 8 and opt_length == 10:  # Timestamp
-                extracted_options['Timestamp'] = struct.unpack('!II', options[i+2:i+10])
-
-            i += opt_length
-
-        return extracted_options
-
-    def _guess_os(self, ttl: int, window_size: int, options: Dict[str, Any]) -> str:
-        if ttl == 56:
-            return f"Possible CDN or Load Balancer (Facebook/Google infrastructure) - Window Size: {window_size}"
-        elif ttl == 64:
-            if window_size == 65535:
-                return "FreeBSD or OpenBSD"
-            elif window_size in [5840, 14600, 29200]:
-                return "Linux (kernel 2.4 and 2.6)"
-            elif window_size == 16384:
-                return "macOS (OS X)"
-            elif window_size == 512:
-                return "Linux (possibly virtualized)"
-            elif window_size == 53270:
-                return "Linux (possibly localhost)"
-        elif ttl == 128:
-            if window_size == 65535:
-                return "Windows Server 2008, Vista, or 7"
-            elif window_size == 8192:
-                return "Windows 2000 or XP"
-            elif window_size == 16384:
-                return "Windows 2003 or 2008"
-        elif ttl == 255:
-            if window_size == 65535:
-                return "Solaris or AIX"
-            elif window_size == 4128:
-                return "Cisco IOS"
-            elif window_size == 53270:
-                return "Linux (localhost)"
-        
-        if 'MSS' in options:
-            mss = options['MSS']
-            if mss == 1460:
-                return f"Ethernet MTU (Windows or Linux) - TTL: {ttl}, Window Size: {window_size}"
-            elif mss == 1380:
-                return f"OpenBSD or NetBSD (Ethernet) - TTL: {ttl}, Window Size: {window_size}"
-            elif mss == 1440:
-                return f"Google server (GWS) - TTL: {ttl}, Window Size: {window_size}"
-        
-        return f"Unknown OS (TTL: {ttl}, Window Size: {window_size}, Options: {options})"
-
-    async def _get_service_version(self, target: str, port: int) -> str:
+    def __init__(self, max_in_flight: int | None = None, connect_timeout: float | None = None, scan_mode: str = 'connect',
+                 discovery: bool = True, max_probes_per_host: int | None = None, rate_limiter: TokenBucket | None = None,
+                 raw_ports: Tuple[int, int] | None = None, host_timeout: float | None = None,
+                 reverse_dns: bool | None = None, max_concurrent_hosts: int | None = None, os_detection: bool = True,
+                 discovery_relay: DiscoveryRelay | None = None):
+        if scan_mode not in SCAN_MODES:
+            raise ValueError(f"scan_mode must be one of {', '.join(SCAN_MODES)}")
+        self.scan_mode = scan_mode
+        self.discovery = discovery
+        self.batch_size = get_config('TARGET_BATCH_SIZE')
+        self.max_concurrent_hosts = max_concurrent_hosts or get_config('MAX_CONCURRENT_HOSTS')
+        self.os_detection = os_detection
+        # Port shards of one scan resolve and discover each batch once, in the lead shard
+        self._discovery_relay = discovery_relay
+        wanted = max_in_flight or get_config('MAX_IN_FLIGHT')
+        # Open ports of a host's accept-all sample stay connected until they are described; they get
+        # whatever descriptors the limit leaves beyond the in-flight budget
+        sample_connections = get_config('FILTER_SAMPLE_SIZE') * self.max_concurrent_hosts
+        usable = _raise_fd_limit(wanted + sample_connections)
+        self.max_in_flight = min(wanted, usable)
+        self._held_budget = usable - self.max_in_flight
+        self._held = 0
+        if self.max_in_flight < wanted:
+            logger.warning(f"In-flight budget reduced from {wanted} to {self.max_in_flight} by the open file limit")
+        self.connect_timeout = connect_timeout or get_config('CONNECT_TIMEOUT')
+        self.max_retries = get_config('MAX_RETRIES')
+        self.host_timeout = get_config('HOST_TIMEOUT') if host_timeout is None else host_timeout
+        self.reverse_dns = get_config('REVERSE_DNS') if reverse_dns is None else reverse_dns
+        # Every target is resolved once, up front; probes only ever see addresses
+        self._resolver = Resolver()
+        self.phase_timeouts = {'ports': get_config('PORT_SCAN_TIMEOUT'), 'service': get_config('SERVICE_SCAN_TIMEOUT'),
+                               'os': get_config('OS_DETECTION_TIMEOUT')}
+        self._services = load_service_database(get_config('SERVICE_PROBES_FILE') or DEFAULT_PROBES_FILE)
+        self._os_db = load_os_database(get_config('OS_FINGERPRINTS_FILE') or DEFAULT_FINGERPRINTS_FILE)
+        self._timing = HostTimingTable(self.connect_timeout, get_config('MIN_RTT_TIMEOUT'), get_config('MAX_RTT_TIMEOUT'))
+        # One budget for every probe issued by this scanner, handed out round-robin across targets
+        self._scheduler = ProbeScheduler(self.max_in_flight, max_probes_per_host or get_config('MAX_PROBES_PER_HOST'),
+                                         get_config('MAX_PACKET_RATE'), limiter=rate_limiter)
+        METRICS.track(self._scheduler)
+        # Version probes that reconnect are paced with the port probes
+        self._service_detector = ServiceDetector(self._services, get_config('SERVICE_PROBE_TIMEOUT'),
+                                                 get_config('SERVICE_DETECTION_BUDGET'), get_config('SERVICE_PROBE_INTENSITY'),
+                                                 rate=self._scheduler.rate)
+        # Concurrent scans on one scanner share the raw listener and the probe budget
+        self._scan_slots = asyncio.Semaphore(get_config('MAX_THREADS'))
+        self._active_scans = 0
+        # SYN sweeps and OS probes share one raw sender/receiver pair, opened on first use
+        self._raw_listener: RawTCPListener | None = None
+        self._raw_ports = raw_ports  # (first source port, count) for raw probes; random when not given
+        self._raw_denied = False
+        self.filtered_open_ratio = get_config('FILTERED_OPEN_RATIO')
+        self._accept_all = AcceptAllDetector(get_config('FILTER_SAMPLE_SIZE'), get_config('FILTER_CANARY_PORTS'),
+                                             self.filtered_open_ratio)
+
+    async def _get_service_version(self, target: str, port: int, sock: socket.socket | None = None,
+                                   deadline: HostDeadline | None = None) -> Dict[str, str]:
+        """Identify the service and its version, starting over `sock` when the scan already holds a connection.
+
+        Every connection opened (or reused) for the probes is closed before returning.
+        """
+        if deadline is not None and deadline.expired('service'):
+            if sock is not None:
+                sock.close()
+            return {}
         try:
-            reader, writer = await asyncio.open_connection(target, port)
-            writer.write(b"HEAD / HTTP/1.0\r\n\r\n")
-            await writer.drain()
-            response = await reader.read(1024)
-            writer.close()
-            await writer.wait_closed()
-            
-            response_str = response.decode('utf-8', errors='ignore')
-            server_header = next((line for line in response_str.splitlines() if line.startswith("Server:")), None)
-            if server_header:
-                return server_header.split("Server:")[1].strip()
-            return "Unknown"
+            remaining = deadline.remaining('service') if deadline is not None else None
+            return await asyncio.wait_for(self._service_detector.detect(target, port, sock), timeout=remaining)
+        except asyncio.TimeoutError:
+            if deadline is not None:
+                deadline.expire('service')
+            return {}
         except Exception as e:
             logger.error(f"Error getting service version for {target}:{port}: {str(e)}")
-            return "Unknown"
+            return {}
+
+    async def _connect(self, target: str, port: int, timeout: float) -> Tuple[socket.socket | None, str]:
+        """Open a non-blocking TCP connection driven by the event loop.
 
-    async def scan_port(self, target: str, port: int) -> Dict[str, Any] | None:
+        Returns the connected socket (or None) and the probe outcome: 'open', 'closed' (refused),
+        'filtered' (ICMP unreachable) or 'timeout' (no answer at all). Answered probes feed the
+        host's RTT estimate.
+        """
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(address_family(target), socket.SOCK_STREAM)
+        sock.setblocking(False)
+        started = time.monotonic()
         try:
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.settimeout(1)
-            result = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: conn.connect_ex((target, port))
-            )
-            if result == 0:
-                service = self._get_service_name(port)
-                version = await self._get_service_version(target, port)
-                return {
-                    'port': port,
-                    'state': 'open',
-                    'service': service,
-                    'version': version
-                }
-            conn.close()
+            await asyncio.wait_for(loop.sock_connect(sock, (target, port)), timeout=timeout)
+        except asyncio.TimeoutError:
+            sock.close()
+            return None, 'timeout'
+        except ConnectionRefusedError:
+            sock.close()
+            self._record_rtt(target, time.monotonic() - started)
+            return None, 'closed'
+        except OSError as e:
+            sock.close()
+            if e.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EACCES):
+                return None, 'filtered'
+            raise
+        except BaseException:
+            sock.close()
+            raise
+        self._record_rtt(target, time.monotonic() - started)
+        return sock, 'open'
+
+    async def _describe_in_slot(self, target: str, port: int, sock: socket.socket | None = None,
+                                deadline: HostDeadline | None = None, phases: PhaseTimer | None = None) -> Dict[str, Any]:
+        """Describe an open port the caller holds no slot for; the detector paces the connections it opens."""
+        await self._scheduler.acquire(target)
+        try:
+            return await self._describe_open_port(target, port, sock, deadline, phases)
+        finally:
+            self._scheduler.release(target)
+
+    def _record_rtt(self, target: str, rtt: float) -> None:
+        self._timing.record(target, rtt)
+        METRICS.connect_latency.observe(rtt, target)
+
+    async def _describe_open_port(self, target: str, port: int, sock: socket.socket | None = None,
+                                  deadline: HostDeadline | None = None, phases: PhaseTimer | None = None) -> Dict[str, Any]:
+        if phases is not None:
+            with phases.measure('service'):
+                details = await self._get_service_version(target, port, sock, deadline)
+        else:
+            details = await self._get_service_version(target, port, sock, deadline)
+        record = {
+            'port': port,
+            'state': 'open',
+            'service': details.get('service') or self._get_service_name(port),
+            'version': details.get('version', 'Unknown')
+        }
+        for field in ('product', 'info', 'cpe', 'banner'):
+            if field in details:
+                record[field] = details[field]
+        return record
+
+    async def scan_port(self, target: str, port: int, deadline: HostDeadline | None = None,
+                        phases: PhaseTimer | None = None,
+                        opened: Callable[[socket.socket], Dict[str, Any]] | None = None) -> Dict[str, Any] | None:
+        """Probe one port; None when it could not be probed (an error, or the host's deadline passed).
+
+        An open port is described over its connection, unless `opened` is given: it then takes
+        the connection and returns the port's record instead.
+        """
+        try:
+            # Only unanswered probes are retransmitted; a refusal or unreachable is a final answer
+            for attempt in range(self.max_retries + 1):
+                async with self._scheduler.slot(target):
+                    timeout = self._timing.timeout_for(target, attempt)
+                    if deadline is not None:
+                        if deadline.expired('ports'):
+                            return None
+                        timeout = deadline.bound('ports', timeout)
+                    METRICS.sent('connect', retry=attempt > 0)
+                    conn, state = await self._connect(target, port, timeout)
+                    # A timeout that is retransmitted is not the probe's outcome yet
+                    if state != 'timeout' or attempt == self.max_retries:
+                        METRICS.reply('connect', state)
+                    if conn is not None and opened is not None:
+                        return opened(conn)
+                    if conn is not None:
+                        # The version probe runs over this connection and keeps the in-flight slot
+                        # until it is closed, so open ports cannot exhaust file descriptors
+                        return await self._describe_open_port(target, port, conn, deadline, phases)
+                if state != 'timeout':
+                    break
+            return {'port': port, 'state': 'filtered' if state == 'timeout' else state}
         except Exception as e:
             logger.error(f"Error scanning port {target}:{port}: {str(e)}")
         return None
 
+    async def _discover(self, addresses: List[str]) -> Dict[str, str]:
+        """Liveness of every address ('up', 'down' or 'timeout'); everything counts as up when discovery is disabled."""
+        if not self.discovery:
+            return dict.fromkeys(addresses, 'up')
+        discovery = HostDiscovery(get_config('DISCOVERY_METHODS'), get_config('DISCOVERY_PORTS'), self._timing,
+                                  retries=self.max_retries, scheduler=self._scheduler, listener=self._raw_tcp_listener())
+        return await discovery.discover(addresses, get_config('DISCOVERY_TIMEOUT'))
+
+    async def _prepare_batch(self, batch: List[str], port_spec: PortSpec) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, SweepStates] | None,
+                                                                               Dict[str, SweepStates] | None, Dict[str, str | None],
+                                                                               Dict[str, float]]:
+        """Resolve and discover a batch of targets, SYN-sweep its live hosts in syn mode and
+        UDP-sweep them when UDP ports are given and, with reverse DNS enabled, look up their names meanwhile.
+
+        Also returns the wall time of each of these batch-wide phases."""
+        phases = PhaseTimer()
+        relay = self._discovery_relay
+        if relay is not None and not relay.lead:
+            with phases.measure('discovery'):
+                resolved, host_states = await relay.receive()
+        else:
+            with phases.measure('resolve'):
+                resolved = await self._resolver.resolve_many(batch)
+            with phases.measure('discovery'):
+                host_states = await self._discover(sorted({address for address in resolved.values() if address}))
+            host_states.update((target, 'unresolved') for target, address in resolved.items() if address is None)
+            if relay is not None:
+                relay.publish(resolved, host_states)
+        # A target that does not resolve keeps its name as its address and is reported without being probed
+        addresses = {target: address or target for target, address in resolved.items()}
+        live_addresses = [address for address, host_state in host_states.items() if host_state == 'up']
+        names = asyncio.create_task(self._resolver.reverse_many(live_addresses)) if self.reverse_dns and live_addresses else None
+        try:
+            syn_states = udp_states = None
+            if live_addresses and (self.scan_mode == 'syn' or port_spec.udp_ports):
+                phases.start('ports')
+                # The sweeps spend every host's port scan time at once, so they end where the
+                # hosts' deadlines would: HOST_TIMEOUT or PORT_SCAN_TIMEOUT, whichever is shorter
+                limits = [limit for limit in (self.host_timeout, self.phase_timeouts['ports']) if limit]
+                until = time.monotonic() + min(limits) if limits else None
+                # Both sweeps are batch-wide and share the packet rate; a sweep not needed yields None
+                syn_states, udp_states = await asyncio.gather(
+                    self._syn_sweep(live_addresses, port_spec.tcp_ports, until) if self.scan_mode == 'syn' else asyncio.sleep(0),
+                    self._udp_sweep(live_addresses, port_spec.udp_ports, until) if port_spec.udp_ports else asyncio.sleep(0))
+                phases.stop('ports')
+            hostnames = await names if names is not None else {}
+        finally:
+            if names is not None:
+                names.cancel()
+        return addresses, host_states, syn_states, udp_states, hostnames, phases.durations
+
+    def _raw_tcp_listener(self) -> RawTCPListener | None:
+        """The scan's shared raw TCP listener; None when raw sockets are unavailable."""
+        if self._raw_listener is None and not self._raw_denied:
+            listener = RawTCPListener(*self._raw_ports) if self._raw_ports else RawTCPListener()
+            try:
+                listener.open()
+            except PermissionError:
+                self._raw_denied = True
+                logger.error("Raw sockets require root privileges; SYN scanning and OS detection are unavailable")
+                return None
+            self._raw_listener = listener
+        return self._raw_listener
+
+    def _close_raw_listener(self) -> None:
+        if self._raw_listener is not None:
+            self._raw_listener.close()
+            self._raw_listener = None
+
+    async def _syn_sweep(self, addresses: List[str], ports: Sequence[int], until: float | None = None) -> Dict[str, SweepStates] | None:
+        """Half-open sweep of every address at once, ending by `until`; None when raw sockets are unavailable."""
+        listener = self._raw_tcp_listener()
+        if listener is None:
+            logger.error("Falling back to connect scanning")
+            return None
+        timeout = max((self._timing.timeout_for(address) for address in addresses), default=self.connect_timeout)
+        scanner = SynScanner(timeout=timeout, retries=self.max_retries, listener=listener, rate=self._scheduler.rate)
+        states = await scanner.scan(addresses, ports, until=until)
+        return {address: SweepStates(states[address], scanner.closed.get(address, 0), scanner.timed_out) for address in addresses}
+
+    async def _udp_sweep(self, addresses: List[str], ports: Sequence[int], until: float | None = None) -> Dict[str, SweepStates]:
+        """UDP sweep of every address at once over a single socket, ending by `until`; needs no privileges."""
+        timeout = max((self._timing.timeout_for(address) for address in addresses), default=self.connect_timeout)
+        scanner = UDPScanner(self._services, timeout=timeout, retries=self.max_retries, rate=self._scheduler.rate)
+        records = await scanner.scan(addresses, ports, until=until)
+        return {address: SweepStates(records[address], scanner.closed.get(address, 0), scanner.timed_out) for address in addresses}
+
+    async def _describe_syn_results(self, address: str, port_states: Dict[int, str], deadline: HostDeadline | None = None,
+                                    phases: PhaseTimer | None = None) -> List[Dict[str, Any]]:
+        open_ports = sorted(port for port, port_state in port_states.items() if port_state == 'open')
+        records: Dict[int, Dict[str, Any]] = {}
+
+        async def describe(port: int) -> None:
+            records[port] = await self._describe_in_slot(address, port, deadline=deadline, phases=phases)
+
+        await _run_bounded(open_ports, self._scheduler.per_host, describe)
+        return [records[port] for port in open_ports]
+
+    async def _sample_host(self, target: str, address: str, ports: Sequence[int], deadline: HostDeadline,
+                           ) -> Tuple[bool, Dict[int, Dict[str, Any] | None], Dict[int, socket.socket]]:
+        """Probe a random sample of `ports` plus canary ports before the sweep.
+
+        Returns whether the host looks like an accept-all middlebox, the records of the sampled
+        ports of `ports` (canaries outside them are left out) and, unless it is accept-all, the
+        connections of its open ports, kept for their description. Open
+        ports are not described yet.
+        """
+        sample, canaries = self._accept_all.plan(ports)
+        if not sample:
+            return False, {}, {}
+        kept = set(sample).union(port for port in canaries if port in ports)
+        connections: Dict[int, socket.socket] = {}
+
+        def keep(port: int) -> Callable[[socket.socket], Dict[str, Any]]:
+            def opened(conn: socket.socket) -> Dict[str, Any]:
+                # Beyond the descriptors set aside for them, connections are closed and redialled later
+                if port in kept and self._held < self._held_budget:
+                    self._held += 1
+                    connections[port] = conn
+                else:
+                    conn.close()
+                return {'port': port, 'state': 'open'}
+            return opened
+
+        try:
+            records = await asyncio.gather(*[self.scan_port(address, port, deadline, opened=keep(port))
+                                             for port in sample + canaries])
+        except BaseException:
+            self._close_held(connections)
+            raise
+        accept_all = self._accept_all.is_accept_all(records[:len(sample)], records[len(sample):])
+        if accept_all:
+            self._close_held(connections)
+            opened = sum(1 for record in records[:len(sample)] if record and record['state'] == 'open')
+            logger.warning(f"{target} accepted {opened} of {len(sample)} sampled ports and all {len(canaries)} canary ports; "
+                           f"treating it as filtered by an accept-all device and skipping the remaining {len(ports) - len(sample)} ports")
+        return accept_all, {port: record for port, record in zip(sample + canaries, records) if port in kept}, connections
+
+    def _take_held(self, connections: Dict[int, socket.socket], port: int) -> socket.socket | None:
+        """The kept connection of `port`, now owned by the caller; None when it was not kept."""
+        conn = connections.pop(port, None)
+        if conn is not None:
+            self._held -= 1
+        return conn
+
+    def _close_held(self, connections: Dict[int, socket.socket]) -> None:
+        for conn in connections.values():
+            conn.close()
+        self._held -= len(connections)
+        connections.clear()
+
     @staticmethod
     def get_common_ports() -> List[int]:
         return [21, 22, 23, 25, 53, 80, 110, 111, 135, 139, 143, 443, 445, 993, 995, 1723, 3306, 3389, 5900, 8080]
 
-    async def scan(self, targets: List[str], ports: str) -> List[ScanResult]:
-        results = []
-        start_port, end_port = map(int, ports.split('-'))
-        common_ports = self.get_common_ports()
-        for target in targets:
-            logger.info(f"Scanning target: {target}")
-            start_time = time.time()
-            state = 'up'  # Assume the host is up if we can scan it
-            open_ports = []
-            
-            # Scan common ports first
-            common_port_tasks = [self.scan_port(target, port) for port in common_ports if start_port <= port <= end_port]
-            common_port_results = await asyncio.gather(*common_port_tasks)
-            open_ports.extend([result for result in common_port_results if result])
-            
-            # Scan remaining ports
-            remaining_ports = [port for port in range(start_port, end_port + 1) if port not in common_ports]
-            remaining_port_tasks = [self.scan_port(target, port) for port in remaining_ports]
-            remaining_port_results = await asyncio.gather(*remaining_port_tasks)
-            open_ports.extend([result for result in remaining_port_results if result])
-            
-            scan_time = time.time() - start_time
-            os_guess = await self._get_os_guess(target)
-            
-            # Check if a large percentage of ports are reported as open
-            total_ports = end_port - start_port + 1
-            open_percentage = len(open_ports) / total_ports * 100
-            logger.info(f"Open ports: {len(open_ports)}, Total ports: {total_ports}, Open percentage: {open_percentage:.2f}%")
-            if open_percentage > 70:
+    async def _scan_host(self, target: str, address: str, host_state: str, port_states: SweepStates | None,
+                         port_spec: PortSpec, emit: Callable[[PortFinding], Awaitable[None]],
+                         progress: HostProgress | None = None,
+                         udp_records: SweepStates | None = None,
+                         phases: PhaseTimer | None = None, details: PortDetailTable | None = None) -> ScanResult:
+        if host_state == 'down':
+            logger.info(f"Skipping {target}: host did not answer discovery probes")
+            return ScanResult(host=target, state='down', ports=[], scan_time=0.0, os_guess='Unknown (host down)')
+        if host_state == 'unresolved':
+            return ScanResult(host=target, state='down', ports=[], scan_time=0.0, os_guess='Unknown (unresolved)')
+        if host_state == 'timeout':
+            logger.info(f"Skipping {target}: discovery ran out of time before the host answered")
+            return ScanResult(host=target, state='down', ports=[], scan_time=0.0, os_guess='Unknown (discovery timed out)',
+                              timed_out=['discovery'])
+        logger.info(f"Scanning target: {target}")
+        start_time = time.time()
+        phases = phases or PhaseTimer()
+        deadline = HostDeadline(self.host_timeout, self.phase_timeouts)
+        if any(sweep is not None and sweep.timed_out for sweep in (port_states, udp_records)):
+            deadline.expire('ports')
+        state = 'up'
+        total_ports = len(port_spec) + len(port_spec.udp_ports)
+        open_ports = []
+
+        if port_states is not None:
+            port_counts = _count_syn_states(port_states, len(port_spec))
+            # The sweep already saw every port; an accept-all host is not worth service detection
+            if len(port_spec) and port_counts['open'] / len(port_spec) > self.filtered_open_ratio:
                 state = 'filtered'
-                logger.warning(f"{open_percentage:.2f}% of ports reported as open for {target}. This may indicate a firewall or other protective measure.")
-                open_ports = []  # Clear the list of open ports for filtered hosts
-            
-            result = ScanResult(host=target, state=state, ports=open_ports, scan_time=scan_time, os_guess=os_guess)
-            logger.info(f"Scan completed for {target}. Time taken: {scan_time:.2f} seconds. State: {state}")
-            results.append(result)
-        
-        return results
+                logger.warning(f"{port_counts['open']} of {len(port_spec)} ports answered the SYN sweep of {target}; "
+                               f"treating it as filtered and skipping service detection")
+            else:
+                open_ports = await self._describe_syn_results(address, port_states.ports, deadline, phases)
+                for record in open_ports:
+                    await emit(PortFinding(target, record))
+        else:
+            phases.start('ports')
+            port_counts = dict.fromkeys(PORT_STATES, 0)
 
-    def _get_service_name(self, port: int) -> str:
-        common_ports = {
-            80: 'http', 443: 'https', 22: 'ssh', 21: 'ftp',
-            25: 'smtp', 110: 'pop3', 143: 'imap', 53: 'dns'
-        }
-        return common_ports.get(port, 'unknown')
+            async def probe(port: int) -> None:
+                record = await self.scan_port(address, port, deadline, phases=phases)
+                if record:
+                    port_counts[record['state']] += 1
+                    if record['state'] == 'open':
+                        open_ports.append(record)
+                        await emit(PortFinding(target, record))
+                if progress is not None:
+                    progress.port_done(port, record)
+
+            # Port ranges finished before a resume are taken from the checkpoint
+            def pending(port: int) -> bool:
+                return progress is None or not progress.is_finished(port)
+
+            if progress is not None:
+                open_ports.extend(progress.open_ports)
+                for record in progress.open_ports:
+                    await emit(PortFinding(target, record))
+
+            common_ports = [port for port in self.get_common_ports() if port in port_spec and pending(port)]
+            # Every port still to scan, kept as compact as the spec's own array
+            ports = port_spec.tcp_ports if progress is None else array('H', filter(pending, port_spec.tcp_ports))
+
+            # A random sample goes first, so an accept-all device is recognised before the whole sweep
+            accept_all, sampled, connections = await self._sample_host(target, address, ports, deadline)
+            if accept_all:
+                # Not journaled: a resumed scan samples the host again rather than restoring a verdict
+                state = 'filtered'
+                common_ports, ports = [], []
+            elif sampled:
+                async def describe(port: int) -> None:
+                    # Over the sample's own connection, when it was kept
+                    sock = self._take_held(connections, port)
+                    record = sampled[port] = await self._describe_in_slot(address, port, sock, deadline, phases)
+                    open_ports.append(record)
+                    await emit(PortFinding(target, record))
 
-    async def _get_os_guess(self, target: str) -> str:
+                try:
+                    await _run_bounded([port for port, record in sampled.items() if record and record['state'] == 'open'],
+                                       self._scheduler.per_host, describe)
+                finally:
+                    self._close_held(connections)
+                if progress is not None:
+                    for port, record in sampled.items():
+                        progress.port_done(port, record)
+            for port_state, count in _count_port_states(list(sampled.values())).items():
+                port_counts[port_state] += count
+
+            # Common ports first, then the rest in the spec's order; a fixed pool of workers pulls them
+            # one at a time, so memory grows with the probes in flight rather than with the ports
+            first = set(common_ports)
+            sweep = itertools.chain((port for port in common_ports if port not in sampled),
+                                    (port for port in ports if port not in first and port not in sampled))
+            await _run_bounded(sweep, self._scheduler.per_host, probe)
+            if progress is not None:
+                for port_state, count in progress.port_counts.items():
+                    port_counts[port_state] += count
+            phases.stop('ports')
+
+        if udp_records is not None:
+            # The batch's UDP sweep already ran; silent ports are open|filtered
+            for port, record in sorted(udp_records.ports.items()):
+                port_counts[record['state']] += 1
+                if record['state'] == 'open':
+                    open_ports.append(record)
+                    await emit(PortFinding(target, record))
+            port_counts['closed'] += udp_records.closed
+            port_counts['open|filtered'] = len(port_spec.udp_ports) - len(udp_records.ports) - udp_records.closed
+
+        tcp_open = [record['port'] for record in open_ports if record.get('protocol', 'tcp') == 'tcp']
+        if self.os_detection and not tcp_open:
+            # A closed port answers with a bare RST, which says too little to fingerprint
+            os_guess = OS_NO_OPEN_PORT
+        elif self.os_detection:
+            with phases.measure('os'):
+                os_guess = await self._get_os_guess(address, tcp_open[0], deadline)
+        else:
+            os_guess = OS_NOT_PROBED
+        scan_time = time.time() - start_time
+
+        # Check if a large percentage of ports are reported as open; only TCP, as a UDP port is open only if it answered
+        open_percentage = len(tcp_open) / len(port_spec) * 100 if len(port_spec) else 0.0
+        logger.info(f"Open ports: {len(open_ports)}, Total ports: {total_ports}, Open TCP percentage: {open_percentage:.2f}%")
+        if open_percentage > self.filtered_open_ratio * 100:
+            state = 'filtered'
+            logger.warning(f"{open_percentage:.2f}% of ports reported as open for {target}. This may indicate a firewall or other protective measure.")
+            open_ports = []  # Clear the list of open ports for filtered hosts
+
+        result = ScanResult(host=target, state=state, ports=open_ports, scan_time=scan_time, os_guess=os_guess,
+                            port_counts=port_counts, timed_out=deadline.timed_out, details=details)
+        if deadline.timed_out:
+            logger.warning(f"{target} ran out of time in phase(s) {', '.join(deadline.timed_out)}; its results are partial")
+        logger.info(f"Scan completed for {target}. Time taken: {scan_time:.2f} seconds. State: {state}")
+        return result
+
+    async def _iter_scan_indexed(self, targets: Iterable[str], ports: str | PortSpec,
+                                 checkpoint: ScanCheckpoint | None = None) -> AsyncIterator[Tuple[int, PortFinding | ScanResult]]:
+        port_spec = parse_ports(ports)
+        # Bounded, so a slow consumer applies backpressure instead of letting findings pile up
+        events: asyncio.Queue = asyncio.Queue(maxsize=1024)
+        finished = object()
+        # The scan's results share one table of port details, which goes away with them
+        details = PortDetailTable()
+
+        async def scan_one(index: int, target: str, address: str, host_state: str,
+                           port_states: SweepStates | None, udp_records: SweepStates | None,
+                           hostname: str | None, phases: PhaseTimer) -> None:
+            async def emit(finding: PortFinding) -> None:
+                await events.put((index, finding))
+            progress = checkpoint.track(index, port_spec.tcp_ports) if checkpoint is not None and port_states is None else None
+            result = await self._scan_host(target, address, host_state, port_states, port_spec, emit, progress, udp_records,
+                                           phases, details)
+            result.hostname = hostname
+            result.timings = phases.durations
+            if checkpoint is not None:
+                checkpoint.record_host(index, result.to_dict())
+            await events.put((index, result))
+
+        async def produce() -> None:
+            host_slots = asyncio.Semaphore(self.max_concurrent_hosts)
+            running = set()
+            # Hosts a resumed checkpoint already finished keep their index but are not scanned again
+            indexed = ((index, target) for index, target in enumerate(targets)
+                       if checkpoint is None or not checkpoint.is_done(index))
+            try:
+                for batch in _batched(indexed, self.batch_size):
+                    addresses, host_states, syn_states, udp_states, hostnames, batch_times = await self._prepare_batch(
+                        [target for _, target in batch], port_spec)
+                    prepared = time.monotonic()
+                    for index, target in batch:
+                        address = addresses[target]
+                        port_states = syn_states.get(address, SweepStates({}, 0)) if syn_states is not None else None
+                        udp_records = udp_states.get(address, SweepStates({}, 0)) if udp_states is not None else None
+                        await host_slots.acquire()
+                        # Queue time is the wait for a host slot once the batch was ready
+                        phases = PhaseTimer(batch_times)
+                        phases.add('queue', time.monotonic() - prepared)
+                        task = asyncio.create_task(scan_one(index, target, address, host_states[address], port_states,
+                                                            udp_records, hostnames.get(address), phases))
+                        task.add_done_callback(lambda _: host_slots.release())
+                        running.add(task)
+                        task.add_done_callback(running.discard)
+                    # Surface failures from finished hosts instead of scanning on silently
+                    for task in [task for task in running if task.done()]:
+                        task.result()
+                await asyncio.gather(*running)
+            finally:
+                for task in running:
+                    task.cancel()
+                await events.put((None, finished))
+
+        if checkpoint is not None:
+            for index, result in checkpoint.completed():
+                yield index, ScanResult.from_dict(result, details)
+        await self._scan_slots.acquire()
+        self._active_scans += 1
+        producer = asyncio.create_task(produce())
         try:
-            logger.info(f"Starting OS detection for {target}")
-            target_ip = await asyncio.get_event_loop().run_in_executor(None, socket.gethostbyname, target)
-            logger.info(f"Resolved {target} to IP: {target_ip}")
-            
-            s = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
-            s.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
-            s.settimeout(2)
-            logger.info("Socket created successfully")
-            
-            # Construct and send the packet
-            packet = self._create_syn_packet(target_ip)
-            await asyncio.get_event_loop().run_in_executor(None, s.sendto, packet, (target_ip, 0))
-            logger.info("Packet sent successfully")
-            
-            # Receive the response
-            data, addr = await asyncio.wait_for(
-                asyncio.get_event_loop().run_in_executor(None, s.recvfrom, 1024),
-                timeout=2
-            )
-            logger.info(f"Response received from {addr}")
-            
-            # Extract information from the response
-            ip_header = data[:20]
-            tcp_header = data[20:40]
-            
-            ttl = struct.unpack('!B', ip_header[8:9])[0]
-            window_size = struct.unpack('!H', tcp_header[14:16])[0]
-            options = data[40:]
-            
-            logger.info(f"Extracted TTL: {ttl}, Window Size: {window_size}")
-            logger.info(f"TCP Options: {options.hex()}")
-            
-            os_guess = self._guess_os(ttl, window_size, options)
-            logger.info(f"OS Guess for {target}: {os_guess}")
-            return os_guess
-            
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout during OS detection for {target}")
-            return "Unknown (Timeout)"
-        except Exception as e:
-            logger.error(f"Error in OS detection for {target}: {str(e)}")
-            return "Unknown (Error)"
+            while True:
+                index, event = await events.get()
+                if event is finished:
+                    break
+                yield index, event
+            await producer  # Re-raise anything the producer hit
+        finally:
+            if not producer.done():
+                producer.cancel()
+            self._active_scans -= 1
+            if not self._active_scans:
+                self._close_raw_listener()
+            self._scan_slots.release()
+
+    async def iter_scan(self, targets: Iterable[str], ports: str | PortSpec,
+                        checkpoint: ScanCheckpoint | None = None) -> AsyncIterator[PortFinding | ScanResult]:
+        """Scan incrementally: yields a PortFinding for every open port as it is found and a
+        ScanResult for every host as soon as it completes (in completion order).
+
+        A host later judged 'filtered' may already have produced port findings; its
+        ScanResult is authoritative. With a `checkpoint`, progress is journaled as it is
+        made; a resumed checkpoint's finished hosts are yielded first and not scanned again.
+        """
+        async for _, event in self._iter_scan_indexed(targets, ports, checkpoint):
+            yield event
+
+    async def scan(self, targets: Iterable[str], ports: str | PortSpec) -> List[ScanResult]:
+        results = []
+        async for index, event in self._iter_scan_indexed(targets, ports):
+            if isinstance(event, ScanResult):
+                results.append((index, event))
+        return [result for _, result in sorted(results, key=lambda item: item[0])]
+
+    def _get_service_name(self, port: int) -> str:
+        return self._services.service_name(port)
 
-    def _create_syn_packet(self, dest_ip: str) -> bytes:
-        # IP header fields
-        ip_ihl = 5
-        ip_ver = 4
-        ip_tos = 0
-        ip_tot_len = 20 + 20  # IP header + TCP header
-        ip_id = 54321
-        ip_frag_off = 0
-        ip_ttl = 255
-        ip_proto = socket.IPPROTO_TCP
-        ip_check = 0
-        ip_saddr = socket.inet_aton('0.0.0.0')
-        ip_daddr = socket.inet_aton(dest_ip)
-        
-        ip_ihl_ver = (ip_ver << 4) + ip_ihl
-        ip_header = struct.pack('!BBHHHBBH4s4s', ip_ihl_ver, ip_tos, ip_tot_len, ip_id, ip_frag_off, ip_ttl, ip_proto, ip_check, ip_saddr, ip_daddr)
-        
-        # TCP header fields
-        tcp_source = 54321
-        tcp_dest = 80
-        tcp_seq = 0
-        tcp_ack_seq = 0
-        tcp_doff = 5
-        tcp_fin = 0
-        tcp_syn = 1
-        tcp_rst = 0
-        tcp_psh = 0
-        tcp_ack = 0
-        tcp_urg = 0
-        tcp_window = socket.htons(5840)
-        tcp_check = 0
-        tcp_urg_ptr = 0
-        
-        tcp_offset_res = (tcp_doff << 4) + 0
-        tcp_flags = tcp_fin + (tcp_syn << 1) + (tcp_rst << 2) + (tcp_psh << 3) + (tcp_ack << 4) + (tcp_urg << 5)
-        
-        tcp_header = struct.pack('!HHLLBBHHH', tcp_source, tcp_dest, tcp_seq, tcp_ack_seq, tcp_offset_res, tcp_flags, tcp_window, tcp_check, tcp_urg_ptr)
-        
-        return ip_header + tcp_header
-
-    def _guess_os(self, ttl: int, window_size: int, options: bytes) -> str:
-        mss = self._extract_mss(options)
-        
-        if ttl == 56:
-            return f"Possible CDN or Load Balancer (Facebook/Google infrastructure) - Window Size: {window_size}"
-        elif ttl == 64:
-            if window_size == 65535:
-                return "FreeBSD or OpenBSD"
-            elif window_size in [5840, 14600, 29200]:
-                return "Linux (kernel 2.4 and 2.6)"
-            elif window_size == 16384:
-                return "macOS (OS X)"
-            elif window_size == 512:
-                return "Linux (possibly virtualized)"
-            elif window_size == 53270:
-                return "Linux (possibly localhost)"
-        elif ttl == 128:
-            if window_size == 65535:
-                return "Windows Server 2008, Vista, or 7"
-            elif window_size == 8192:
-                return "Windows 2000 or XP"
-            elif window_size == 16384:
-                return "Windows 2003 or 2008"
-        elif ttl == 255:
-            if window_size == 65535:
-                return "Solaris or AIX"
-            elif window_size == 4128:
-                return "Cisco IOS"
-            elif window_size == 53270:
-                return "Linux (localhost)"
-        
-        if mss:
-            if mss == 1460:
-                return f"Ethernet MTU (Windows or Linux) - TTL: {ttl}, Window Size: {window_size}"
-            elif mss == 1380:
-                return f"OpenBSD or NetBSD (Ethernet) - TTL: {ttl}, Window Size: {window_size}"
-            elif mss == 1440:
-                return f"Google server (GWS) - TTL: {ttl}, Window Size: {window_size}"
-        
-        return f"Unknown OS (TTL: {ttl}, Window Size: {window_size}, MSS: {mss if mss else 'N/A'})"
-
-    def _extract_mss(self, options: bytes) -> int:
-        i = 0
-        while i < len(options) and i < 40:  # Limit to first 40 bytes to avoid application data
-            opt_type = options[i]
-            if opt_type == 0:  # End of options
-                break
-            if opt_type == 1:  # NOP
-                i += 1
-                continue
-            if i + 1 >= len(options):
-                break
-            opt_length = options[i+1]
-            if opt_type == 2 and opt_length == 4 and i + 3 < len(options):  # MSS option
-                return struct.unpack('!H', options[i+2:i+4])[0]
-            i += opt_length if opt_length > 1 else 1
-        return 0
-
-    async def _get_os_guess(self, target: str) -> str:
+    async def _get_os_guess(self, target: str, port: int = 80, deadline: HostDeadline | None = None) -> str:
+        """Fingerprint the SYN/ACK that target:port answers a raw SYN with and look it up in the OS database.
+
+        `target` must be an address. The probe goes through the scan's shared raw listener, so
+        any number of hosts can be fingerprinted at once without extra sockets or threads.
+        """
+        listener = self._raw_tcp_listener()
+        if listener is None:
+            return "Unknown (requires root)"
+        if deadline is not None and deadline.expired('os'):
+            return "Unknown (Timeout)"
         try:
             logger.info(f"Starting OS detection for {target}")
-            target_ip = await asyncio.get_event_loop().run_in_executor(None, socket.gethostbyname, target)
-            logger.info(f"Resolved {target} to IP: {target_ip}")
-            
-            s = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
-            s.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
-            s.settimeout(2)
-            logger.info("Socket created successfully")
-            
-            # Construct and send the packet
-            packet = self._create_syn_packet(target_ip)
-            await asyncio.get_event_loop().run_in_executor(None, s.sendto, packet, (target_ip, 0))
-            logger.info("Packet sent successfully")
-            
-            # Receive the response
-            data, addr = await asyncio.wait_for(
-                asyncio.get_event_loop().run_in_executor(None, s.recvfrom, 1024),
-                timeout=2
-            )
-            logger.info(f"Response received from {addr}")
-            
-            # Extract information from the response
-            ip_header = data[:20]
-            tcp_header = data[20:40]
-            
-            ttl = struct.unpack('!B', ip_header[8:9])[0]
-            window_size = struct.unpack('!H', tcp_header[14:16])[0]
-            options = data[40:]
-            
-            logger.info(f"Extracted TTL: {ttl}, Window Size: {window_size}")
-            logger.info(f"TCP Options: {options[:40].hex()}")  # Log only first 40 bytes of options
-            
-            os_guess = self._guess_os(ttl, window_size, options)
+            src_ip = source_address_for(target)
+            src_port = listener.allocate_port()
+            seq = random.getrandbits(32)
+            # Offer the common options so the reply shows which ones the stack supports and in what order
+            packet = ip_packet(src_ip, target, tcp_segment(src_ip, target, src_port, port, seq,
+                                                           window=64240, options=OS_PROBE_OPTIONS),
+                               ident=random.getrandbits(16))
+            reply = listener.expect(target, port, src_port, (seq + 1) & 0xffffffff)
+            try:
+                await listener.send(packet, target)
+                timeout = self._timing.timeout_for(target)
+                answer = await asyncio.wait_for(reply, timeout=deadline.bound('os', timeout) if deadline is not None else timeout)
+            finally:
+                reply.cancel()
+
+            if answer.flags & TCP_RST:
+                logger.info(f"{target}:{port} answered the OS probe with an RST; not fingerprinting it")
+                return OS_NO_OPEN_PORT
+            fingerprint = fingerprint_from_reply(answer)
+            logger.info(f"Fingerprint for {target}: {fingerprint}")
+            matches = self._os_db.match(fingerprint)
+            if not matches:
+                return describe_fingerprint(fingerprint)
+            logger.debug(f"OS candidates for {target}: {', '.join(str(match) for match in matches)}")
+            os_guess = str(matches[0])
             logger.info(f"OS Guess for {target}: {os_guess}")
             return os_guess
-            
+
         except asyncio.TimeoutError:
             logger.warning(f"Timeout during OS detection for {target}")
             return "Unknown (Timeout)"
@@ -375,84 +712,201 @@ class Scanner:
             logger.error(f"Error in OS detection for {target}: {str(e)}")
             return "Unknown (Error)"
 
-async def run_scan(targets: List[str], ports: str) -> List[ScanResult]:
-    scanner = Scanner()
-    async def scan_target(target: str) -> ScanResult:
-        logger.info(f"Scanning target: {target}")
-        start_time = time.time()
-        state = 'up'  # Assume the host is up if we can scan it
-        start_port, end_port = map(int, ports.split('-'))
-        
-        port_tasks = [scanner.scan_port(target, port) for port in range(start_port, end_port + 1)]
-        port_results = await asyncio.gather(*port_tasks)
-        open_ports = [result for result in port_results if result and result['state'] == 'open']
-        
-        scan_time = time.time() - start_time
-        os_guess = await scanner._get_os_guess(target)
-        
-        # Check if a large percentage of ports are reported as open
-        total_ports = end_port - start_port + 1
-        open_percentage = len(open_ports) / total_ports * 100
-        logger.info(f"Open ports: {len(open_ports)}, Total ports: {total_ports}, Open percentage: {open_percentage:.2f}%")
-        if open_percentage > 70:
-            state = 'filtered'
-            logger.warning(f"{open_percentage:.2f}% of ports reported as open for {target}. This may indicate a firewall or other protective measure.")
-            open_ports = []  # Clear the list of open ports for filtered hosts
-        
-        result = ScanResult(host=target, state=state, ports=open_ports, scan_time=scan_time, os_guess=os_guess)
-        logger.info(f"Scan completed for {target}. Time taken: {scan_time:.2f} seconds. State: {state}")
-        return result
-
-    return await asyncio.gather(*[scan_target(target) for target in targets])
+async def run_scan(targets: Iterable[str], ports: str | PortSpec, scan_mode: str = 'connect', discovery: bool = True) -> List[ScanResult]:
+    scanner = Scanner(scan_mode=scan_mode, discovery=discovery)
+    return await scanner.scan(targets, ports)
 
 def save_results_to_file(results: List[ScanResult], filename: str):
     with open(filename, 'w') as f:
         json.dump([result.to_dict() for result in results], f, indent=2)
     logger.info(f"Scan results saved to {filename}")
 
+class NDJSONWriter:
+    """Writes scan events as newline-delimited JSON, one object per line, flushed per host."""
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+
+    def write(self, event: PortFinding | ScanResult) -> None:
+        record = {'type': 'port' if isinstance(event, PortFinding) else 'host', **event.to_dict()}
+        self.stream.write(json.dumps(record, separators=(',', ':')) + '\n')
+        if isinstance(event, ScanResult):
+            self.stream.flush()
+
+def load_results_from_file(filename: str) -> List[ScanResult]:
+    """Read results written either as a JSON array or as NDJSON host records."""
+    with open(filename, 'r') as f:
+        content = f.read()
+    details = PortDetailTable()
+    if content.lstrip().startswith('['):
+        return [ScanResult.from_dict(item, details) for item in json.loads(content)]
+    results = []
+    for line in content.splitlines():
+        if line.strip():
+            record = json.loads(line)
+            if record.pop('type', 'host') == 'host':
+                results.append(ScanResult.from_dict(record, details))
+    return results
+
+def print_phase_report(report: PhaseReport) -> None:
+    """Mean phase times per network segment, with the phase that dominates each."""
+    rows = report.rows()
+    if not rows:
+        return
+    print("Mean phase times per segment (seconds):")
+    print(f"  {'segment':<24} {'hosts':>6} " + ' '.join(f"{phase:>9}" for phase in PHASES) + "  dominant")
+    for row in rows:
+        print(f"  {row['segment']:<24} {row['hosts']:>6} " + ' '.join(f"{row['phases'].get(phase, 0.0):>9.3f}" for phase in PHASES)
+              + f"  {row['dominant']}")
+
+def print_scan_result(result: ScanResult, ports: PortSpec) -> None:
+    print(f"Host: {result.host}")
+    if result.hostname:
+        print(f"Hostname: {result.hostname}")
+    print(f"State: {result.state}")
+    if result.state == 'down':
+        if result.os_guess == 'Unknown (unresolved)':
+            print("  Host name could not be resolved; scan skipped")
+        elif 'discovery' in result.timed_out:
+            print("  Discovery ran out of time before the host answered; port scan skipped")
+        else:
+            print("  Host did not answer discovery probes; port scan skipped")
+        print("---")
+        return
+    if result.state == 'filtered':
+        print("  Host appears to be filtered (firewall or other protective measure)")
+        print(f"Open ports: N/A (filtered)")
+    else:
+        print(f"Open ports: {len(result.ports)}")
+        if result.ports:
+            for port in result.ports:
+                protocol = port.get('protocol', 'tcp')
+                if 'service' in port:
+                    print(f"  {port['port']}/{protocol} - {port['service']}")
+                else:
+                    print(f"  {port['port']}/{protocol} - unknown")
+        else:
+            print("  No open ports found")
+    total_ports = len(ports) + len(ports.udp_ports)
+    print(f"Total ports scanned: {total_ports}")
+    if result.port_counts:
+        print(f"Closed ports: {result.port_counts['closed']}, Filtered ports: {result.port_counts['filtered']}")
+        if 'open|filtered' in result.port_counts:
+            print(f"Open|filtered UDP ports (no answer): {result.port_counts['open|filtered']}")
+    if result.state != 'filtered':
+        open_percentage = len(result.ports) / total_ports * 100 if total_ports else 0.0
+        print(f"Percentage of open ports: {open_percentage:.2f}%")
+    print(f"Scan time: {result.scan_time:.2f} seconds")
+    if result.timings:
+        print(f"Phase times: {', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in result.timings.items() if seconds)}")
+    print(f"OS guess: {result.os_guess}")
+    if result.timed_out:
+        print(f"Timed out during: {', '.join(result.timed_out)} (results are partial)")
+    print("---")
+
 async def main():
     parser = argparse.ArgumentParser(description="Network Scanner")
-    parser.add_argument("-t", "--targets", nargs="+", default=["localhost"], help="List of targets to scan")
-    parser.add_argument("-p", "--ports", default="1-100", help="Port range to scan (e.g., '1-100' or '1-1000')")
-    parser.add_argument("-o", "--output", help="Output file to save results")
+    parser.add_argument("-t", "--targets", nargs="+", default=["localhost"], help="Targets to scan: addresses, hostnames, CIDR blocks (10.0.0.0/24), ranges (10.0.0.1-20) or @file")
+    parser.add_argument("-iL", "--target-file", help="File with one or more targets per line")
+    parser.add_argument("--exclude", nargs="+", default=[], help="Targets to leave out, in the same syntax as --targets")
+    parser.add_argument("--randomize-hosts", action="store_true", help="Scan targets in a random permutation to spread load across subnets")
+    parser.add_argument("-p", "--ports", default="1-100", help="Ports to scan (e.g., '1-100', '22,80,443,8000-8100', 'top-100', 'T:80,U:53')")
+    parser.add_argument("-s", "--scan-type", choices=SCAN_MODES, default="connect", help="Full TCP connect scan or raw SYN half-open scan (requires root)")
+    parser.add_argument("-sU", "--udp", action="store_true", help="Scan the ports over UDP (T: and U: prefixes in --ports still apply)")
+    parser.add_argument("-Pn", "--skip-discovery", action="store_true", help="Treat every target as up and skip host discovery")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Worker processes to shard the scan across (0 for one per CPU core)")
+    parser.add_argument("--shard-ports", action="store_true", help="Give each worker a share of the ports instead of a share of the targets")
+    parser.add_argument("-o", "--output", help="Output file to save results ('-' writes NDJSON to stdout)")
+    parser.add_argument("-f", "--output-format", choices=("json", "ndjson"), default="json", help="JSON array written at the end, or NDJSON streamed as results arrive")
+    parser.add_argument("--reverse-dns", action="store_true", help="Look up the host name of every live address")
+    parser.add_argument("--max-time", type=float, default=300, help="Stop the scan after this many seconds (0 for no limit)")
+    parser.add_argument("--host-timeout", type=float, help="Give up on a host after this many seconds, keeping what was found (0 for no limit)")
+    parser.add_argument("--checkpoint", help="Journal the scan's progress to this file so it can be resumed")
+    parser.add_argument("--resume", help="Continue the scan journaled in this checkpoint file")
+    parser.add_argument("--profile", help="Profile the scan with a sampling profiler and write collapsed stacks (for flame graphs) to this file")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output")
     args = parser.parse_args()
+    if (args.checkpoint or args.resume) and args.workers != 1:
+        parser.error("--checkpoint and --resume require a single worker")
 
-    targets = args.targets
-    ports = args.ports
-    logger.info(f"Starting scan with targets: {targets} and ports: {ports}")
-    
-    try:
-        results = await asyncio.wait_for(run_scan(targets, ports), timeout=300)  # 5 minutes timeout
-        for result in results:
-            print(f"Host: {result.host}")
-            print(f"State: {result.state}")
-            if result.state == 'filtered':
-                print("  Host appears to be filtered (firewall or other protective measure)")
-                print(f"Open ports: N/A (filtered)")
-            else:
-                print(f"Open ports: {len(result.ports)}")
-                if result.ports:
-                    for port in result.ports:
-                        if 'service' in port:
-                            print(f"  {port['port']}/tcp - {port['service']}")
-                        else:
-                            print(f"  {port['port']}/tcp - unknown")
-                else:
-                    print("  No open ports found")
-            print(f"Total ports scanned: {int(ports.split('-')[1]) - int(ports.split('-')[0]) + 1}")
-            if result.state != 'filtered':
-                open_percentage = len(result.ports) / (int(ports.split('-')[1]) - int(ports.split('-')[0]) + 1) * 100
-                print(f"Percentage of open ports: {open_percentage:.2f}%")
-            print(f"Scan time: {result.scan_time:.2f} seconds")
-            print(f"OS guess: {result.os_guess}")
-            print("---")
-
-        if args.output:
-            save_results_to_file(results, args.output)
+    checkpoint = None
+    if args.resume:
+        # The journal fixes what is scanned; targets and ports on the command line are ignored
+        checkpoint = ScanCheckpoint.resume(args.resume)
+        params = checkpoint.params
+        target_specs, exclude, seed = params['targets'], params['exclude'], params['seed']
+        args.ports, args.scan_type, args.skip_discovery = params['ports'], params['scan_type'], params['skip_discovery']
+    else:
+        target_specs = args.targets + ([f"@{args.target_file}"] if args.target_file else [])
+        exclude = args.exclude
+        seed = random.getrandbits(64) if args.randomize_hosts else None
+        if args.udp:
+            args.ports = f"U:{args.ports}"
+        if args.checkpoint:
+            checkpoint = ScanCheckpoint.create(args.checkpoint, {
+                'targets': target_specs, 'exclude': exclude, 'seed': seed, 'ports': args.ports,
+                'scan_type': args.scan_type, 'skip_discovery': args.skip_discovery})
+    targets = expand_targets(target_specs, exclude, randomize=seed is not None, seed=seed)
+    ports = parse_ports(args.ports)
+    logger.info(f"Starting scan with targets: {target_specs} and ports: {args.ports}")
+
+    streaming = args.output_format == 'ndjson' or args.output == '-'
+    to_stdout = args.output == '-'
+    output = None
+    if streaming and args.output:
+        output = sys.stdout if to_stdout else open(args.output, 'w')
+    writer = NDJSONWriter(output) if output else None
+    results = []
+    phase_report = PhaseReport()
+
+    if args.workers != 1:
+        from sharding import ShardedScanner
+        events = ShardedScanner(args.workers or None, shard_ports=args.shard_ports, profile=args.profile, scan_mode=args.scan_type,
+                                discovery=not args.skip_discovery, host_timeout=args.host_timeout,
+                                reverse_dns=args.reverse_dns or None).iter_scan(target_specs, ports, exclude,
+                                                                             randomize=args.randomize_hosts)
+    else:
+        events = Scanner(scan_mode=args.scan_type, discovery=not args.skip_discovery, host_timeout=args.host_timeout,
+                         reverse_dns=args.reverse_dns or None).iter_scan(targets, ports, checkpoint)
 
+    async def consume():
+        async for event in events:
+            if writer:
+                writer.write(event)
+            if isinstance(event, ScanResult):
+                phase_report.add(event.host, event.timings)
+                if not to_stdout:
+                    print_scan_result(event, ports)
+                if args.output and not streaming:
+                    results.append(event)
+
+    # Sharded workers log their own stats lines; this process only relays their results
+    interval = get_config('STATS_INTERVAL')
+    stats = asyncio.create_task(log_stats(interval)) if interval and args.workers == 1 else None
+    finished = False
+    try:
+        # With workers, the scanning happens (and is profiled) in the worker processes
+        async with profile(args.profile) if args.profile and args.workers == 1 else contextlib.nullcontext():
+            await asyncio.wait_for(consume(), timeout=args.max_time or None)
+        finished = True
     except asyncio.TimeoutError:
-        logger.error("Scan timed out after 5 minutes")
+        logger.error(f"Scan stopped after {args.max_time:g} seconds")
+    finally:
+        if stats is not None:
+            stats.cancel()
+            logger.info(METRICS.summary())
+        if args.verbose and not to_stdout:
+            print_phase_report(phase_report)
+        # Whatever finished is saved, also when the scan is cut short or fails
+        if args.output and not streaming:
+            save_results_to_file(results, args.output)
+        if checkpoint is not None:
+            checkpoint.close()
+            if not finished:
+                logger.info(f"Progress journaled to {checkpoint.path}; continue with --resume {checkpoint.path}")
+        if output and output is not sys.stdout:
+            output.close()
+            logger.info(f"Scan results streamed to {args.output}")
 
 if __name__ == '__main__':
     asyncio.run(main())
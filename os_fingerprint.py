@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import struct
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from packets import TCPReply
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FINGERPRINTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'os_fingerprints.json')
+
+# Initial TTLs in common use; an observed TTL is normalised up to the nearest one
+INITIAL_TTLS = (32, 64, 128, 255)
+
+# Feature weights for scoring; TTL is not scored because every candidate shares it through the index
+WEIGHTS = {'window': 3, 'options': 3, 'wscale': 2, 'mss': 1, 'df': 1}
+
+_OPTION_LETTERS = {0: 'E', 1: 'N', 2: 'M', 3: 'W', 4: 'S', 8: 'T'}
+
+class TCPFingerprint(NamedTuple):
+    """Features of a SYN/ACK that identify the responding TCP/IP stack."""
+    ttl: int
+    initial_ttl: int
+    window: int
+    options: str
+    mss: int | None
+    wscale: int | None
+    df: bool
+
+class OSMatch(NamedTuple):
+    name: str
+    os_class: str
+    confidence: float
+    distance: int
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.confidence:.0%})"
+
+def initial_ttl(ttl: int) -> int:
+    return next((initial for initial in INITIAL_TTLS if ttl <= initial), 255)
+
+def parse_options(options: bytes) -> Tuple[str, int | None, int | None]:
+    """Option order as letters (M=MSS, N=NOP, W=window scale, S=SACK permitted, T=timestamp, E=end),
+    plus the MSS and window scale values."""
+    letters: List[str] = []
+    mss = wscale = None
+    i = 0
+    while i < len(options):
+        kind = options[i]
+        letters.append(_OPTION_LETTERS.get(kind, f"?{kind}"))
+        if kind == 0:
+            break
+        if kind == 1:
+            i += 1
+            continue
+        if i + 1 >= len(options) or options[i + 1] < 2:
+            break  # Truncated or malformed option
+        length = options[i + 1]
+        if kind == 2 and length == 4:
+            mss = struct.unpack('!H', options[i + 2:i + 4])[0]
+        elif kind == 3 and length == 3:
+            wscale = options[i + 2]
+        i += length
+    return ','.join(letters), mss, wscale
+
+def fingerprint_from_reply(reply: TCPReply) -> TCPFingerprint:
+    """Fingerprint a parsed TCP reply of either address family; IPv6 hop limits stand in for the TTL."""
+    options, mss, wscale = parse_options(reply.options)
+    return TCPFingerprint(reply.ttl, initial_ttl(reply.ttl), reply.window, options, mss, wscale, reply.df)
+
+def _window_tokens(fingerprint: TCPFingerprint) -> List[str]:
+    """Index tokens for the window: its literal value and, when it is one, a multiple of the MSS."""
+    tokens = [str(fingerprint.window)]
+    if fingerprint.mss and fingerprint.window % fingerprint.mss == 0:
+        tokens.append(f"mss*{fingerprint.window // fingerprint.mss}")
+    return tokens
+
+class OSSignature:
+    __slots__ = ('name', 'os_class', 'ttl', 'windows', 'options', 'mss', 'wscale', 'df')
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.name = entry['name']
+        self.os_class = entry.get('class', entry['name'])
+        self.ttl = entry['ttl']
+        self.windows = frozenset(str(window) for window in entry.get('window', []))
+        self.options = entry.get('options')
+        self.mss = frozenset(entry['mss']) if 'mss' in entry else None
+        self.wscale = frozenset(entry['wscale']) if 'wscale' in entry else None
+        self.df = entry.get('df')
+
+    def score(self, fingerprint: TCPFingerprint, windows: Iterable[str]) -> float:
+        """Weighted share of features that agree; features the signature leaves open count as misses."""
+        score = 0
+        if self.windows and not self.windows.isdisjoint(windows):
+            score += WEIGHTS['window']
+        if self.options is not None and self.options == fingerprint.options:
+            score += WEIGHTS['options']
+        if self.wscale is not None and fingerprint.wscale in self.wscale:
+            score += WEIGHTS['wscale']
+        if self.mss is not None and fingerprint.mss in self.mss:
+            score += WEIGHTS['mss']
+        if self.df is not None and self.df == fingerprint.df:
+            score += WEIGHTS['df']
+        return score / sum(WEIGHTS.values())
+
+class OSFingerprintDB:
+    """Signatures indexed by (initial TTL, window) and by (initial TTL, option order).
+
+    A lookup touches only the index buckets the fingerprint falls into, so its cost depends
+    on how many signatures resemble the fingerprint rather than on the size of the database.
+    """
+
+    def __init__(self, signatures: List[OSSignature]):
+        self.signatures = signatures
+        self._by_window: Dict[Tuple[int, str], List[OSSignature]] = {}
+        self._by_options: Dict[Tuple[int, str], List[OSSignature]] = {}
+        for signature in signatures:
+            for window in signature.windows:
+                self._by_window.setdefault((signature.ttl, window), []).append(signature)
+            if signature.options is not None:
+                self._by_options.setdefault((signature.ttl, signature.options), []).append(signature)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'OSFingerprintDB':
+        with open(path, 'r') as f:
+            entries = json.load(f)
+        signatures = [OSSignature(entry) for entry in entries]
+        logger.info(f"Loaded {len(signatures)} OS fingerprints from {path}")
+        return cls(signatures)
+
+    def match(self, fingerprint: TCPFingerprint, limit: int = 3) -> List[OSMatch]:
+        """Ranked candidates for `fingerprint`, best first."""
+        ttl = fingerprint.initial_ttl
+        windows = _window_tokens(fingerprint)
+        candidates: Dict[int, OSSignature] = {}
+        for window in windows:
+            candidates.update((id(signature), signature) for signature in self._by_window.get((ttl, window), ()))
+        candidates.update((id(signature), signature) for signature in self._by_options.get((ttl, fingerprint.options), ()))
+        distance = fingerprint.initial_ttl - fingerprint.ttl
+        scored = [OSMatch(signature.name, signature.os_class, signature.score(fingerprint, windows), distance)
+                  for signature in candidates.values()]
+        scored.sort(key=lambda match: match.confidence, reverse=True)
+        return scored[:limit]
+
+@lru_cache(maxsize=4)
+def load_os_database(path: str = DEFAULT_FINGERPRINTS_FILE) -> OSFingerprintDB:
+    return OSFingerprintDB.from_file(path)
+
+def describe(fingerprint: TCPFingerprint) -> str:
+    return (f"Unknown OS (TTL: {fingerprint.ttl}, Window Size: {fingerprint.window}, "
+            f"Options: {fingerprint.options or 'none'})")
@@ -0,0 +1,157 @@
+import socket
+import struct
+from array import array
+from functools import lru_cache
+from typing import NamedTuple
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACH = 3
+ICMP_ECHO_REQUEST = 8
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+_IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+_TCP_HEADER = struct.Struct('!HHLLBBHHH')
+_PSEUDO_HEADER = struct.Struct('!4s4sBBH')
+_PSEUDO_HEADER6 = struct.Struct('!16s16sL3xB')
+_ICMP_ECHO = struct.Struct('!BBHHH')
+
+class TCPReply(NamedTuple):
+    src: str
+    src_port: int
+    dst_port: int
+    seq: int
+    ack: int
+    flags: int
+    window: int
+    ttl: int  # Hop limit for IPv6
+    options: bytes
+    df: bool = True
+
+class ICMPReply(NamedTuple):
+    src: str
+    type: int
+    code: int
+    ident: int
+    seq: int
+    ttl: int
+
+def address_family(address: str) -> int:
+    """AF_INET6 for IPv6 address literals, AF_INET otherwise."""
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+def _pseudo_header(src_ip: str, dst_ip: str, proto: int, length: int) -> bytes:
+    if address_family(dst_ip) == socket.AF_INET6:
+        return _PSEUDO_HEADER6.pack(socket.inet_pton(socket.AF_INET6, src_ip), socket.inet_pton(socket.AF_INET6, dst_ip),
+                                    length, proto)
+    return _PSEUDO_HEADER.pack(socket.inet_aton(src_ip), socket.inet_aton(dst_ip), 0, proto, length)
+
+def checksum(data: bytes) -> int:
+    """Internet checksum (RFC 1071) over `data`."""
+    if len(data) % 2:
+        data += b'\0'
+    words = array('H', data)
+    total = sum(words)
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    # array('H') reads native byte order; swap back on little-endian hosts
+    return socket.ntohs(~total & 0xffff)
+
+def tcp_segment(src_ip: str, dst_ip: str, src_port: int, dst_port: int, seq: int,
+                ack: int = 0, flags: int = TCP_SYN, window: int = 1024, options: bytes = b'') -> bytes:
+    """Build a TCP segment with a valid checksum over the IPv4 or IPv6 pseudo-header."""
+    if len(options) % 4:
+        options += b'\0' * (4 - len(options) % 4)
+    offset = (5 + len(options) // 4) << 4
+    header = _TCP_HEADER.pack(src_port, dst_port, seq, ack, offset, flags, window, 0, 0) + options
+    check = checksum(_pseudo_header(src_ip, dst_ip, socket.IPPROTO_TCP, len(header)) + header)
+    return header[:16] + struct.pack('!H', check) + header[18:]
+
+def ipv4_packet(src_ip: str, dst_ip: str, payload: bytes, proto: int = socket.IPPROTO_TCP,
+                ttl: int = 64, ident: int = 0) -> bytes:
+    """Wrap `payload` in an IPv4 header with its header checksum filled in."""
+    header = _IP_HEADER.pack((4 << 4) + 5, 0, 20 + len(payload), ident, 0, ttl, proto, 0,
+                             socket.inet_aton(src_ip), socket.inet_aton(dst_ip))
+    check = checksum(header)
+    return header[:10] + struct.pack('!H', check) + header[12:] + payload
+
+def ip_packet(src_ip: str, dst_ip: str, payload: bytes, proto: int = socket.IPPROTO_TCP,
+              ttl: int = 64, ident: int = 0) -> bytes:
+    """What a raw sender transmits for `payload`: a full IPv4 datagram, or for IPv6 the payload
+    alone, since the kernel always writes the IPv6 header of a raw socket's packets."""
+    if address_family(dst_ip) == socket.AF_INET6:
+        return payload
+    return ipv4_packet(src_ip, dst_ip, payload, proto, ttl, ident)
+
+def parse_tcp_reply(data: bytes) -> TCPReply | None:
+    """Parse an IPv4 datagram carrying TCP, as read from a raw IPPROTO_TCP socket."""
+    if len(data) < 20 or data[0] >> 4 != 4 or data[9] != socket.IPPROTO_TCP:
+        return None
+    ihl = (data[0] & 0x0f) * 4
+    df = bool(struct.unpack('!H', data[6:8])[0] & 0x4000)
+    return parse_tcp_segment(data[ihl:], socket.inet_ntoa(data[12:16]), data[8], df)
+
+def parse_tcp_segment(data: bytes, src: str, ttl: int, df: bool = True) -> TCPReply | None:
+    """Parse a bare TCP segment, as read from a raw IPv6 socket (which strips the IPv6 header).
+
+    IPv6 routers never fragment, which is what DF asks of IPv4 ones, so `df` defaults to set.
+    """
+    if len(data) < 20:
+        return None
+    src_port, dst_port, seq, ack, offset, flags, window, _, _ = _TCP_HEADER.unpack_from(data)
+    data_offset = (offset >> 4) * 4
+    return TCPReply(
+        src=src,
+        src_port=src_port,
+        dst_port=dst_port,
+        seq=seq,
+        ack=ack,
+        flags=flags,
+        window=window,
+        ttl=ttl,
+        options=data[20:data_offset],
+        df=df
+    )
+
+def icmp_echo(ident: int, seq: int, payload: bytes = b'', family: int = socket.AF_INET) -> bytes:
+    """ICMP (or ICMPv6) echo request; the kernel adds the IP header on a plain raw ICMP socket
+    and fills in the checksum of ICMPv6 messages itself."""
+    if family == socket.AF_INET6:
+        return _ICMP_ECHO.pack(ICMPV6_ECHO_REQUEST, 0, 0, ident, seq) + payload
+    header = _ICMP_ECHO.pack(ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    check = checksum(header + payload)
+    return header[:2] + struct.pack('!H', check) + header[4:] + payload
+
+def parse_icmp_reply(data: bytes) -> ICMPReply | None:
+    """Parse an IPv4 datagram carrying ICMP, as read from a raw IPPROTO_ICMP socket."""
+    if len(data) < 20 or data[0] >> 4 != 4 or data[9] != socket.IPPROTO_ICMP:
+        return None
+    ihl = (data[0] & 0x0f) * 4
+    if len(data) < ihl + 8:
+        return None
+    icmp_type, code, _, ident, seq = _ICMP_ECHO.unpack_from(data, ihl)
+    return ICMPReply(src=socket.inet_ntoa(data[12:16]), type=icmp_type, code=code, ident=ident, seq=seq, ttl=data[8])
+
+def parse_icmpv6_reply(data: bytes, src: str, hop_limit: int = 0) -> ICMPReply | None:
+    """Parse an ICMPv6 message, as read (without its IPv6 header) from a raw IPPROTO_ICMPV6 socket."""
+    if len(data) < 8:
+        return None
+    icmp_type, code, _, ident, seq = _ICMP_ECHO.unpack_from(data)
+    return ICMPReply(src=src, type=icmp_type, code=code, ident=ident, seq=seq, ttl=hop_limit)
+
+@lru_cache(maxsize=4096)
+def source_address_for(dst_ip: str) -> str:
+    """Local address the kernel would route from when talking to `dst_ip`."""
+    probe = socket.socket(address_family(dst_ip), socket.SOCK_DGRAM)
+    try:
+        probe.connect((dst_ip, 9))  # No packet is sent for a UDP connect
+        return probe.getsockname()[0]
+    finally:
+        probe.close()
@@ -0,0 +1,166 @@
+import logging
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_PORT = 65535
+
+# Most frequently open ports, most common first (after nmap-services frequencies)
+TOP_TCP_PORTS = [
+    80, 23, 443, 21, 22, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8080, 1723, 111, 995, 993, 5900,
+    1025, 587, 8888, 199, 1720, 465, 548, 113, 81, 6001, 10000, 514, 5060, 179, 1026, 2000, 8443, 8000, 32768, 554,
+    26, 1433, 49152, 2001, 515, 8008, 49154, 1027, 5666, 646, 5000, 5631, 631, 49153, 8081, 2049, 88, 79, 5800, 106,
+    2121, 1110, 49155, 6000, 513, 990, 5357, 427, 49156, 543, 544, 5101, 144, 7, 389, 8009, 3128, 444, 9999, 5009,
+    7070, 5190, 3000, 5432, 1900, 3986, 13, 1029, 9, 5051, 6646, 49157, 1028, 873, 1755, 2717, 4899, 9100, 119, 37,
+]
+TOP_UDP_PORTS = [
+    631, 161, 137, 123, 138, 1434, 445, 135, 67, 53, 139, 500, 68, 520, 1900, 4500, 514, 49152, 162, 69,
+    5353, 111, 49154, 1701, 998, 996, 997, 999, 3283, 49153, 1812, 136, 2222, 2049, 3278, 5060, 1025, 1433, 3456, 80,
+    20031, 1026, 7, 1646, 1645, 593, 518, 2048, 626, 1027,
+]
+
+class PortSpec:
+    """Compiled port specification: one bit per port and protocol.
+
+    Grammar (comma separated): single ports (80), ranges (1-1024, open-ended -1024 or 1024-),
+    `top-N` for the N most common ports, and `T:`/`U:` prefixes that switch the protocol
+    for the following items, as in "22,80,T:8000-8100,U:53,161,top-20".
+    Membership is an O(1) bit test and the sorted port arrays are built once.
+    """
+
+    def __init__(self, spec: str = ''):
+        self.spec = spec
+        self._bits = {'tcp': bytearray(MAX_PORT // 8 + 1), 'udp': bytearray(MAX_PORT // 8 + 1)}
+        self._ports = {}
+        if spec:
+            self._parse(spec)
+
+    def _add(self, protocol: str, first: int, last: int) -> None:
+        if not 1 <= first <= last <= MAX_PORT:
+            raise ValueError(f"Invalid port range {first}-{last} in '{self.spec}'")
+        bits = self._bits[protocol]
+        for port in range(first, last + 1):
+            bits[port >> 3] |= 1 << (port & 7)
+
+    def _parse(self, spec: str) -> None:
+        protocol = 'tcp'
+        for item in spec.replace(' ', '').split(','):
+            if not item:
+                continue
+            prefix, sep, rest = item.partition(':')
+            if sep:
+                if prefix.upper() not in ('T', 'U'):
+                    raise ValueError(f"Unknown protocol prefix '{prefix}:' in '{spec}'")
+                protocol = 'tcp' if prefix.upper() == 'T' else 'udp'
+                item = rest
+                if not item:
+                    continue
+            if item.lower().startswith('top-'):
+                top = TOP_TCP_PORTS if protocol == 'tcp' else TOP_UDP_PORTS
+                count = int(item[4:])
+                if count > len(top):
+                    logger.warning(f"Only {len(top)} top {protocol} ports are known; using all of them for '{item}'")
+                for port in top[:count]:
+                    self._add(protocol, port, port)
+            elif '-' in item:
+                first, _, last = item.partition('-')
+                self._add(protocol, int(first) if first else 1, int(last) if last else MAX_PORT)
+            else:
+                port = int(item)
+                self._add(protocol, port, port)
+
+    def __contains__(self, port: int) -> bool:
+        return self.has(port)
+
+    def has(self, port: int, protocol: str = 'tcp') -> bool:
+        return 0 < port <= MAX_PORT and bool(self._bits[protocol][port >> 3] & (1 << (port & 7)))
+
+    def ports(self, protocol: str = 'tcp') -> array:
+        """Sorted ports for `protocol` as a compact unsigned-short array."""
+        if protocol not in self._ports:
+            bits = self._bits[protocol]
+            ports = array('H')
+            for index, byte in enumerate(bits):
+                if byte:
+                    base = index << 3
+                    ports.extend(base + bit for bit in range(8) if byte & (1 << bit))
+            self._ports[protocol] = ports
+        return self._ports[protocol]
+
+    @property
+    def tcp_ports(self) -> array:
+        return self.ports('tcp')
+
+    @property
+    def udp_ports(self) -> array:
+        return self.ports('udp')
+
+    def __len__(self) -> int:
+        return len(self.tcp_ports)
+
+    def __iter__(self):
+        return iter(self.tcp_ports)
+
+    def ordered(self, first: Iterable[int], protocol: str = 'tcp') -> List[int]:
+        """Ports with `first` (filtered to the spec) moved to the front, in that order."""
+        priority = [port for port in dict.fromkeys(first) if self.has(port, protocol)]
+        seen = set(priority)
+        return priority + [port for port in self.ports(protocol) if port not in seen]
+
+    def subset(self, index: int, count: int) -> 'PortSpec':
+        """Every `count`-th port of each protocol, starting at position `index`; the shards of
+        one spec are disjoint and together cover it, with common low ports spread evenly."""
+        shard = PortSpec()
+        shard.spec = f"{self.spec} (shard {index + 1}/{count})"
+        for protocol, bits in shard._bits.items():
+            for port in self.ports(protocol)[index::count]:
+                bits[port >> 3] |= 1 << (port & 7)
+        return shard
+
+    def __repr__(self) -> str:
+        return f"PortSpec({self.spec!r}: {len(self.tcp_ports)} tcp, {len(self.udp_ports)} udp)"
+
+class AnsweredPorts:
+    """Which ports of each address answered a sweep: one bitmap per address that answered at all."""
+
+    def __init__(self):
+        self._bits: Dict[str, bytearray] = {}
+
+    def add(self, address: str, port: int) -> bool:
+        """Note that address:port answered; False when it already had."""
+        bits = self._bits.get(address)
+        if bits is None:
+            bits = self._bits[address] = bytearray((MAX_PORT >> 3) + 1)
+        mask = 1 << (port & 7)
+        if bits[port >> 3] & mask:
+            return False
+        bits[port >> 3] |= mask
+        return True
+
+    def __contains__(self, probe: Tuple[str, int]) -> bool:
+        address, port = probe
+        bits = self._bits.get(address)
+        return bits is not None and bool(bits[port >> 3] & (1 << (port & 7)))
+
+    def addresses(self) -> Set[str]:
+        return set(self._bits)
+
+    def unanswered(self, addresses: Sequence[str], ports: Sequence[int]) -> Iterator[Tuple[str, int]]:
+        """(address, port) pairs without an answer, generated one at a time. Port-major order
+        interleaves the addresses, so no single host gets a burst of probes."""
+        for port in ports:
+            for address in addresses:
+                if (address, port) not in self:
+                    yield address, port
+
+@lru_cache(maxsize=32)
+def _compile(spec: str) -> PortSpec:
+    return PortSpec(spec)
+
+def parse_ports(ports: str | PortSpec) -> PortSpec:
+    """Compile a port specification once; repeated strings reuse the same PortSpec."""
+    if isinstance(ports, PortSpec):
+        return ports
+    return _compile(ports.strip())
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from metrics import METRICS
+
+class TokenBucket:
+    """Rate limiter for `rate` events per second with bursts of up to `burst` events.
+
+    Callers that find the bucket empty go into debt and sleep until it is paid off, so
+    concurrent callers are spaced out in arrival order. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        if not self.rate:
+            return
+        self._refill()
+        self._tokens -= tokens
+        if self._tokens < 0:
+            METRICS.rate_limited.inc(amount=-self._tokens / self.rate)
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take `tokens` only if they are available right now."""
+        if not self.rate:
+            return True
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+class ProbeScheduler:
+    """Central gate for probes: a global in-flight budget, a per-host cap and a packet rate.
+
+    Probes that cannot start at once queue per host, and freed slots are handed to the
+    waiting hosts in round-robin order, so one host with many ports cannot starve the
+    others and no host ever has more than `per_host` probes outstanding.
+    """
+
+    def __init__(self, max_in_flight: int, per_host: int, rate: float = 0, burst: float | None = None,
+                 limiter: TokenBucket | None = None):
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        # An explicit limiter (e.g. one drawing on a budget shared between processes) overrides `rate`
+        self.rate = limiter or TokenBucket(rate, burst)
+        self.in_flight = 0
+        self._host_in_flight: Dict[str, int] = {}
+        self._waiting: Dict[str, Deque[asyncio.Future]] = {}
+        self._ready: Deque[str] = deque()  # Hosts with queued probes, in service order
+
+    @property
+    def queued(self) -> int:
+        """Probes waiting for a slot."""
+        return sum(len(queue) for queue in self._waiting.values())
+
+    @asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[None]:
+        """Hold one in-flight slot for `host`, paced by the packet rate."""
+        await self.acquire(host)
+        try:
+            await self.rate.acquire()
+            yield
+        finally:
+            self.release(host)
+
+    async def acquire(self, host: str) -> None:
+        if host not in self._waiting and self.in_flight < self.max_in_flight and self._host_in_flight.get(host, 0) < self.per_host:
+            self._grant(host)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiting.get(host)
+        if queue is None:
+            queue = self._waiting[host] = deque()
+            self._ready.append(host)
+        queue.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(host)  # Granted just before the cancellation landed
+            elif waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    self._forget(host)
+            raise
+
+    def release(self, host: str) -> None:
+        self.in_flight -= 1
+        remaining = self._host_in_flight[host] - 1
+        if remaining:
+            self._host_in_flight[host] = remaining
+        else:
+            del self._host_in_flight[host]
+        self._dispatch()
+
+    def _grant(self, host: str) -> None:
+        self.in_flight += 1
+        self._host_in_flight[host] = self._host_in_flight.get(host, 0) + 1
+
+    def _forget(self, host: str) -> None:
+        del self._waiting[host]
+        self._ready.remove(host)
+
+    def _dispatch(self) -> None:
+        skipped = 0
+        while self.in_flight < self.max_in_flight and skipped < len(self._ready):
+            host = self._ready.popleft()
+            if self._host_in_flight.get(host, 0) >= self.per_host:
+                self._ready.append(host)
+                skipped += 1
+                continue
+            queue = self._waiting[host]
+            waiter = queue.popleft()
+            # A waiter cancelled since it queued is dropped here rather than granted
+            if not waiter.done():
+                self._grant(host)
+                waiter.set_result(None)
+                skipped = 0
+            if queue:
+                self._ready.append(host)
+            else:
+                del self._waiting[host]
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from types import CodeType
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Innermost matching function of a sampled stack decides its phase; methods with common
+# names are given by qualified name, which code objects carry from Python 3.11
+PHASE_FUNCTIONS = {
+    'resolve_many': 'resolve',
+    'reverse_many': 'resolve',
+    '_discover': 'discovery',
+    'scan_port': 'ports',
+    '_syn_sweep': 'ports',
+    '_udp_sweep': 'ports',
+    '_get_service_version': 'service',
+    '_get_os_guess': 'os',
+    'ScanResult.to_dict': 'serialisation',
+    'ScanResult.from_dict': 'serialisation',
+    'PortFinding.to_dict': 'serialisation',
+    'NDJSONWriter.write': 'serialisation',
+    'save_results_to_file': 'serialisation',
+    'save_results': 'serialisation',
+    'record_host': 'serialisation',
+}
+# Where a thread blocks waiting for work: the event loop's poll and idle pool workers
+_IDLE_FUNCTIONS = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get')}
+LAG_INTERVAL = 0.05
+
+def _phase(stack: Tuple[CodeType, ...]) -> str:
+    innermost = stack[-1]
+    if (os.path.basename(innermost.co_filename), innermost.co_name) in _IDLE_FUNCTIONS:
+        return 'idle'
+    for code in reversed(stack):
+        phase = PHASE_FUNCTIONS.get(getattr(code, 'co_qualname', code.co_name)) or PHASE_FUNCTIONS.get(code.co_name)
+        if phase is not None:
+            return phase
+    return 'other'
+
+def _frame_name(code: CodeType) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples the stacks of every thread of the process every `interval` seconds from a
+    background thread, so the profiled code runs unmodified.
+
+    Only running code is seen: a coroutine suspended in an await is on no stack, and the
+    event loop then shows as idle in its poll. Each sample is attributed to the scan phase
+    of the innermost function of PHASE_FUNCTIONS on its stack.
+    """
+
+    def __init__(self, interval: float | None = None):
+        self.interval = interval or get_config('PROFILE_INTERVAL')
+        self.samples: Counter = Counter()  # (thread name, phase, stack of code objects) -> samples
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                if stack:
+                    stack = tuple(stack)
+                    self.samples[(names.get(ident, str(ident)), _phase(stack), stack)] += 1
+
+    def phase_shares(self) -> Dict[str, float]:
+        """Share of the busy samples (idle ones left out) per phase."""
+        phases: Counter = Counter()
+        for (_, phase, _), count in self.samples.items():
+            if phase != 'idle':
+                phases[phase] += count
+        busy = sum(phases.values())
+        return {phase: count / busy for phase, count in phases.most_common()} if busy else {}
+
+    def write_collapsed(self, path: str) -> None:
+        """Write the samples as collapsed stacks (`thread;phase;outer;...;inner count`), the
+        input format of flamegraph.pl, speedscope and most flame graph tools."""
+        lines: Counter = Counter()
+        for (thread, phase, stack), count in self.samples.items():
+            lines[';'.join([thread, phase] + [_frame_name(code) for code in stack])] += count
+        with open(path, 'w') as f:
+            for line, count in sorted(lines.items()):
+                f.write(f"{line} {count}\n")
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a callback scheduled `interval` seconds ahead;
+    lag means some callback held the loop."""
+
+    def __init__(self, interval: float = LAG_INTERVAL, keep: int = 65536):
+        self.interval = interval
+        self.lags: Deque[float] = deque(maxlen=keep)
+        self.worst = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.lags.append(lag)
+            self.worst = max(self.worst, lag)
+
+    def summary(self) -> Dict[str, float]:
+        if not self.lags:
+            return {}
+        ordered = sorted(self.lags)
+        return {'p50': ordered[len(ordered) // 2], 'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+                'max': self.worst}
+
+def describe(profiler: SamplingProfiler, lag: LoopLagMonitor) -> str:
+    shares = ', '.join(f"{phase} {share:.0%}" for phase, share in profiler.phase_shares().items()) or 'none'
+    lags = lag.summary()
+    lag_text = (f"event loop lag p50 {lags['p50'] * 1000:.1f}ms p99 {lags['p99'] * 1000:.1f}ms max {lags['max'] * 1000:.1f}ms"
+                if lags else "no event loop lag samples")
+    return f"{sum(profiler.samples.values())} samples; busy time by phase: {shares}; {lag_text}"
+
+@asynccontextmanager
+async def profile(path: str, interval: float | None = None) -> AsyncIterator[SamplingProfiler]:
+    """Profile the enclosed code and the running event loop, writing collapsed stacks to `path` at the end."""
+    profiler, lag = SamplingProfiler(interval), LoopLagMonitor()
+    profiler.start()
+    lag.start()
+    try:
+        yield profiler
+    finally:
+        lag.stop()
+        profiler.stop()
+        profiler.write_collapsed(path)
+        logger.info(f"Profile: {describe(profiler, lag)}; collapsed stacks written to {path}")
@@ -0,0 +1,226 @@
+import asyncio
+import ctypes
+import errno
+import logging
+import random
+import socket
+import struct
+import sys
+from typing import Callable, Dict, Tuple
+
+from packets import TCP_ACK, TCP_RST, TCP_SYN, TCPReply, address_family, parse_tcp_reply, parse_tcp_segment
+
+logger = logging.getLogger(__name__)
+
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+PORT_SPAN = 1024
+
+def _bpf_program6(first_port: int, last_port: int) -> bytes:
+    """The filter for raw IPv6 sockets, which see the TCP segment without an IP header."""
+    drop = 6
+    instructions = [
+        (0x28, 0, 0, 2),                          # ldh [2]           TCP destination port
+        (0x35, 0, drop - 2, first_port),          # jge #first
+        (0x25, drop - 3, 0, last_port),           # jgt #last
+        (0x30, 0, 0, 13),                         # ldb [13]          TCP flags
+        (0x45, 0, drop - 5, TCP_SYN | TCP_RST),   # jset #SYN|RST
+        (0x06, 0, 0, 0x40000),                    # ret #262144       accept
+        (0x06, 0, 0, 0),                          # ret #0            drop
+    ]
+    return b''.join(struct.pack('HBBI', *instruction) for instruction in instructions)
+
+def _bpf_program(first_port: int, last_port: int) -> bytes:
+    """Classic BPF: accept TCP segments with SYN or RST set whose destination port is in range."""
+    drop = 9
+    instructions = [
+        (0x30, 0, 0, 9),                          # ldb [9]           IP protocol
+        (0x15, 0, drop - 2, socket.IPPROTO_TCP),  # jeq #6
+        (0xb1, 0, 0, 0),                          # ldxb 4*([0]&0xf)  IP header length
+        (0x48, 0, 0, 2),                          # ldh [x+2]         TCP destination port
+        (0x35, 0, drop - 5, first_port),          # jge #first
+        (0x25, drop - 6, 0, last_port),           # jgt #last
+        (0x50, 0, 0, 13),                         # ldb [x+13]        TCP flags
+        (0x45, 0, drop - 8, TCP_SYN | TCP_RST),   # jset #SYN|RST
+        (0x06, 0, 0, 0x40000),                    # ret #262144       accept
+        (0x06, 0, 0, 0),                          # ret #0            drop
+    ]
+    return b''.join(struct.pack('HBBI', *instruction) for instruction in instructions)
+
+class RawTCPListener:
+    """One raw sender and one raw receiver shared by every raw TCP probe of a scan.
+
+    Probes take their source port from a private range of `port_span` ports; a BPF filter
+    attached to the receiver keeps everything else in the kernel. Where the filter cannot be
+    attached, the same test runs on every packet before it is parsed. Replies are demultiplexed
+    either to a future registered with `expect` (keyed by source address, source port and
+    our port, checked against the expected acknowledgment number) or to a handler
+    registered with `subscribe` for one of our ports.
+
+    IPv6 probes go through a raw IPv6 TCP socket that both sends and receives; the kernel
+    writes the IPv6 header, so only the TCP segment is passed to `send` for an IPv6 address.
+    """
+
+    def __init__(self, port_base: int | None = None, port_span: int = PORT_SPAN):
+        self.port_base = port_base or random.randrange(40000, 61000 - port_span)
+        self.port_span = port_span
+        self._next_port = 0
+        self._sender: socket.socket | None = None
+        self._receiver: socket.socket | None = None
+        self._socket6: socket.socket | None = None
+        self._filters = []
+        # Sockets without a BPF filter, whose packets are filtered before parsing instead
+        self._user_filter = self._user_filter6 = False
+        self._waiters: Dict[Tuple[str, int, int], Tuple[int, asyncio.Future]] = {}
+        self._handlers: Dict[int, Callable[[TCPReply], None]] = {}
+
+    @property
+    def is_open(self) -> bool:
+        return self._receiver is not None
+
+    def open(self) -> None:
+        """Create the sockets; raises PermissionError without root privileges."""
+        loop = asyncio.get_running_loop()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        try:
+            receiver = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        except BaseException:
+            sender.close()
+            raise
+        sender.setblocking(False)
+        receiver.setblocking(False)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._user_filter = not self._attach_filter(receiver, _bpf_program)
+        self._sender, self._receiver = sender, receiver
+        loop.add_reader(receiver.fileno(), self._on_readable)
+        try:
+            socket6 = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        except OSError as e:
+            logger.debug(f"IPv6 raw sockets are unavailable: {str(e)}")
+            return
+        socket6.setblocking(False)
+        socket6.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        # The hop limit of replies is only available as ancillary data
+        socket6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_RECVHOPLIMIT, 1)
+        self._user_filter6 = not self._attach_filter(socket6, _bpf_program6)
+        self._socket6 = socket6
+        loop.add_reader(socket6.fileno(), self._on_readable6)
+
+    def _attach_filter(self, sock: socket.socket, program_for: Callable[[int, int], bytes]) -> bool:
+        """Attach the BPF filter to `sock`; False when the kernel refuses it."""
+        program = program_for(self.port_base, self.port_base + self.port_span - 1)
+        # The kernel copies the program on attach, but keep the buffer alive with the socket anyway
+        buffer = ctypes.create_string_buffer(program)
+        self._filters.append(buffer)
+        fprog = struct.pack('HL', len(program) // 8, ctypes.addressof(buffer))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        except OSError as e:
+            logger.warning(f"Could not attach BPF filter, filtering raw TCP replies in user space: {str(e)}")
+            return False
+        return True
+
+    def _accepts(self, data: bytes, offset: int) -> bool:
+        """What the BPF filter decides for the TCP segment at `offset` of `data`: whether it has SYN or
+        RST set and is addressed to a port of our range."""
+        if len(data) < offset + 14:
+            return False
+        port = int.from_bytes(data[offset + 2:offset + 4], 'big')
+        return self.port_base <= port < self.port_base + self.port_span and bool(data[offset + 13] & (TCP_SYN | TCP_RST))
+
+    def close(self) -> None:
+        if self._receiver is not None:
+            asyncio.get_running_loop().remove_reader(self._receiver.fileno())
+            self._receiver.close()
+            self._receiver = None
+        if self._sender is not None:
+            self._sender.close()
+            self._sender = None
+        if self._socket6 is not None:
+            asyncio.get_running_loop().remove_reader(self._socket6.fileno())
+            self._socket6.close()
+            self._socket6 = None
+        for _, waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+        self._handlers.clear()
+
+    def allocate_port(self) -> int:
+        """Next source port from the listener's range."""
+        port = self.port_base + self._next_port
+        self._next_port = (self._next_port + 1) % self.port_span
+        return port
+
+    def subscribe(self, port: int, handler: Callable[[TCPReply], None]) -> None:
+        self._handlers[port] = handler
+
+    def unsubscribe(self, port: int) -> None:
+        self._handlers.pop(port, None)
+
+    def expect(self, src_ip: str, src_port: int, dst_port: int, ack: int) -> asyncio.Future:
+        """Future resolved with the TCPReply answering a probe sent from `dst_port` to src_ip:src_port."""
+        waiter = asyncio.get_running_loop().create_future()
+        key = (src_ip, src_port, dst_port)
+
+        def forget(_: asyncio.Future) -> None:
+            if self._waiters.get(key, (None, None))[1] is waiter:
+                del self._waiters[key]
+
+        waiter.add_done_callback(forget)
+        self._waiters[key] = (ack, waiter)
+        return waiter
+
+    async def send(self, packet: bytes, ip: str) -> None:
+        sender = self._sender
+        if address_family(ip) == socket.AF_INET6:
+            sender = self._socket6
+            if sender is None:
+                raise OSError(errno.EAFNOSUPPORT, "IPv6 raw sockets are unavailable")
+        try:
+            sender.sendto(packet, (ip, 0))
+        except BlockingIOError:
+            await asyncio.get_running_loop().sock_sendto(sender, packet, (ip, 0))
+
+    def _dispatch(self, reply: TCPReply) -> None:
+        entry = self._waiters.get((reply.src, reply.src_port, reply.dst_port))
+        if entry is not None and reply.flags & TCP_ACK and reply.ack == entry[0] and not entry[1].done():
+            entry[1].set_result(reply)
+            return
+        handler = self._handlers.get(reply.dst_port)
+        if handler is not None:
+            handler(reply)
+
+    def _on_readable(self) -> None:
+        while self._receiver is not None:
+            try:
+                data = self._receiver.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error(f"Error reading from raw socket: {str(e)}")
+                return
+            if self._user_filter and not (len(data) > 9 and data[9] == socket.IPPROTO_TCP
+                                          and self._accepts(data, 4 * (data[0] & 0xf))):
+                continue
+            reply = parse_tcp_reply(data)
+            if reply is not None:
+                self._dispatch(reply)
+
+    def _on_readable6(self) -> None:
+        while self._socket6 is not None:
+            try:
+                data, ancdata, _, address = self._socket6.recvmsg(65535, socket.CMSG_SPACE(4))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error(f"Error reading from raw IPv6 socket: {str(e)}")
+                return
+            if self._user_filter6 and not self._accepts(data, 0):
+                continue
+            hop_limit = 0
+            for level, kind, value in ancdata:
+                if level == socket.IPPROTO_IPV6 and kind == socket.IPV6_HOPLIMIT and len(value) >= 4:
+                    hop_limit = int.from_bytes(value[:4], sys.byteorder)
+            reply = parse_tcp_segment(data, address[0], hop_limit)
+            if reply is not None:
+                self._dispatch(reply)
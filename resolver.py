@@ -0,0 +1,145 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+from config import get_config
+
+try:
+    import aiodns
+except ImportError:  # Optional: without it lookups go through the event loop's thread pool
+    aiodns = None
+
+logger = logging.getLogger(__name__)
+
+# Failed lookups are remembered for a shorter time, so a transient DNS outage heals quickly
+NEGATIVE_TTL = 60
+
+class DNSCache:
+    """Forward and reverse answers with an expiry time, shared by every resolver in the process.
+
+    Holds at most `max_entries` answers (DNS_CACHE_SIZE); past that the least recently used
+    one is dropped, so a long-lived process that resolves ever new names stays bounded.
+    """
+
+    def __init__(self, max_entries: int | None = None):
+        self.max_entries = max_entries or get_config('DNS_CACHE_SIZE')
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, str | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, kind: str, key: str) -> Tuple[bool, str | None]:
+        """(hit, answer); answers past their expiry are dropped."""
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            del self._entries[(kind, key)]
+            return False, None
+        self._entries.move_to_end((kind, key))
+        return True, entry[1]
+
+    def put(self, kind: str, key: str, answer: str | None, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        self._entries[(kind, key)] = (time.monotonic() + ttl, answer)
+        self._entries.move_to_end((kind, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+DNS_CACHE = DNSCache()
+
+class Resolver:
+    """Asynchronous forward (name to address) and reverse (address to name) lookups.
+
+    Answers are cached for CACHE_EXPIRATION seconds, concurrent lookups of one name share a
+    single query, and bulk lookups run up to DNS_CONCURRENCY queries at a time. Uses aiodns
+    when it is installed and the system resolver through the event loop otherwise.
+    """
+
+    def __init__(self, ttl: float | None = None, concurrency: int | None = None, cache: DNSCache = DNS_CACHE):
+        self.ttl = get_config('CACHE_EXPIRATION') if ttl is None else ttl
+        self.cache = cache
+        self._slots = asyncio.Semaphore(concurrency or get_config('DNS_CONCURRENCY'))
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._backend = None
+
+    def _aiodns(self):
+        if self._backend is None and aiodns is not None:
+            self._backend = aiodns.DNSResolver()
+        return self._backend
+
+    async def resolve(self, name: str) -> str | None:
+        """Address of `name`, IPv4 or IPv6 in the system's order of preference (an IPv4 address
+        first with aiodns); IP literals are returned in canonical form, failures as None."""
+        try:
+            return str(ipaddress.ip_address(name))
+        except ValueError:
+            pass
+        return await self._lookup('forward', name.lower(), self._query_address)
+
+    async def reverse(self, address: str) -> str | None:
+        """Host name registered for `address`, or None."""
+        return await self._lookup('reverse', address, self._query_name)
+
+    async def resolve_many(self, names: Iterable[str]) -> Dict[str, str | None]:
+        names = list(dict.fromkeys(names))
+        return dict(zip(names, await asyncio.gather(*[self.resolve(name) for name in names])))
+
+    async def reverse_many(self, addresses: Iterable[str]) -> Dict[str, str | None]:
+        addresses = list(dict.fromkeys(addresses))
+        return dict(zip(addresses, await asyncio.gather(*[self.reverse(address) for address in addresses])))
+
+    async def _lookup(self, kind: str, key: str, query) -> str | None:
+        hit, answer = self.cache.get(kind, key)
+        if hit:
+            return answer
+        # One query per name however many callers ask; a caller that is cancelled leaves it running for the rest
+        task = self._pending.get((kind, key))
+        if task is None:
+            task = self._pending[(kind, key)] = asyncio.create_task(self._query(kind, key, query))
+            task.add_done_callback(lambda _: self._pending.pop((kind, key), None))
+        return await asyncio.shield(task)
+
+    async def _query(self, kind: str, key: str, query) -> str | None:
+        async with self._slots:
+            answer = await query(key)
+        self.cache.put(kind, key, answer, self.ttl if answer is not None else min(NEGATIVE_TTL, self.ttl))
+        return answer
+
+    async def _query_address(self, name: str) -> str | None:
+        backend = self._aiodns()
+        try:
+            if backend is not None:
+                # gethostbyname consults the hosts file as well, unlike a bare A query
+                for family in (socket.AF_INET, socket.AF_INET6):
+                    try:
+                        result = await backend.gethostbyname(name, family)
+                    except aiodns.error.DNSError:
+                        continue
+                    if result.addresses:
+                        return result.addresses[0]
+                raise OSError("no A or AAAA record")
+            infos = await asyncio.get_running_loop().getaddrinfo(name, None, type=socket.SOCK_STREAM)
+            return infos[0][4][0]
+        except Exception as e:
+            logger.error(f"Could not resolve {name}: {str(e)}")
+            return None
+
+    async def _query_name(self, address: str) -> str | None:
+        backend = self._aiodns()
+        try:
+            if backend is not None:
+                return (await backend.gethostbyaddr(address)).name
+            name, _ = await asyncio.get_running_loop().getnameinfo((address, 0), socket.NI_NAMEREQD)
+            return name
+        except Exception as e:
+            logger.debug(f"No reverse DNS name for {address}: {str(e)}")
+            return None
@@ -0,0 +1,160 @@
+import sys
+from array import array
+from typing import Any, Dict, List, Tuple
+
+from timing import PHASES
+
+PORT_STATES = ('open', 'closed', 'filtered')
+# Codes of port states in packed records and tallies; UDP adds open|filtered
+STATE_CODES = PORT_STATES + ('open|filtered',)
+_STATE_INDEX = {port_state: code for code, port_state in enumerate(STATE_CODES)}
+# OS guess of a host scanned without OS detection (all port shards but the lead one)
+OS_NOT_PROBED = 'Unknown (not probed)'
+# OS guess of a host with no open TCP port to fingerprint
+OS_NO_OPEN_PORT = 'Unknown (no open port)'
+
+class PortDetailTable:
+    """Interned port details: every distinct combination of the fields of a port record other
+    than its number and state (service, version, product, ...) is stored once per table.
+
+    A scan shares one table between its results, and the table lives as long as they do, so a
+    long-running process does not keep the details of every scan it ever ran.
+    """
+
+    def __init__(self):
+        self._ids: Dict[Tuple[Tuple[str, Any], ...], int] = {}
+        self._details: List[Tuple[Tuple[str, Any], ...]] = []
+
+    def intern(self, details: Tuple[Tuple[str, Any], ...]) -> int:
+        detail_id = self._ids.get(details)
+        if detail_id is None:
+            detail_id = self._ids[details] = len(self._details)
+            self._details.append(details)
+        return detail_id
+
+    def __getitem__(self, detail_id: int) -> Tuple[Tuple[str, Any], ...]:
+        return self._details[detail_id]
+
+    def __len__(self) -> int:
+        return len(self._details)
+
+class ScanResult:
+    """Outcome of scanning one host, kept compact for inventories of many thousands of hosts.
+
+    Each port record is packed into one 64-bit word (port number, state code and the id of
+    its interned details), the port tally into an array of counts by state code and the
+    phase times into an array of seconds by phase; a host without open ports holds no port
+    array at all. Results built with the same `details` table share their interned details;
+    without one, a result with ports gets a table of its own.
+
+    `ports`, `port_counts`, `timed_out` and `timings` rebuild plain lists and dicts on every
+    access, so treat them as read-only views and assign a new value to change them.
+    """
+
+    __slots__ = ('host', 'state', 'scan_time', 'os_guess', 'hostname', '_ports', '_details', '_counts', '_timed_out',
+                 '_timings')
+
+    def __init__(self, host: str, state: str, ports: List[Dict[str, Any]], scan_time: float, os_guess: str,
+                 port_counts: Dict[str, int] | None = None, timed_out: List[str] | None = None,
+                 hostname: str | None = None, timings: Dict[str, float] | None = None,
+                 details: PortDetailTable | None = None):
+        self.host = host
+        self.state = state
+        self._details = details
+        self.ports = ports
+        self.scan_time = scan_time
+        # Hosts mostly share a handful of guesses ('Unknown (host down)', the best OS match, ...)
+        self.os_guess = sys.intern(os_guess)
+        # Tally of every probed port by state; `ports` only carries the open ones
+        self.port_counts = port_counts
+        # Phases (discovery, ports, service, os) cut short by a deadline; their results are partial
+        self.timed_out = timed_out
+        self.hostname = hostname  # Reverse DNS name, when looked up
+        # Seconds spent in each phase (see timing.PHASES); phases may overlap, so they need not add up to scan_time
+        self.timings = timings
+
+    @property
+    def ports(self) -> List[Dict[str, Any]]:
+        if self._ports is None:
+            return []
+        records = []
+        for packed in self._ports:
+            record = {'port': packed >> 40, 'state': STATE_CODES[packed >> 32 & 0xff]}
+            record.update(self._details[packed & 0xffffffff])
+            records.append(record)
+        return records
+
+    @ports.setter
+    def ports(self, ports: List[Dict[str, Any]]) -> None:
+        if not ports:
+            self._ports = None
+            return
+        if self._details is None:
+            self._details = PortDetailTable()
+        self._ports = array('Q', (record['port'] << 40 | _STATE_INDEX[record['state']] << 32
+                                  | self._details.intern(tuple((field, value) for field, value in record.items()
+                                                              if field not in ('port', 'state')))
+                                  for record in ports))
+
+    @property
+    def port_counts(self) -> Dict[str, int]:
+        if self._counts is None:
+            return {}
+        return dict(zip(STATE_CODES, self._counts))
+
+    @port_counts.setter
+    def port_counts(self, port_counts: Dict[str, int] | None) -> None:
+        if not port_counts:
+            self._counts = None
+            return
+        # Every state up to the last one present is kept, as the tallies have always listed them
+        length = max(_STATE_INDEX[port_state] for port_state in port_counts) + 1
+        self._counts = array('I', (port_counts.get(port_state, 0) for port_state in STATE_CODES[:length]))
+
+    @property
+    def timed_out(self) -> List[str]:
+        return list(self._timed_out)
+
+    @timed_out.setter
+    def timed_out(self, timed_out: List[str] | None) -> None:
+        self._timed_out = tuple(timed_out) if timed_out else ()
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        if self._timings is None:
+            return {}
+        return {phase: round(seconds, 6) for phase, seconds in zip(PHASES, self._timings)}
+
+    @timings.setter
+    def timings(self, timings: Dict[str, float] | None) -> None:
+        # Doubles: rounded to microseconds on the way out, which single precision cannot hold for long phases
+        self._timings = array('d', (timings.get(phase, 0.0) for phase in PHASES)) if timings else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'host': self.host,
+            'state': self.state,
+            'ports': self.ports,
+            'scan_time': self.scan_time,
+            'os_guess': self.os_guess,
+            'port_counts': self.port_counts,
+            'timed_out': self.timed_out,
+            'hostname': self.hostname,
+            'timings': self.timings
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], details: PortDetailTable | None = None) -> 'ScanResult':
+        return cls(host=data['host'], state=data['state'], ports=data['ports'], scan_time=data['scan_time'],
+                   os_guess=data['os_guess'], port_counts=data.get('port_counts'), timed_out=data.get('timed_out'),
+                   hostname=data.get('hostname'), timings=data.get('timings'), details=details)
+
+class PortFinding:
+    """An open port reported while its host is still being scanned."""
+
+    def __init__(self, host: str, port: Dict[str, Any]):
+        self.host = host
+        self.port = port
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'host': self.host, **self.port}
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from metrics import METRICS
+from probe_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service_probes.json')
+
+_TEMPLATE = re.compile(r'\$(\d)')
+
+Streams = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+class ServiceMatch:
+    """One response signature; `soft` matches name the service but let probing continue."""
+
+    __slots__ = ('service', 'regex', 'templates', 'soft')
+
+    def __init__(self, service: str, pattern: str, templates: Dict[str, str], soft: bool = False):
+        self.service = service
+        # Patterns are byte regexes; JSON carries them as latin-1 text so \xNN escapes survive
+        self.regex = re.compile(pattern.encode('latin-1'), re.DOTALL)
+        self.templates = templates
+        self.soft = soft
+
+    def apply(self, data: bytes) -> Dict[str, str] | None:
+        found = self.regex.search(data)
+        if not found:
+            return None
+        def group(reference: re.Match) -> str:
+            # A group that did not take part in the match, or that the pattern lacks, is empty
+            index = int(reference.group(1))
+            value = found.group(index) if index <= found.re.groups else None
+            return (value or b'').decode('utf-8', errors='ignore')
+
+        details = {'service': self.service}
+        for field, template in self.templates.items():
+            value = _TEMPLATE.sub(group, template).strip().rstrip(':')
+            if value:
+                details[field] = value
+        return details
+
+class ServiceProbe:
+    __slots__ = ('name', 'payload', 'ports', 'rarity', 'wait', 'matches', 'protocol')
+
+    def __init__(self, name: str, payload: bytes, ports: frozenset, rarity: int, wait: float, matches: List[ServiceMatch],
+                 protocol: str = 'tcp'):
+        self.name = name
+        self.protocol = protocol
+        self.payload = payload
+        self.ports = ports
+        self.rarity = rarity
+        self.wait = wait
+        self.matches = matches
+
+    def match(self, data: bytes) -> Dict[str, str] | None:
+        soft = None
+        for signature in self.matches:
+            details = signature.apply(data)
+            if details is None:
+                continue
+            if not signature.soft:
+                return details
+            if soft is None:
+                soft = dict(details, soft=True)
+        return soft
+
+class ServiceDatabase:
+    """Probe/match database compiled once at load: regexes precompiled, probe order cached per port."""
+
+    def __init__(self, probes: List[ServiceProbe], services: Dict[int, str], udp_services: Dict[int, str] | None = None):
+        self.probes = probes
+        self.services = services
+        self.udp_services = udp_services or {}
+        self._null = next((probe for probe in probes if not probe.payload and probe.protocol == 'tcp'), None)
+        self._order: Dict[Tuple[int, int, str], List[ServiceProbe]] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ServiceDatabase':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        probes = []
+        for entry in data['probes']:
+            matches = [ServiceMatch(m['service'], m['pattern'],
+                                    {k: m[k] for k in ('product', 'version', 'info', 'cpe') if k in m},
+                                    m.get('soft', False))
+                       for m in entry['matches']]
+            probes.append(ServiceProbe(entry['name'], entry.get('payload', '').encode('latin-1'),
+                                       frozenset(entry.get('ports', [])), entry.get('rarity', 5),
+                                       entry.get('wait', 3.0), matches, entry.get('protocol', 'tcp')))
+        services = {int(port): name for port, name in data.get('services', {}).items()}
+        udp_services = {int(port): name for port, name in data.get('udp_services', {}).items()}
+        logger.info(f"Loaded {len(probes)} service probes with {sum(len(p.matches) for p in probes)} signatures from {path}")
+        return cls(probes, services, udp_services)
+
+    def service_name(self, port: int, protocol: str = 'tcp') -> str:
+        return (self.udp_services if protocol == 'udp' else self.services).get(port, 'unknown')
+
+    def probes_for(self, port: int, intensity: int, protocol: str = 'tcp') -> List[ServiceProbe]:
+        """Probes worth sending to `port`: those registered for the port first, then by rarity."""
+        key = (port, intensity, protocol)
+        if key not in self._order:
+            candidates = [probe for probe in self.probes
+                          if probe.protocol == protocol and (port in probe.ports or probe.rarity <= intensity)]
+            self._order[key] = sorted(candidates, key=lambda probe: (port not in probe.ports, probe.rarity))
+        return self._order[key]
+
+    def match(self, probe: ServiceProbe, data: bytes) -> Dict[str, str] | None:
+        details = probe.match(data)
+        if (details is None or details.get('soft')) and self._null is not None and probe is not self._null:
+            # Banners can arrive in answer to any probe, so fall back to the banner signatures
+            fallback = self._null.match(data)
+            if fallback is not None and (details is None or not fallback.get('soft')):
+                details = fallback
+        return details
+
+@lru_cache(maxsize=4)
+def load_service_database(path: str = DEFAULT_PROBES_FILE) -> ServiceDatabase:
+    return ServiceDatabase.from_file(path)
+
+class ServiceDetector:
+    """Runs the probes for one open port within a per-probe and per-port time budget.
+
+    Callers hold the port's in-flight slot; every connection the detector opens itself (the
+    first one when it is not handed a socket, and one after each probe that closed its stream)
+    is paced by `rate`.
+    """
+
+    def __init__(self, database: ServiceDatabase, probe_timeout: float, budget: float, intensity: int,
+                 rate: TokenBucket | None = None):
+        self.database = database
+        self.probe_timeout = probe_timeout
+        self.budget = budget
+        self.intensity = intensity
+        self.rate = rate
+
+    async def detect(self, target: str, port: int, sock=None) -> Dict[str, Any]:
+        """Identify the service on target:port, starting on the already connected `sock` if given."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.budget
+        streams: Streams | None = None
+        best: Dict[str, Any] = {}
+        try:
+            if sock is not None:
+                try:
+                    streams = await asyncio.open_connection(sock=sock)
+                except BaseException:
+                    sock.close()
+                    raise
+            for probe in self.database.probes_for(port, self.intensity):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    data, streams = await self._run_probe(target, port, probe, streams, min(probe.wait, self.probe_timeout, remaining))
+                except (OSError, asyncio.TimeoutError) as e:
+                    logger.debug(f"Probe {probe.name} failed on {target}:{port}: {str(e)}")
+                    streams = None
+                    continue
+                if not data:
+                    continue
+                details = self.database.match(probe, data)
+                if details is None:
+                    best.setdefault('banner', data[:80].decode('utf-8', errors='replace').strip())
+                    continue
+                if not details.pop('soft', False):
+                    return details
+                if 'service' not in best:
+                    best.update(details)
+            return best
+        finally:
+            if streams is not None:
+                await _close(streams[1])
+
+    async def _run_probe(self, target: str, port: int, probe: ServiceProbe, streams: Streams | None,
+                         wait: float) -> Tuple[bytes, Streams | None]:
+        """Send one probe and collect its answer; returns the data and a connection still fit for reuse."""
+        loop = asyncio.get_running_loop()
+        if streams is None and self.rate is not None:
+            await self.rate.acquire()
+        deadline = loop.time() + wait
+        if streams is None:
+            streams = await asyncio.wait_for(asyncio.open_connection(target, port), timeout=wait)
+        reader, writer = streams
+        data = b''
+        reusable = False
+        try:
+            METRICS.sent('service')
+            if probe.payload:
+                writer.write(probe.payload)
+                await writer.drain()
+            while len(data) < 4096:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(reader.read(4096), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+                details = probe.match(data)
+                if details is not None and not details.get('soft'):
+                    break
+            # A connection that has neither sent nor received anything can carry the next probe
+            reusable = not probe.payload and not data and not reader.at_eof()
+            METRICS.reply('service', 'data' if data else 'timeout' if not reader.at_eof() else 'closed')
+            return data, streams if reusable else None
+        finally:
+            if not reusable:
+                await _close(writer)
+
+async def _close(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass  # Peer reset while closing; the descriptor is released either way
@@ -0,0 +1,276 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import time
+import traceback
+from typing import Any, AsyncIterator, Dict, List, Sequence, Tuple
+
+from config import get_config
+from metrics import METRICS, log_stats
+from port_spec import PortSpec, parse_ports
+from probe_scheduler import TokenBucket
+from profiler import profile
+from raw_listener import PORT_SPAN
+from scan_result import OS_NOT_PROBED, PortDetailTable, ScanResult
+from targets import expand_targets
+
+logger = logging.getLogger(__name__)
+
+# Raw probe source ports are split between the workers so their BPF filters never overlap
+RAW_PORT_RANGE = (40000, 61000)
+
+class SharedRateBudget:
+    """Token bucket in shared memory that every worker process draws on."""
+
+    def __init__(self, rate: float, burst: float | None = None, context=multiprocessing):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        # [tokens, last refill]; CLOCK_MONOTONIC is system wide, so the timestamp is valid in every process
+        self._state = context.Array('d', [self.burst, time.monotonic()])
+
+    def take(self, tokens: float) -> float:
+        """Withdraw `tokens`, going into debt when the bucket is short; returns the seconds to wait."""
+        with self._state.get_lock():
+            now = time.monotonic()
+            available = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate) - tokens
+            self._state[0] = available
+            self._state[1] = now
+        return max(0.0, -available / self.rate)
+
+    def try_take(self, tokens: float) -> bool:
+        """Withdraw `tokens` only if the bucket holds them right now."""
+        with self._state.get_lock():
+            now = time.monotonic()
+            available = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate)
+            self._state[1] = now
+            if available < tokens:
+                self._state[0] = available
+                return False
+            self._state[0] = available - tokens
+        return True
+
+class SharedTokenBucket(TokenBucket):
+    """Worker-side limiter that fetches tokens from a SharedRateBudget `grab` at a time,
+    so the cross-process lock is taken once per batch rather than once per packet."""
+
+    def __init__(self, budget: SharedRateBudget, grab: int):
+        super().__init__(budget.rate, burst=grab)
+        self.budget = budget
+        self.grab = grab
+        self._tokens = 0
+
+    async def acquire(self, tokens: float = 1) -> None:
+        self._tokens -= tokens
+        if self._tokens < 0:
+            needed = max(self.grab, -self._tokens)
+            wait = self.budget.take(needed)
+            self._tokens += needed
+            if wait:
+                METRICS.rate_limited.inc(amount=wait)
+                await asyncio.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        if self._tokens < tokens:
+            needed = tokens - self._tokens
+            if not self.budget.try_take(needed):
+                return False
+            self._tokens += needed
+        self._tokens -= tokens
+        return True
+
+class DiscoveryRelay:
+    """Hands the lead port shard's resolution and discovery of every target batch to the other
+    port shards, which walk the same batches, so each host is resolved and discovered once.
+
+    The lead gets an outbox per other shard; every other shard gets its inbox.
+    """
+
+    def __init__(self, outboxes: Sequence[multiprocessing.Queue] = (), inbox: 'multiprocessing.Queue | None' = None):
+        self.outboxes = list(outboxes)
+        self.inbox = inbox
+
+    @property
+    def lead(self) -> bool:
+        return self.inbox is None
+
+    def publish(self, resolved: Dict[str, str | None], host_states: Dict[str, str]) -> None:
+        # The outboxes are unbounded, so the lead never waits for a slower shard
+        for outbox in self.outboxes:
+            outbox.put((resolved, host_states))
+
+    async def receive(self) -> Tuple[Dict[str, str | None], Dict[str, str]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.inbox.get)
+
+def merge_results(parts: Sequence[ScanResult], details: PortDetailTable | None = None) -> ScanResult:
+    """Combine the results that port shards produced for the same host, interning its port details in `details`."""
+    states = {part.state for part in parts}
+    state = 'up' if 'up' in states else 'down' if states == {'down'} else 'filtered'
+    port_counts: Dict[str, int] = {}
+    for part in parts:
+        for port_state, count in part.port_counts.items():
+            port_counts[port_state] = port_counts.get(port_state, 0) + count
+    # Only the lead shard probes the OS; the others report OS_NOT_PROBED
+    guesses = [part.os_guess for part in parts if part.os_guess != OS_NOT_PROBED] or [parts[0].os_guess]
+    os_guess = next((guess for guess in guesses if not guess.startswith('Unknown')), guesses[0])
+    timed_out = list(dict.fromkeys(phase for part in parts for phase in part.timed_out))
+    # The shards scanned the host side by side, so each phase took as long as its slowest shard
+    timings: Dict[str, float] = {}
+    for part in parts:
+        for phase, seconds in part.timings.items():
+            timings[phase] = max(timings.get(phase, 0.0), seconds)
+    return ScanResult(host=parts[0].host, state=state,
+                      ports=sorted((port for part in parts for port in part.ports),
+                                   key=lambda port: (port.get('protocol', 'tcp'), port['port'])),
+                      scan_time=max(part.scan_time for part in parts), os_guess=os_guess, port_counts=port_counts,
+                      timed_out=timed_out, hostname=next((part.hostname for part in parts if part.hostname), None),
+                      timings=timings, details=details)
+
+def _run_worker(shard: int, shards: int, target_specs: Sequence[str], exclude: Sequence[str], randomize: bool,
+                seed: int | None, ports: PortSpec, shard_ports: bool, options: Dict[str, Any],
+                budget: SharedRateBudget | None, results: multiprocessing.Queue, profile_path: str | None = None,
+                relay: DiscoveryRelay | None = None) -> None:
+    """Process entry point: scan one shard on a private event loop and send its results back."""
+    try:
+        asyncio.run(_scan_shard(shard, shards, target_specs, exclude, randomize, seed, ports, shard_ports,
+                                options, budget, results, profile_path, relay))
+        results.put(('done', shard, None))
+    except BaseException:
+        results.put(('error', shard, traceback.format_exc()))
+
+async def _scan_shard(shard: int, shards: int, target_specs: Sequence[str], exclude: Sequence[str], randomize: bool,
+                      seed: int | None, ports: PortSpec, shard_ports: bool, options: Dict[str, Any],
+                      budget: SharedRateBudget | None, results: multiprocessing.Queue, profile_path: str | None = None,
+                      relay: DiscoveryRelay | None = None) -> None:
+    # Only the workers scan; the parent, which may be running network_scanner as __main__, never imports it
+    from network_scanner import Scanner
+    targets = expand_targets(target_specs, exclude, randomize=randomize, seed=seed)
+    if shard_ports:
+        ports = ports.subset(shard, shards)
+    else:
+        targets = itertools.islice(targets, shard, None, shards)
+    span = min(PORT_SPAN, (RAW_PORT_RANGE[1] - RAW_PORT_RANGE[0]) // shards)
+    max_in_flight = max(1, get_config('MAX_IN_FLIGHT') // shards)
+    max_hosts = max(1, get_config('MAX_CONCURRENT_HOSTS') // shards)
+    # Port shards all probe the same hosts, so they split the per-host cap as well
+    per_host = max(1, get_config('MAX_PROBES_PER_HOST') // shards) if shard_ports else None
+    if shard_ports and shard:
+        # Host-wide work (OS detection, reverse DNS) is left to the lead shard
+        options = {**options, 'os_detection': False, 'reverse_dns': False}
+    limiter = SharedTokenBucket(budget, grab=max(1, min(64, int(budget.rate / shards / 100)))) if budget else None
+    scanner = Scanner(max_in_flight=max_in_flight, max_probes_per_host=per_host, rate_limiter=limiter,
+                      raw_ports=(RAW_PORT_RANGE[0] + shard * span, span), max_concurrent_hosts=max_hosts,
+                      discovery_relay=relay, **options)
+    loop = asyncio.get_running_loop()
+    interval = get_config('STATS_INTERVAL')
+    stats = asyncio.create_task(log_stats(interval, lambda line: logger.info(f"Worker {shard}: {line}"))) if interval else None
+    try:
+        # Every worker profiles itself, into the profile file name suffixed with its shard
+        async with profile(f"{profile_path}.worker{shard}") if profile_path else contextlib.nullcontext():
+            async for local_index, event in scanner._iter_scan_indexed(targets, ports):
+                if isinstance(event, ScanResult):
+                    index = local_index if shard_ports else local_index * shards + shard
+                    # put blocks while the queue is full; waiting for the parent must not stall the probes
+                    await loop.run_in_executor(None, results.put, ('result', index, event.to_dict()))
+    finally:
+        if stats is not None:
+            stats.cancel()
+
+class ShardedScanner:
+    """Runs one scan across several worker processes, each with its own event loop and Scanner.
+
+    By default every worker takes every N-th target; with `shard_ports` every worker scans all
+    targets over every N-th port and the per-host results are merged; the first worker then
+    discovers the hosts for all of them and alone runs OS detection and reverse DNS. A
+    packets-per-second limit (MAX_PACKET_RATE) is enforced for the scan as a whole through
+    shared memory, and the in-flight and concurrent host budgets are split between the
+    workers. Results are yielded in target order, as soon as every shard before them has reported.
+    """
+
+    def __init__(self, workers: int | None = None, shard_ports: bool = False, profile: str | None = None,
+                 **scanner_options: Any):
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_ports = shard_ports
+        self.profile = profile  # Collapsed stacks file of the workers' sampling profiles, if any
+        # Passed on to every worker's Scanner (scan_mode, discovery, host_timeout, ...)
+        self.scanner_options = scanner_options
+
+    async def iter_scan(self, target_specs: Sequence[str], ports: str | PortSpec, exclude: Sequence[str] = (),
+                        randomize: bool = False, seed: int | None = None) -> AsyncIterator[ScanResult]:
+        context = multiprocessing.get_context('spawn')
+        port_spec = parse_ports(ports)
+        if randomize and seed is None:
+            seed = random.getrandbits(64)  # Every worker must walk the same permutation
+        rate = get_config('MAX_PACKET_RATE')
+        budget = SharedRateBudget(rate, context=context) if rate else None
+        results = context.Queue(maxsize=4096)
+        relays: List[DiscoveryRelay | None] = [None] * self.workers
+        if self.shard_ports and self.workers > 1:
+            inboxes = [context.Queue() for _ in range(self.workers - 1)]
+            relays = [DiscoveryRelay(outboxes=inboxes)] + [DiscoveryRelay(inbox=inbox) for inbox in inboxes]
+        processes = [context.Process(target=_run_worker, daemon=True,
+                                     args=(shard, self.workers, list(target_specs), list(exclude), randomize, seed,
+                                           port_spec, self.shard_ports, self.scanner_options, budget, results, self.profile,
+                                           relays[shard]))
+                     for shard in range(self.workers)]
+        logger.info(f"Starting {self.workers} scan workers, sharding by {'port' if self.shard_ports else 'target'}")
+        for process in processes:
+            process.start()
+
+        loop = asyncio.get_running_loop()
+        finished = set()
+        parts: Dict[int, List[ScanResult]] = {}
+        ready: Dict[int, ScanResult] = {}
+        details = PortDetailTable()
+        next_index = 0
+        try:
+            while len(finished) < self.workers:
+                kind, key, payload = await loop.run_in_executor(None, self._next_message, results, processes, finished)
+                if kind == 'done':
+                    finished.add(key)
+                    continue
+                if kind == 'error':
+                    raise RuntimeError(f"Scan worker {key} failed:\n{payload}")
+                result = ScanResult.from_dict(payload, details)
+                if self.shard_ports:
+                    host_parts = parts.setdefault(key, [])
+                    host_parts.append(result)
+                    if len(host_parts) < self.workers:
+                        continue
+                    result = merge_results(parts.pop(key), details)
+                ready[key] = result
+                while next_index in ready:
+                    yield ready.pop(next_index)
+                    next_index += 1
+            # Every shard is done; hosts some shard never reported follow in index order
+            for index in sorted(ready.keys() | parts.keys()):
+                yield ready[index] if index in ready else merge_results(parts[index], details)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            await loop.run_in_executor(None, self._join, processes)
+
+    async def scan(self, target_specs: Sequence[str], ports: str | PortSpec, exclude: Sequence[str] = (),
+                   randomize: bool = False, seed: int | None = None) -> List[ScanResult]:
+        return [result async for result in self.iter_scan(target_specs, ports, exclude, randomize, seed)]
+
+    @staticmethod
+    def _next_message(results: multiprocessing.Queue, processes: List[multiprocessing.Process],
+                      finished: set) -> Tuple[str, int, Any]:
+        while True:
+            try:
+                return results.get(timeout=0.5)
+            except queue.Empty:
+                for shard, process in enumerate(processes):
+                    if shard not in finished and process.exitcode is not None and results.empty():
+                        return 'error', shard, f"worker exited with code {process.exitcode} without reporting"
+
+    @staticmethod
+    def _join(processes: List[multiprocessing.Process]) -> None:
+        for process in processes:
+            process.join(timeout=5)
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from metrics import METRICS
+from packets import TCP_ACK, TCP_RST, TCP_SYN, TCPReply, ip_packet, source_address_for, tcp_segment
+from port_spec import AnsweredPorts
+from probe_scheduler import TokenBucket
+from raw_listener import RawTCPListener
+
+logger = logging.getLogger(__name__)
+
+class SynScanner:
+    """Stateless half-open scanner: replies arrive through a RawTCPListener and are matched by sequence cookie.
+
+    Pass the scan's shared listener to keep the raw socket count fixed; without one a private
+    listener is opened for the duration of each sweep.
+
+    Only open ports are kept with their address; closed ones are counted per address in `closed`.
+    """
+
+    def __init__(self, timeout: float = 1.0, retries: int = 1, batch_size: int = 256, source_port: int | None = None,
+                 listener: RawTCPListener | None = None, rate: TokenBucket | None = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_size = batch_size
+        self.listener = listener
+        self.rate = rate or TokenBucket(0)
+        self.source_port = source_port or (listener.allocate_port() if listener else random.randint(40000, 60999))
+        self._secret = os.urandom(16)
+        self._results: Dict[Tuple[str, int], str] = {}
+        self._answered = AnsweredPorts()
+        self.closed: Dict[str, int] = {}
+        self._kind = 'syn'
+        self._attempt = 0
+        self._until: float | None = None
+        self.timed_out = False
+
+    def cookie(self, ip: str, port: int) -> int:
+        """Initial sequence number for a probe to ip:port; replies are validated against it."""
+        digest = hashlib.blake2s(f"{ip}:{port}:{self.source_port}".encode(), key=self._secret, digest_size=4).digest()
+        return int.from_bytes(digest, 'big')
+
+    def _build_probe(self, ip: str, port: int, flags: int = TCP_SYN) -> bytes:
+        src_ip = source_address_for(ip)
+        cookie = self.cookie(ip, port)
+        # A bare ACK draws an RST whose sequence number echoes our acknowledgment number
+        ack = cookie if flags & TCP_ACK else 0
+        segment = tcp_segment(src_ip, ip, self.source_port, port, cookie, ack=ack, flags=flags)
+        return ip_packet(src_ip, ip, segment, ident=random.getrandbits(16))
+
+    def _on_reply(self, reply: TCPReply) -> None:
+        cookie = self.cookie(reply.src, reply.src_port)
+        if reply.flags & TCP_ACK:
+            if reply.ack != (cookie + 1) & 0xffffffff:
+                return  # Not an answer to one of our SYNs
+        elif not (reply.flags & TCP_RST and reply.seq == cookie):
+            return  # Not an answer to one of our ACKs
+        key = (reply.src, reply.src_port)
+        if reply.flags & TCP_SYN and reply.flags & TCP_ACK:
+            if key not in self._results:
+                METRICS.reply(self._kind, 'syn-ack')
+                if not self._answered.add(*key):
+                    self.closed[reply.src] -= 1  # An RST came first
+            self._results[key] = 'open'
+        elif reply.flags & TCP_RST and self._answered.add(*key):
+            self.closed[reply.src] = self.closed.get(reply.src, 0) + 1
+            METRICS.reply(self._kind, 'rst')
+
+    def _out_of_time(self) -> bool:
+        """Whether the sweep's time limit has passed; the sweep is then recorded as timed out."""
+        if self._until is not None and time.monotonic() >= self._until:
+            self.timed_out = True
+        return self.timed_out
+
+    async def _send(self, listener: RawTCPListener, probes: Iterable[Tuple[str, int]], flags: int) -> int:
+        sent = 0
+        batch: List[Tuple[bytes, str]] = []
+        for ip, port in probes:
+            batch.append((self._build_probe(ip, port, flags), ip))
+            if len(batch) >= self.batch_size:
+                if self._out_of_time():
+                    return sent
+                sent += await self._flush(listener, batch)
+                batch = []
+        if batch:
+            sent += await self._flush(listener, batch)
+        return sent
+
+    async def _flush(self, listener: RawTCPListener, batch: List[Tuple[bytes, str]]) -> int:
+        await self.rate.acquire(len(batch))
+        for packet, ip in batch:
+            try:
+                await listener.send(packet, ip)
+            except OSError as e:
+                logger.warning(f"Could not send SYN probe to {ip}: {str(e)}")
+        METRICS.sent(self._kind, len(batch), retry=self._attempt > 0)
+        # Give the receiver a turn between batches so replies are drained while we send
+        await asyncio.sleep(0)
+        return len(batch)
+
+    def answered_hosts(self) -> Set[str]:
+        """Addresses that have answered any probe so far, also while a sweep is still running."""
+        return self._answered.addresses()
+
+    async def scan(self, addresses: Sequence[str], ports: Sequence[int], flags: int = TCP_SYN,
+                   until: float | None = None) -> Dict[str, Dict[int, str]]:
+        """SYN-probe every address x port; returns {address: {port: 'open'}} and counts closed ports in
+        `closed`, unanswered ports are filtered.
+
+        With `until` (a time.monotonic() instant) no probe is sent and no reply awaited past it; a sweep
+        cut short sets `timed_out` and leaves the ports it did not get to unanswered.
+
+        With `flags=TCP_ACK` the sweep is an ACK ping: any RST counts the port closed and proves the host is up.
+        """
+        self._results = {}
+        self._answered = AnsweredPorts()
+        self.closed = {}
+        self._until = until
+        self.timed_out = False
+        self._kind = 'ack' if flags & TCP_ACK else 'syn'
+        listener = self.listener or RawTCPListener(port_base=self.source_port)
+        if not listener.is_open:
+            listener.open()
+        listener.subscribe(self.source_port, self._on_reply)
+        try:
+            # Only probes that drew no reply at all are retransmitted
+            for attempt in range(self.retries + 1):
+                self._attempt = attempt
+                sent = await self._send(listener, self._answered.unanswered(addresses, ports), flags)
+                if not sent:
+                    break
+                logger.info(f"Raw TCP pass {attempt + 1}: sent {sent} probes")
+                # Wait out the replies, though never past the time limit
+                await asyncio.sleep(self.timeout if self._until is None else max(0.0, min(self.timeout, self._until - time.monotonic())))
+                if self._out_of_time():
+                    break
+            # A probe answered on a retransmission did not time out; only the ones never answered did
+            METRICS.reply(self._kind, 'timeout', sum(1 for _ in self._answered.unanswered(addresses, ports)))
+        finally:
+            listener.unsubscribe(self.source_port)
+            if listener is not self.listener:
+                listener.close()
+
+        results: Dict[str, Dict[int, str]] = {ip: {} for ip in addresses}
+        for (ip, port), state in self._results.items():
+            if ip in results:
+                results[ip][port] = state
+        return results
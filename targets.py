@@ -0,0 +1,201 @@
+import bisect
+import ipaddress
+import logging
+import random
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SPLIT = re.compile(r'[,\s]+')
+_LAST_OCTET_RANGE = re.compile(r'^(\d+\.\d+\.\d+\.)(\d+)-(\d+)$')
+
+# IPv6 addresses are stored above the IPv4 space, so both families share one ordered integer line
+IPV6_BASE = 1 << 32
+
+def _to_int(address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> int:
+    return int(address) + IPV6_BASE if address.version == 6 else int(address)
+
+def format_address(value: int) -> str:
+    """The address string for an integer of the shared IPv4/IPv6 space."""
+    if value < IPV6_BASE:
+        return str(ipaddress.IPv4Address(value))
+    return str(ipaddress.IPv6Address(value - IPV6_BASE))
+
+def _parse_token(token: str) -> Tuple[int, int] | str:
+    """Turn one target token into an inclusive (first, last) integer range, or a hostname."""
+    if '/' in token:
+        network = ipaddress.ip_network(token, strict=False)
+        return _to_int(network.network_address), _to_int(network.broadcast_address)
+    match = _LAST_OCTET_RANGE.match(token)
+    if match:
+        prefix, first, last = match.groups()
+        start, end = int(ipaddress.IPv4Address(prefix + first)), int(ipaddress.IPv4Address(prefix + last))
+        if end < start:
+            raise ValueError(f"Empty address range: {token}")
+        return start, end
+    if '-' in token:
+        first, _, last = token.partition('-')
+        try:
+            first_address, last_address = ipaddress.ip_address(first), ipaddress.ip_address(last)
+        except ValueError:
+            return token  # Hostnames may contain dashes
+        if first_address.version != last_address.version:
+            raise ValueError(f"Address range mixes IPv4 and IPv6: {token}")
+        start, end = _to_int(first_address), _to_int(last_address)
+        if end < start:
+            raise ValueError(f"Empty address range: {token}")
+        return start, end
+    try:
+        address = _to_int(ipaddress.ip_address(token))
+        return address, address
+    except ValueError:
+        return token
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        # 255.255.255.255 and :: are neighbours on the integer line but not on the network
+        if merged and start <= merged[-1][1] + 1 and (start < IPV6_BASE) == (merged[-1][1] < IPV6_BASE):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _subtract(ranges: List[Tuple[int, int]], excluded: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    result: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        for ex_start, ex_end in excluded:
+            if ex_end < start or ex_start > end:
+                continue
+            if ex_start > start:
+                result.append((start, ex_start - 1))
+            start = ex_end + 1
+            if start > end:
+                break
+        if start <= end:
+            result.append((start, end))
+    return result
+
+def _read_target_file(path: str) -> Iterator[str]:
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield from (token for token in _SPLIT.split(line) if token)
+
+def _tokens(specs: Iterable[str]) -> Iterator[str]:
+    for spec in specs:
+        for token in _SPLIT.split(spec.strip()):
+            if not token:
+                continue
+            if token.startswith('@'):
+                yield from _read_target_file(token[1:])
+            else:
+                yield token
+
+class TargetSpec:
+    """Target specification compiled to merged integer address ranges and expanded lazily.
+
+    Accepts single addresses, CIDR blocks (10.0.0.0/8, 2001:db8::/120), last-octet ranges
+    (127.0.0.1-10), full ranges (10.0.0.1-10.0.3.255, 2001:db8::1-2001:db8::ff), hostnames,
+    comma or whitespace separated lists and `@file` references to files with one or more
+    targets per line; IPv4 and IPv6 targets can be mixed. Only the range boundaries are
+    stored, as integers, so iterating a /8 never materialises 16M strings.
+    """
+
+    def __init__(self, specs: Iterable[str], exclude: Iterable[str] = ()):
+        ranges: List[Tuple[int, int]] = []
+        hostnames: List[str] = []
+        for token in _tokens(specs):
+            parsed = _parse_token(token)
+            if isinstance(parsed, str):
+                hostnames.append(parsed)
+            else:
+                ranges.append(parsed)
+        excluded_ranges: List[Tuple[int, int]] = []
+        excluded_names = set()
+        for token in _tokens(exclude):
+            parsed = _parse_token(token)
+            if isinstance(parsed, str):
+                excluded_names.add(parsed)
+            else:
+                excluded_ranges.append(parsed)
+        self.ranges = _subtract(_merge(ranges), _merge(excluded_ranges))
+        self.hostnames = list(dict.fromkeys(name for name in hostnames if name not in excluded_names))
+        # Cumulative range sizes let an index be mapped to an address with one bisect
+        self._offsets: List[int] = []
+        total = 0
+        for start, end in self.ranges:
+            self._offsets.append(total)
+            total += end - start + 1
+        self.address_count = total
+
+    @property
+    def count(self) -> int:
+        """Number of targets; unlike len() not limited to sys.maxsize, which an IPv6 /64 exceeds."""
+        return self.address_count + len(self.hostnames)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.hostnames
+        for address in self.iter_addresses():
+            yield format_address(address)
+
+    def iter_addresses(self) -> Iterator[int]:
+        """Addresses as integers, in ascending order (IPv6 ones offset by IPV6_BASE)."""
+        for start, end in self.ranges:
+            yield from range(start, end + 1)
+
+    def iter_range(self, start: int, stop: int) -> Iterator[str]:
+        """Targets start..stop-1 in iteration order (hostnames first), skipping ahead without expanding."""
+        stop = min(stop, self.count)
+        names = len(self.hostnames)
+        yield from self.hostnames[start:stop]
+        index = max(start, names) - names
+        end = stop - names
+        if index >= end:
+            return
+        position = bisect.bisect_right(self._offsets, index) - 1
+        while index < end:
+            first, last = self.ranges[position]
+            address = first + index - self._offsets[position]
+            count = min(last - address + 1, end - index)
+            for value in range(address, address + count):
+                yield format_address(value)
+            index += count
+            position += 1
+
+    def address_at(self, index: int) -> int:
+        """The index-th address of the spec (ascending order) without expanding the ranges."""
+        position = bisect.bisect_right(self._offsets, index) - 1
+        return self.ranges[position][0] + index - self._offsets[position]
+
+    def shuffled(self, seed: int | None = None) -> Iterator[str]:
+        """Iterate in a pseudo-random permutation so consecutive probes land on different subnets.
+
+        Uses a full-period linear congruential generator over the next power of two and
+        skips out-of-range indices, so the permutation needs O(1) memory.
+        """
+        yield from self.hostnames
+        count = self.address_count
+        if count == 0:
+            return
+        rng = random.Random(seed)
+        modulus = 1 << max(2, (count - 1).bit_length())
+        multiplier = rng.randrange(1, max(2, modulus >> 2)) * 4 + 1  # a = 1 (mod 4)
+        increment = rng.randrange(0, modulus >> 1) * 2 + 1  # c odd
+        index = rng.randrange(modulus)
+        for _ in range(modulus):
+            index = (multiplier * index + increment) % modulus
+            if index < count:
+                yield format_address(self.address_at(index))
+
+def expand_targets(specs: Iterable[str], exclude: Iterable[str] = (), randomize: bool = False,
+                   seed: int | None = None) -> Iterator[str]:
+    """Lazily expand target specifications into individual targets."""
+    spec = TargetSpec(specs, exclude)
+    logger.info(f"Target specification expands to {spec.count} targets")
+    return spec.shuffled(seed) if randomize else iter(spec)
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import config
+from checkpoint import ScanCheckpoint
+
+PARAMS = {'targets': ['192.0.2.0/30'], 'exclude': [], 'seed': None, 'ports': '1-20', 'scan_type': 'connect',
+          'skip_discovery': True}
+
+@pytest.fixture
+def chunk_size(monkeypatch):
+    def use(size):
+        monkeypatch.setattr(config.CONFIG, 'CHECKPOINT_PORT_CHUNK', size)
+    return use
+
+def closed(port):
+    return {'port': port, 'state': 'closed'}
+
+def entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_finished_hosts_and_port_ranges_survive_a_resume(tmp_path, chunk_size):
+    chunk_size(10)
+    path = str(tmp_path / 'scan.journal')
+    checkpoint = ScanCheckpoint.create(path, PARAMS)
+    checkpoint.record_host(0, {'host': '192.0.2.1', 'state': 'down'})
+    progress = checkpoint.track(1, range(1, 21))
+    for port in range(1, 10):
+        progress.port_done(port, {'port': port, 'state': 'open'} if port == 5 else closed(port))
+    checkpoint.close()
+
+    resumed = ScanCheckpoint.resume(path)
+    assert resumed.params == PARAMS
+    assert resumed.is_done(0) and not resumed.is_done(1)
+    assert list(resumed.completed()) == [(0, {'host': '192.0.2.1', 'state': 'down'})]
+    progress = resumed.track(1, range(1, 21))
+    assert [port for port in range(1, 21) if progress.is_finished(port)] == list(range(1, 10))
+    assert progress.open_ports == [{'port': 5, 'state': 'open'}]
+    assert progress.port_counts == {'closed': 8, 'open': 1}
+    resumed.close()
+
+def test_ports_without_a_verdict_leave_their_range_pending(tmp_path, chunk_size):
+    chunk_size(2)
+    path = str(tmp_path / 'scan.journal')
+    checkpoint = ScanCheckpoint.create(path, {**PARAMS, 'ports': '1-4'})
+    progress = checkpoint.track(0, [1, 2, 3, 4])
+    progress.port_done(2, closed(2))
+    progress.port_done(3, closed(3))
+    progress.port_done(1, None)  # The probe failed
+    progress.port_done(4, closed(4))
+    checkpoint.close()
+    assert [entry['chunk'] for entry in entries(path) if entry['type'] == 'ports'] == [1, 2]
+
+    resumed = ScanCheckpoint.resume(path)
+    progress = resumed.track(0, [1, 2, 3, 4])
+    assert [port for port in (1, 2, 3, 4) if not progress.is_finished(port)] == [1]
+    resumed.close()
+
+def test_truncated_last_line_is_discarded(tmp_path):
+    path = str(tmp_path / 'scan.journal')
+    checkpoint = ScanCheckpoint.create(path, PARAMS)
+    checkpoint.record_host(0, {'host': '192.0.2.1', 'state': 'down'})
+    checkpoint.close()
+    with open(path, 'a') as f:
+        f.write('{"type":"host","index":1,"res')
+    resumed = ScanCheckpoint.resume(path)
+    assert resumed.is_done(0) and not resumed.is_done(1)
+    resumed.close()
+    assert len(entries(path)) == 2
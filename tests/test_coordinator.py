@@ -0,0 +1,55 @@
+import pytest
+
+from coordinator import WorkQueue
+
+HOST = {'host': '192.0.2.1', 'state': 'up', 'ports': [], 'scan_time': 1.0, 'os_guess': 'Unknown'}
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), max_attempts=2)
+    yield queue
+    queue.close()
+
+def test_job_is_split_into_units(queue):
+    job_id = queue.create_job(['192.0.2.0/28'], '22,80', unit_size=8, port_shards=2)
+    assert queue.progress(job_id)['pending'] == 4
+    unit = queue.lease('a', 60)
+    assert (unit.target_start, unit.target_stop, unit.port_shard, unit.port_shards) == (0, 8, 0, 2)
+
+def test_a_held_lease_is_not_handed_out_twice(queue):
+    queue.create_job(['192.0.2.1'], '22')
+    assert queue.lease('a', 60) is not None
+    assert queue.lease('b', 60) is None
+
+def test_an_expired_lease_moves_to_another_worker(queue):
+    queue.create_job(['192.0.2.1'], '22')
+    first = queue.lease('a', -1)
+    second = queue.lease('b', 60)
+    assert second.id == first.id
+    assert not queue.renew(first.id, 'a', 60)
+    assert not queue.complete(first.id, 'a', [(0, HOST)])
+    assert queue.complete(second.id, 'b', [(0, HOST)])
+    assert queue.progress()['done'] == 1
+    assert [result.host for result in queue.results(first.job_id)] == ['192.0.2.1']
+
+def test_renew_keeps_the_lease(queue):
+    queue.create_job(['192.0.2.1'], '22')
+    unit = queue.lease('a', -1)
+    assert queue.renew(unit.id, 'a', 60)
+    assert queue.lease('b', 60) is None
+
+def test_unit_fails_after_max_attempts(queue):
+    job_id = queue.create_job(['192.0.2.1'], '22')
+    queue.lease('a', -1)
+    queue.lease('b', -1)
+    assert queue.lease('c', 60) is None
+    assert queue.progress(job_id)['failed'] == 1
+
+def test_failed_unit_is_retried_until_attempts_run_out(queue):
+    job_id = queue.create_job(['192.0.2.1'], '22')
+    unit = queue.lease('a', 60)
+    queue.fail(unit.id, 'a', 'boom')
+    assert queue.progress(job_id)['pending'] == 1
+    unit = queue.lease('b', 60)
+    queue.fail(unit.id, 'b', 'boom')
+    assert queue.progress(job_id)['failed'] == 1
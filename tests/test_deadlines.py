@@ -0,0 +1,30 @@
+import asyncio
+
+from network_scanner import Scanner
+from timing import HostDeadline
+
+class TimingOutDetector:
+    async def detect(self, target, port, sock=None):
+        raise asyncio.TimeoutError
+
+def test_phase_budget_bounds_timeouts_and_records_expiry():
+    deadline = HostDeadline(phases={'service': 0.0001})
+    assert deadline.remaining('ports') is None
+    assert deadline.bound('ports', 2.0) == 2.0
+    assert deadline.remaining('service') > 0  # starts the phase's clock
+    asyncio.run(asyncio.sleep(0.001))
+    assert deadline.bound('service', 2.0) == 0.0
+    assert deadline.expired('service')
+    assert deadline.timed_out == ['service']
+
+def test_service_timeout_without_a_host_deadline():
+    scanner = Scanner(discovery=False)
+    scanner._service_detector = TimingOutDetector()
+    assert asyncio.run(scanner._get_service_version('192.0.2.1', 80)) == {}
+
+def test_service_timeout_marks_the_phase_expired():
+    scanner = Scanner(discovery=False)
+    scanner._service_detector = TimingOutDetector()
+    deadline = HostDeadline(phases={'service': 5})
+    assert asyncio.run(scanner._get_service_version('192.0.2.1', 80, deadline=deadline)) == {}
+    assert deadline.timed_out == ['service']
@@ -0,0 +1,29 @@
+import asyncio
+import contextlib
+import socket
+
+from discovery import HostDiscovery
+from timing import HostTimingTable
+
+class SlowScheduler:
+    """Holds every probe back before granting its slot, as a busy scheduler would."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str):
+        await asyncio.sleep(self.delay)
+        yield
+
+def test_connect_ping_times_the_connect_only():
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        port = listener.getsockname()[1]
+        timing = HostTimingTable(1.0, 0.001, 5.0)
+        discovery = HostDiscovery(['connect'], [port], timing, scheduler=SlowScheduler(0.2))
+        alive = set()
+        asyncio.run(discovery._connect_ping(['127.0.0.1'], alive))
+    assert alive == {'127.0.0.1'}
+    assert timing.get('127.0.0.1').srtt < 0.1
@@ -0,0 +1,27 @@
+from metrics import OTHER_HOSTS, Histogram, ScanMetrics
+
+def test_histogram_folds_least_recent_hosts_into_other():
+    histogram = Histogram('latency', 'help', (0.01, 0.1), 'host', max_series=2)
+    for host in ('a', 'b', 'a', 'c'):
+        histogram.observe(0.005, host)
+    lines = histogram.render()
+    assert any('host="other"' in line for line in lines)
+    assert not any('host="b"' in line for line in lines)
+    assert set(histogram._series) == {'a', 'c', OTHER_HOSTS}
+
+def test_render_without_hosts_sums_every_series():
+    metrics = ScanMetrics(max_hosts=4)
+    metrics.connect_latency.observe(0.003, '192.0.2.1')
+    metrics.connect_latency.observe(0.2, '192.0.2.2')
+    text = metrics.render(per_host=False)
+    assert '192.0.2.' not in text
+    assert 'scanner_connect_latency_seconds_count 2' in text
+    assert 'scanner_connect_latency_seconds_bucket{le="0.005"} 1' in text
+    assert '192.0.2.1' in metrics.render()
+
+def test_zero_reply_counts_are_ignored():
+    metrics = ScanMetrics(max_hosts=4)
+    metrics.reply('connect', 'timeout', 0)
+    metrics.reply('connect', 'open', 2)
+    assert metrics.replies.values == {('connect', 'open'): 2}
+    assert metrics.timeouts.total() == 0
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from middlebox import CANARY_RANGE, AcceptAllDetector, wilson_lower_bound
+
+OPEN = {'state': 'open'}
+CLOSED = {'state': 'closed'}
+
+def test_wilson_lower_bound_known_values():
+    assert wilson_lower_bound(0, 0) == 0.0
+    assert wilson_lower_bound(0, 10) == pytest.approx(0.0, abs=1e-12)
+    assert wilson_lower_bound(10, 10) == pytest.approx(0.7225, abs=1e-4)
+    assert wilson_lower_bound(50, 100) == pytest.approx(0.4038, abs=1e-4)
+
+def test_wilson_lower_bound_tightens_with_more_trials():
+    bounds = [wilson_lower_bound(trials, trials) for trials in (5, 20, 80)]
+    assert bounds == sorted(bounds) and bounds[-1] < 1.0
+
+def test_plan_skips_hosts_with_too_few_ports():
+    detector = AcceptAllDetector(16, 3, 0.5, random.Random(1))
+    assert detector.plan(list(range(1, 32))) == ([], [])
+    assert AcceptAllDetector(0, 3, 0.5).plan(list(range(1, 1000))) == ([], [])
+
+def test_plan_picks_canaries_outside_the_scanned_ports():
+    ports = list(range(1, 1025))
+    sample, canaries = AcceptAllDetector(16, 3, 0.5, random.Random(1)).plan(ports)
+    assert len(set(sample)) == 16 and set(sample) <= set(ports)
+    assert len(set(canaries)) == 3
+    assert all(CANARY_RANGE[0] <= port <= CANARY_RANGE[1] and port not in ports for port in canaries)
+
+def test_plan_falls_back_to_unsampled_ports_on_a_full_range():
+    ports = list(range(1, 65536))
+    sample, canaries = AcceptAllDetector(16, 3, 0.5, random.Random(1)).plan(ports)
+    assert len(canaries) == 3 and not set(canaries) & set(sample)
+
+def test_accept_all_needs_open_canaries_and_a_confident_open_share():
+    detector = AcceptAllDetector(16, 3, 0.5)
+    assert detector.is_accept_all([OPEN] * 16, [OPEN] * 3)
+    assert not detector.is_accept_all([OPEN] * 16, [OPEN, OPEN, CLOSED])
+    assert not detector.is_accept_all([OPEN] * 16, [OPEN, OPEN, None])
+    # 10 of 16 open is over the ratio, but not with 95% confidence
+    assert not detector.is_accept_all([OPEN] * 10 + [CLOSED] * 6, [OPEN] * 3)
+
+def test_unprobed_sample_ports_are_left_out_of_the_share():
+    detector = AcceptAllDetector(16, 3, 0.5)
+    assert detector.is_accept_all([OPEN] * 12 + [None] * 4, [OPEN] * 3)
+    assert not detector.is_accept_all([None] * 16, [OPEN] * 3)
@@ -0,0 +1,147 @@
+import asyncio
+import socket
+
+import config
+from network_scanner import Scanner
+from packets import TCP_ACK, TCP_RST, TCPReply
+from scan_result import OS_NO_OPEN_PORT
+from service_detection import ServiceDatabase, ServiceDetector, ServiceProbe
+
+class CountingBucket:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire(self, tokens: float = 1) -> None:
+        self.acquired += tokens
+
+def test_syn_results_are_described_in_slots_bounded_per_host():
+    scanner = Scanner(discovery=False, max_probes_per_host=3)
+    peak = {'running': 0, 'max': 0, 'in_flight': 0}
+
+    async def describe(target, port, sock=None, deadline=None, phases=None):
+        peak['running'] += 1
+        peak['max'] = max(peak['max'], peak['running'])
+        peak['in_flight'] = max(peak['in_flight'], scanner._scheduler.in_flight)
+        await asyncio.sleep(0.01)
+        peak['running'] -= 1
+        return {'port': port, 'state': 'open'}
+
+    scanner._describe_open_port = describe
+    port_states = {port: 'open' for port in range(1, 21)}
+    port_states[21] = 'closed'
+    records = asyncio.run(scanner._describe_syn_results('192.0.2.1', port_states))
+    assert [record['port'] for record in records] == list(range(1, 21))
+    assert peak['max'] == 3 and peak['in_flight'] == 3
+    assert scanner._scheduler.in_flight == 0
+
+def test_detector_paces_every_connection_it_opens():
+    async def main():
+        async def hang_up(reader, writer):
+            writer.close()
+
+        server = await asyncio.start_server(hang_up, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        probes = [ServiceProbe(name, payload, frozenset([port]), 1, 0.5, [])
+                  for name, payload in (('NULL', b''), ('First', b'a\r\n'), ('Second', b'b\r\n'))]
+        bucket = CountingBucket()
+        detector = ServiceDetector(ServiceDatabase(probes, {}), 0.5, 5.0, 1, rate=bucket)
+        async with server:
+            await detector.detect('127.0.0.1', port)
+        return bucket.acquired
+
+    # The peer hangs up after every probe, so each of them needs a connection of its own
+    assert asyncio.run(main()) == 3
+
+def test_connect_sweep_runs_a_fixed_pool_of_probes(monkeypatch):
+    monkeypatch.setattr(config.CONFIG, 'FILTER_SAMPLE_SIZE', 0)
+    scanner = Scanner(discovery=False, max_probes_per_host=4, os_detection=False, reverse_dns=False)
+    running = {'now': 0, 'max': 0, 'ports': []}
+
+    async def scan_port(target, port, deadline=None, phases=None):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        running['ports'].append(port)
+        await asyncio.sleep(0)
+        running['now'] -= 1
+        return {'port': port, 'state': 'open' if port == 2000 else 'closed'}
+
+    scanner.scan_port = scan_port
+    result, = asyncio.run(scanner.scan(['192.0.2.1'], '1-2000'))
+    assert running['max'] == 4
+    common = [port for port in Scanner.get_common_ports() if port <= 2000]
+    assert running['ports'][:len(common)] == common and sorted(running['ports']) == list(range(1, 2001))
+    assert result.port_counts['closed'] == 1999 and [port['port'] for port in result.ports] == [2000]
+
+def closed_ports(count):
+    ports = []
+    for _ in range(count):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            ports.append(sock.getsockname()[1])
+    return ports
+
+def connections_per_open_port(monkeypatch, sample_size):
+    """Scan five SSH-like listeners among closed ports and count the connections each one accepted."""
+    monkeypatch.setattr(config.CONFIG, 'FILTER_SAMPLE_SIZE', sample_size)
+    monkeypatch.setattr(config.CONFIG, 'FILTER_CANARY_PORTS', 1)
+
+    async def main():
+        accepted = {}
+
+        async def greet(reader, writer):
+            port = writer.get_extra_info('sockname')[1]
+            accepted[port] = accepted.get(port, 0) + 1
+            writer.write(b"SSH-2.0-OpenSSH_8.9p1 Ubuntu-3ubuntu0.6\r\n")
+            await writer.drain()
+            await reader.read()
+            writer.close()
+
+        servers = [await asyncio.start_server(greet, '127.0.0.1', 0) for _ in range(5)]
+        open_ports = [server.sockets[0].getsockname()[1] for server in servers]
+        scanner = Scanner(discovery=False, os_detection=False, reverse_dns=False)
+        result, = await scanner.scan(['127.0.0.1'], ','.join(map(str, open_ports + closed_ports(5))))
+        for server in servers:
+            server.close()
+        return open_ports, accepted, result, scanner
+
+    open_ports, accepted, result, scanner = asyncio.run(main())
+    assert sorted(port['port'] for port in result.ports) == sorted(open_ports)
+    assert all(port['service'] == 'ssh' for port in result.ports)
+    assert scanner._held == 0
+    return [accepted.get(port, 0) for port in open_ports]
+
+def test_sampled_open_ports_are_described_over_their_connection(monkeypatch):
+    assert connections_per_open_port(monkeypatch, 5) == [1] * 5
+
+def test_version_probe_reuses_the_connect_scan_connection(monkeypatch):
+    assert connections_per_open_port(monkeypatch, 0) == [1] * 5
+
+def test_host_without_open_ports_is_not_fingerprinted(monkeypatch):
+    monkeypatch.setattr(config.CONFIG, 'FILTER_SAMPLE_SIZE', 0)
+    scanner = Scanner(discovery=False, os_detection=True, reverse_dns=False)
+
+    async def get_os_guess(*args, **kwargs):
+        raise AssertionError("a closed port was probed for the OS")
+
+    scanner._get_os_guess = get_os_guess
+    result, = asyncio.run(scanner.scan(['127.0.0.1'], ','.join(map(str, closed_ports(3)))))
+    assert result.os_guess == OS_NO_OPEN_PORT and result.port_counts['closed'] == 3
+
+def test_rst_answer_to_the_os_probe_is_not_fingerprinted():
+    class RejectingListener:
+        """Answers every probe with the RST of a closed port."""
+
+        def allocate_port(self):
+            return 50000
+
+        def expect(self, target, port, src_port, ack):
+            self.reply = asyncio.get_running_loop().create_future()
+            self.reply.set_result(TCPReply(target, port, src_port, 0, ack, TCP_RST | TCP_ACK, 0, 64, b''))
+            return self.reply
+
+        async def send(self, packet, ip):
+            pass
+
+    scanner = Scanner(discovery=False, os_detection=True, reverse_dns=False)
+    scanner._raw_listener = RejectingListener()
+    assert asyncio.run(scanner._get_os_guess('192.0.2.1', 80)) == OS_NO_OPEN_PORT
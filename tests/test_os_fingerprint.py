@@ -0,0 +1,18 @@
+from os_fingerprint import fingerprint_from_reply, initial_ttl, parse_options
+from packets import TCP_ACK, TCP_SYN, TCPReply
+
+# MSS 1460, SACK permitted, timestamps, NOP, window scale 7
+LINUX_OPTIONS = bytes.fromhex('020405b40402080a0000000100000000' '01030307')
+
+def test_parse_options():
+    assert parse_options(LINUX_OPTIONS) == ('M,S,T,N,W', 1460, 7)
+    assert parse_options(b'') == ('', None, None)
+
+def test_initial_ttl_rounds_up_to_a_common_value():
+    assert [initial_ttl(ttl) for ttl in (30, 57, 64, 113, 240)] == [32, 64, 64, 128, 255]
+
+def test_fingerprint_from_reply():
+    reply = TCPReply('192.0.2.1', 22, 50000, 1, 2, TCP_SYN | TCP_ACK, 64240, 57, LINUX_OPTIONS)
+    fingerprint = fingerprint_from_reply(reply)
+    assert (fingerprint.ttl, fingerprint.initial_ttl, fingerprint.window) == (57, 64, 64240)
+    assert (fingerprint.options, fingerprint.mss, fingerprint.wscale, fingerprint.df) == ('M,S,T,N,W', 1460, 7, True)
@@ -0,0 +1,55 @@
+import pytest
+
+from port_spec import MAX_PORT, TOP_TCP_PORTS, TOP_UDP_PORTS, AnsweredPorts, PortSpec, parse_ports
+
+def test_ports_and_ranges():
+    spec = PortSpec('22,80-82, 8080')
+    assert list(spec.tcp_ports) == [22, 80, 81, 82, 8080]
+    assert len(spec) == 5
+    assert 81 in spec and 83 not in spec and 0 not in spec and MAX_PORT + 1 not in spec
+    assert list(spec.udp_ports) == []
+
+def test_open_ended_ranges():
+    assert list(PortSpec('-3').tcp_ports) == [1, 2, 3]
+    assert list(PortSpec('65534-').tcp_ports) == [65534, 65535]
+
+def test_protocol_prefixes_apply_to_following_items():
+    spec = PortSpec('T:80,443,U:53,161,T:22')
+    assert list(spec.tcp_ports) == [22, 80, 443]
+    assert list(spec.udp_ports) == [53, 161]
+    assert spec.has(53, 'udp') and not spec.has(53, 'tcp')
+
+def test_top_ports():
+    assert list(PortSpec('top-10').tcp_ports) == sorted(TOP_TCP_PORTS[:10])
+    assert list(PortSpec('U:top-5').udp_ports) == sorted(TOP_UDP_PORTS[:5])
+
+@pytest.mark.parametrize('spec', ['0', '70000', '10-5', 'X:80', 'http'])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        PortSpec(spec)
+
+def test_ordered_moves_given_ports_first():
+    assert PortSpec('1-6').ordered([5, 99, 2, 5]) == [5, 2, 1, 3, 4, 6]
+
+def test_subsets_are_disjoint_and_cover_the_spec():
+    spec = PortSpec('1-100,U:53,123,161')
+    shards = [spec.subset(index, 3) for index in range(3)]
+    for protocol in ('tcp', 'udp'):
+        ports = [port for shard in shards for port in shard.ports(protocol)]
+        assert sorted(ports) == list(spec.ports(protocol))
+        assert len(ports) == len(set(ports))
+
+def test_parse_ports_reuses_compiled_specs():
+    spec = parse_ports('1-1024')
+    assert parse_ports(' 1-1024 ') is spec
+    assert parse_ports(spec) is spec
+
+def test_answered_ports_yields_only_unanswered_pairs():
+    answered = AnsweredPorts()
+    assert answered.add('192.0.2.1', 80)
+    assert not answered.add('192.0.2.1', 80)
+    assert answered.add('192.0.2.2', 65535)
+    assert ('192.0.2.1', 80) in answered and ('192.0.2.1', 81) not in answered
+    pending = answered.unanswered(['192.0.2.1', '192.0.2.2'], [80, 65535])
+    assert list(pending) == [('192.0.2.2', 80), ('192.0.2.1', 65535)]
+    assert answered.addresses() == {'192.0.2.1', '192.0.2.2'}
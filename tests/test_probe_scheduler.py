@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+from probe_scheduler import ProbeScheduler, TokenBucket
+
+def test_burst_is_available_at_once():
+    bucket = TokenBucket(10, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+def test_bucket_refills_at_the_rate():
+    bucket = TokenBucket(100, burst=1)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    time.sleep(0.02)
+    assert bucket.try_acquire()
+
+def test_zero_rate_is_unlimited():
+    bucket = TokenBucket(0)
+    assert all(bucket.try_acquire() for _ in range(1000))
+    asyncio.run(bucket.acquire(1000))
+
+def test_acquire_paces_callers_past_the_burst():
+    async def main():
+        bucket = TokenBucket(50, burst=1)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    # One token from the burst, then five more at 20 ms each
+    assert 0.09 <= asyncio.run(main()) < 0.5
+
+def test_scheduler_caps_probes_per_host_and_in_total():
+    async def main():
+        scheduler = ProbeScheduler(max_in_flight=3, per_host=2)
+        peak = {'total': 0}
+        per_host = {}
+
+        async def probe(host):
+            async with scheduler.slot(host):
+                per_host[host] = per_host.get(host, 0) + 1
+                peak['total'] = max(peak['total'], scheduler.in_flight)
+                peak[host] = max(peak.get(host, 0), per_host[host])
+                await asyncio.sleep(0.01)
+                per_host[host] -= 1
+
+        await asyncio.gather(*(probe(host) for host in ['a'] * 6 + ['b'] * 6))
+        return scheduler, peak
+
+    scheduler, peak = asyncio.run(main())
+    assert peak == {'total': 3, 'a': 2, 'b': 2}
+    assert scheduler.in_flight == 0 and scheduler.queued == 0
+
+def test_freed_slots_go_round_robin_across_hosts():
+    async def main():
+        scheduler = ProbeScheduler(max_in_flight=1, per_host=1)
+        order = []
+        await scheduler.acquire('holder')
+
+        async def probe(host):
+            await scheduler.acquire(host)
+            order.append(host)
+            scheduler.release(host)
+
+        tasks = [asyncio.create_task(probe(host)) for host in ['a', 'a', 'a', 'b', 'b']]
+        await asyncio.sleep(0)
+        scheduler.release('holder')
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ['a', 'b', 'a', 'b', 'a']
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def main():
+        scheduler = ProbeScheduler(max_in_flight=1, per_host=1)
+        await scheduler.acquire('a')
+        waiter = asyncio.create_task(scheduler.acquire('b'))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release('a')
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    assert scheduler.in_flight == 0 and scheduler.queued == 0
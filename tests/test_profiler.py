@@ -0,0 +1,37 @@
+import re
+import time
+
+from profiler import PHASE_FUNCTIONS, SamplingProfiler
+
+FRAME = re.compile(r'\S+ \(.+:\d+\)')
+
+def _get_os_guess(seconds):
+    """Named after a profiled phase, so its busy time counts as 'os'."""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(100))
+
+def test_busy_time_is_attributed_to_the_phase_function(tmp_path):
+    profiler = SamplingProfiler(interval=0.002)
+    profiler.start()
+    try:
+        _get_os_guess(0.3)
+    finally:
+        profiler.stop()
+    assert PHASE_FUNCTIONS['_get_os_guess'] == 'os'
+    # Stopping the profiler may itself be sampled, but the busy loop dominates
+    assert max(profiler.phase_shares(), key=profiler.phase_shares().get) == 'os'
+
+    path = tmp_path / 'profile.folded'
+    profiler.write_collapsed(str(path))
+    lines = path.read_text().splitlines()
+    assert lines
+    total = 0
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        thread, phase, *frames = stack.split(';')
+        assert thread and phase and frames and all(FRAME.fullmatch(frame) for frame in frames)
+        total += int(count)
+    assert total == sum(profiler.samples.values())
+    main = [line for line in lines if line.startswith('MainThread;os;')]
+    assert main and all(re.search(r';_get_os_guess \(test_profiler\.py:\d+\)', line) for line in main)
@@ -0,0 +1,109 @@
+import ctypes
+import errno
+import socket
+import struct
+
+import pytest
+
+import raw_listener
+from packets import TCP_RST, TCP_SYN
+from raw_listener import SO_ATTACH_FILTER, RawTCPListener, _bpf_program, _bpf_program6
+
+PROGRAMS = [(_bpf_program, socket.AF_INET), (_bpf_program6, socket.AF_INET6)]
+BPF_JMP = 0x05
+BPF_RET = 0x06
+
+def instructions(program: bytes):
+    return [struct.unpack('HBBI', program[offset:offset + 8]) for offset in range(0, len(program), 8)]
+
+def run(program: bytes, packet: bytes) -> int:
+    """A tiny interpreter for the instructions the filters use."""
+    a = x = pc = 0
+    code = instructions(program)
+    while True:
+        op, jt, jf, k = code[pc]
+        if op == 0x30:
+            a = packet[k]
+        elif op == 0x28:
+            a = struct.unpack_from('!H', packet, k)[0]
+        elif op == 0x48:
+            a = struct.unpack_from('!H', packet, x + k)[0]
+        elif op == 0x50:
+            a = packet[x + k]
+        elif op == 0xb1:
+            x = 4 * (packet[k] & 0xf)
+        elif op == BPF_RET:
+            return k
+        else:
+            taken = {0x15: a == k, 0x35: a >= k, 0x25: a > k, 0x45: bool(a & k)}[op]
+            pc += jt if taken else jf
+        pc += 1
+
+def tcp(port: int, flags: int) -> bytes:
+    return struct.pack('!HHIIBBHHH', 40000, port, 0, 0, 5 << 4, flags, 0, 0, 0)
+
+def ipv4(segment: bytes, protocol: int = socket.IPPROTO_TCP) -> bytes:
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0, 0, 64, protocol, 0,
+                       socket.inet_aton('10.0.0.1'), socket.inet_aton('10.0.0.2')) + segment
+
+@pytest.mark.parametrize('build, family', PROGRAMS)
+def test_jumps_stay_inside_the_program(build, family):
+    code = instructions(build(50000, 50999))
+    assert code[-1][0] == BPF_RET
+    for pc, (op, jt, jf, _) in enumerate(code):
+        if op & 0x07 == BPF_JMP:
+            assert pc + 1 + jt < len(code)
+            assert pc + 1 + jf < len(code)
+
+@pytest.mark.parametrize('port, flags, accepted', [
+    (50000, TCP_SYN, True), (50999, TCP_RST, True), (49999, TCP_SYN, False), (51000, TCP_SYN, False), (50500, 0x10, False),
+])
+def test_filters_accept_syn_or_rst_in_range(port, flags, accepted):
+    assert bool(run(_bpf_program6(50000, 50999), tcp(port, flags))) == accepted
+    assert bool(run(_bpf_program(50000, 50999), ipv4(tcp(port, flags)))) == accepted
+
+def test_ipv4_filter_drops_other_protocols():
+    assert run(_bpf_program(50000, 50999), ipv4(tcp(50000, TCP_SYN), socket.IPPROTO_UDP)) == 0
+
+@pytest.mark.parametrize('build, family', PROGRAMS)
+def test_kernel_accepts_the_filter(build, family):
+    try:
+        sock = socket.socket(family, socket.SOCK_RAW, socket.IPPROTO_TCP)
+    except OSError as e:
+        pytest.skip(f"No raw socket: {str(e)}")
+    with sock:
+        program = build(50000, 50999)
+        buffer = ctypes.create_string_buffer(program)
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HL', len(program) // 8, ctypes.addressof(buffer)))
+
+class Refusing:
+    """A raw socket stand-in that refuses filters and holds the given packets."""
+
+    def __init__(self, packets=()):
+        self.packets = list(packets)
+
+    def setsockopt(self, *args):
+        raise OSError(errno.ENOPROTOOPT, "Protocol not available")
+
+    def recv(self, size):
+        if not self.packets:
+            raise BlockingIOError
+        return self.packets.pop(0)
+
+def test_packets_are_filtered_before_parsing_without_bpf(monkeypatch, caplog):
+    parsed = []
+    monkeypatch.setattr(raw_listener, 'parse_tcp_reply', lambda data: parsed.append(data))
+    listener = RawTCPListener(port_base=50000, port_span=1000)
+    assert not listener._attach_filter(Refusing(), _bpf_program)
+    assert 'filtering raw TCP replies in user space' in caplog.text
+    wanted = ipv4(tcp(50999, TCP_SYN | 0x10))
+    listener._receiver = Refusing([ipv4(tcp(51000, TCP_SYN)), ipv4(tcp(50000, 0x10)), ipv4(tcp(50000, TCP_RST), socket.IPPROTO_UDP),
+                                   ipv4(b'\x00'), wanted])
+    listener._user_filter = True
+    listener._on_readable()
+    assert parsed == [wanted]
+
+@pytest.mark.parametrize('port, flags, accepted', [(50000, TCP_RST, True), (49999, TCP_SYN, False), (50500, 0x10, False)])
+def test_user_space_filter_matches_the_ipv6_program(port, flags, accepted):
+    listener = RawTCPListener(port_base=50000, port_span=1000)
+    assert listener._accepts(tcp(port, flags), 0) == accepted == bool(run(_bpf_program6(50000, 50999), tcp(port, flags)))
@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import types
+
+import pytest
+
+import resolver
+from resolver import NEGATIVE_TTL, DNSCache, Resolver
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the cache's clock; the event loop keeps the real one
+    monkeypatch.setattr(resolver, 'time', types.SimpleNamespace(monotonic=clock))
+    return clock
+
+def test_answers_expire_after_their_ttl(clock):
+    cache = DNSCache()
+    cache.put('forward', 'host.example', '192.0.2.1', 30)
+    clock.now += 29
+    assert cache.get('forward', 'host.example') == (True, '192.0.2.1')
+    clock.now += 2
+    assert cache.get('forward', 'host.example') == (False, None)
+    assert len(cache) == 0
+
+def test_cache_drops_the_least_recently_used_answer():
+    cache = DNSCache(max_entries=2)
+    cache.put('forward', 'a.example', '192.0.2.1', 60)
+    cache.put('forward', 'b.example', '192.0.2.2', 60)
+    cache.get('forward', 'a.example')
+    cache.put('reverse', '192.0.2.3', 'c.example', 60)
+    assert len(cache) == 2
+    assert cache.get('forward', 'b.example') == (False, None)
+    assert cache.get('forward', 'a.example') == (True, '192.0.2.1')
+
+def test_failures_are_cached_for_the_negative_ttl(clock):
+    queries = []
+
+    async def query(name):
+        queries.append(name)
+        return None
+
+    async def lookup(client):
+        return await client._lookup('forward', 'missing.example', query)
+
+    client = Resolver(ttl=3600, cache=DNSCache())
+    assert asyncio.run(lookup(client)) is None
+    assert asyncio.run(lookup(client)) is None
+    assert queries == ['missing.example']
+    clock.now += NEGATIVE_TTL + 1
+    asyncio.run(lookup(client))
+    assert queries == ['missing.example'] * 2
+
+def test_concurrent_lookups_share_one_query():
+    queries = []
+
+    async def query(name):
+        queries.append(name)
+        await asyncio.sleep(0.01)
+        return '192.0.2.1'
+
+    async def main():
+        client = Resolver(cache=DNSCache())
+        return await asyncio.gather(*[client._lookup('forward', 'host.example', query) for _ in range(5)])
+
+    assert asyncio.run(main()) == ['192.0.2.1'] * 5
+    assert queries == ['host.example']
+
+def test_system_resolver_without_aiodns(monkeypatch):
+    monkeypatch.setattr(resolver, 'aiodns', None)
+    client = Resolver(cache=DNSCache())
+    assert client._aiodns() is None
+    assert asyncio.run(client.resolve('localhost')) in ('127.0.0.1', '::1')
+    assert asyncio.run(client.resolve('2001:DB8::1')) == '2001:db8::1'
+
+def test_aiodns_falls_back_to_an_ipv6_address(monkeypatch):
+    class DNSError(Exception):
+        pass
+
+    class FakeResolver:
+        async def gethostbyname(self, name, family):
+            if family == socket.AF_INET:
+                raise DNSError(4, 'no A record')
+            return types.SimpleNamespace(addresses=['2001:db8::7'])
+
+    monkeypatch.setattr(resolver, 'aiodns', types.SimpleNamespace(DNSResolver=FakeResolver, error=types.SimpleNamespace(DNSError=DNSError)))
+    assert asyncio.run(Resolver(cache=DNSCache()).resolve('v6only.example')) == '2001:db8::7'
@@ -0,0 +1,45 @@
+import gc
+import weakref
+
+from scan_result import PortDetailTable, ScanResult
+
+SSH = {'port': 22, 'state': 'open', 'service': 'ssh', 'version': '8.9p1', 'product': 'OpenSSH'}
+DNS = {'port': 53, 'protocol': 'udp', 'state': 'open|filtered', 'service': 'domain', 'version': 'Unknown'}
+
+def test_packed_fields_read_back_as_given():
+    result = ScanResult('192.0.2.1', 'up', [SSH, DNS], 1.5, 'Linux 5.x', port_counts={'open': 1, 'closed': 98},
+                        timed_out=['service'], hostname='host.example', timings={'ports': 1.25, 'service': 0.125})
+    assert result.ports == [SSH, DNS]
+    assert result.port_counts == {'open': 1, 'closed': 98}
+    assert result.timed_out == ['service']
+    assert result.timings['ports'] == 1.25 and result.timings['os'] == 0.0
+    assert ScanResult.from_dict(result.to_dict()).to_dict() == result.to_dict()
+
+def test_timings_keep_microseconds():
+    result = ScanResult('192.0.2.1', 'up', [], 1.0, 'Unknown', timings={'ports': 1234.567891, 'os': 0.000001})
+    assert result.timings['ports'] == 1234.567891
+    assert result.timings['os'] == 0.000001
+
+def test_results_of_a_scan_share_their_details_table():
+    details = PortDetailTable()
+    first = ScanResult('192.0.2.1', 'up', [SSH], 1.0, 'Unknown', details=details)
+    second = ScanResult('192.0.2.2', 'up', [{**SSH, 'port': 2222}], 1.0, 'Unknown', details=details)
+    assert len(details) == 1
+    assert second.ports[0]['port'] == 2222 and second.ports[0]['product'] == 'OpenSSH'
+    assert first.ports == [SSH]
+
+def test_details_table_is_freed_with_its_results():
+    details = PortDetailTable()
+    table = weakref.ref(details)
+    results = [ScanResult(f'192.0.2.{index}', 'up', [SSH], 1.0, 'Unknown', details=details) for index in range(4)]
+    del details
+    assert table() is not None
+    del results
+    gc.collect()
+    assert table() is None
+
+def test_results_without_a_table_get_their_own():
+    first = ScanResult('192.0.2.1', 'up', [SSH], 1.0, 'Unknown')
+    second = ScanResult('192.0.2.2', 'up', [DNS], 1.0, 'Unknown')
+    assert first.ports == [SSH] and second.ports == [DNS]
+    assert ScanResult('192.0.2.3', 'down', [], 0.0, 'Unknown (host down)').ports == []
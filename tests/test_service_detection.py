@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from service_detection import ServiceDatabase
+
+PROBES = {
+    'probes': [
+        {'name': 'NULL', 'payload': '', 'rarity': 1, 'ports': [22], 'matches': [
+            {'service': 'ssh', 'pattern': r'^SSH-([\d.]+)-OpenSSH_([\w.]+)(?: (\S+))?',
+             'product': 'OpenSSH', 'version': '$2', 'info': 'protocol $1 $3'},
+            {'service': 'ssh', 'pattern': r'^SSH-', 'soft': True},
+        ]},
+        {'name': 'GetRequest', 'payload': 'GET / HTTP/1.0\r\n\r\n', 'rarity': 1, 'ports': [80], 'matches': [
+            # $4 is beyond the pattern's groups and comes out empty
+            {'service': 'http', 'pattern': r'^HTTP/1\.[01] \d+.*\r\nServer: nginx/([\d.]+)',
+             'product': 'nginx', 'version': '$1', 'info': '$4'},
+            {'service': 'http', 'pattern': r'^HTTP/1\.[01] \d+', 'soft': True},
+        ]},
+        {'name': 'Generic', 'payload': '\r\n\r\n', 'rarity': 5, 'matches': []},
+        {'name': 'RedisPing', 'payload': 'PING\r\n', 'rarity': 8, 'ports': [6379], 'matches': [
+            {'service': 'redis', 'pattern': r'^\+PONG'},
+        ]},
+        {'name': 'DNSStatus', 'protocol': 'udp', 'payload': '\x00', 'rarity': 1, 'ports': [53], 'matches': []},
+    ],
+    'services': {'22': 'ssh', '80': 'http'},
+    'udp_services': {'53': 'domain'},
+}
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / 'probes.json'
+    path.write_text(json.dumps(PROBES))
+    return ServiceDatabase.from_file(str(path))
+
+def probe(database, name):
+    return next(probe for probe in database.probes if probe.name == name)
+
+def test_hard_match_fills_templates(database):
+    details = database.match(probe(database, 'NULL'), b'SSH-2.0-OpenSSH_9.6p1 Debian\r\n')
+    assert details == {'service': 'ssh', 'product': 'OpenSSH', 'version': '9.6p1', 'info': 'protocol 2.0 Debian'}
+
+def test_unmatched_and_missing_groups_are_empty(database):
+    # The optional group did not take part in the match
+    assert database.match(probe(database, 'NULL'), b'SSH-2.0-OpenSSH_9.6\r\n')['info'] == 'protocol 2.0'
+    # The template refers to a group the pattern lacks; the empty field is left out
+    details = database.match(probe(database, 'GetRequest'), b'HTTP/1.1 200 OK\r\nServer: nginx/1.24.0\r\n\r\n')
+    assert details == {'service': 'http', 'product': 'nginx', 'version': '1.24.0'}
+
+def test_soft_match_is_flagged(database):
+    assert database.match(probe(database, 'NULL'), b'SSH-2.0-libssh\r\n') == {'service': 'ssh', 'soft': True}
+    assert database.match(probe(database, 'GetRequest'), b'HTTP/1.1 404 Not Found\r\n') == {'service': 'http', 'soft': True}
+    assert database.match(probe(database, 'GetRequest'), b'garbage') is None
+
+def test_banner_signatures_back_up_other_probes(database):
+    # A banner sent on connect arrives in answer to whatever probe went out
+    details = database.match(probe(database, 'GetRequest'), b'SSH-2.0-OpenSSH_8.9p1\r\n')
+    assert details['service'] == 'ssh' and details['version'] == '8.9p1' and 'soft' not in details
+
+def test_probes_for_puts_the_port_s_own_probes_first(database):
+    names = lambda port, intensity, protocol='tcp': [probe.name for probe in database.probes_for(port, intensity, protocol)]
+    assert names(80, 7) == ['GetRequest', 'NULL', 'Generic']
+    assert names(22, 7) == ['NULL', 'GetRequest', 'Generic']
+    # A probe registered for the port is sent whatever its rarity
+    assert names(6379, 2) == ['RedisPing', 'NULL', 'GetRequest']
+    assert names(6379, 9) == ['RedisPing', 'NULL', 'GetRequest', 'Generic']
+    assert names(12345, 0) == []
+    assert names(53, 9, 'udp') == ['DNSStatus']
+
+def test_service_names_by_protocol(database):
+    assert database.service_name(22) == 'ssh'
+    assert database.service_name(53, 'udp') == 'domain'
+    assert database.service_name(53) == 'unknown'
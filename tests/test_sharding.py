@@ -0,0 +1,57 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from scan_result import OS_NOT_PROBED, ScanResult
+from sharding import DiscoveryRelay, merge_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_merge_results_combines_port_shards():
+    parts = [
+        ScanResult('192.0.2.1', 'up', [{'port': 443, 'state': 'open', 'service': 'https'}], 1.0, 'Unknown',
+                   port_counts={'open': 1, 'closed': 9}, timings={'ports': 0.5}),
+        ScanResult('192.0.2.1', 'up', [{'port': 22, 'state': 'open', 'service': 'ssh'}], 2.0, 'Linux 5.x',
+                   port_counts={'open': 1, 'closed': 9, 'filtered': 1}, timed_out=['service'], timings={'ports': 0.75}),
+    ]
+    merged = merge_results(parts)
+    assert [port['port'] for port in merged.ports] == [22, 443]
+    assert merged.port_counts == {'open': 2, 'closed': 18, 'filtered': 1}
+    assert merged.os_guess == 'Linux 5.x'
+    assert merged.scan_time == 2.0
+    assert merged.timed_out == ['service']
+    assert merged.timings['ports'] == 0.75
+
+def test_merge_results_takes_the_lead_shards_os_guess_and_hostname():
+    lead = ScanResult('192.0.2.1', 'up', [], 1.0, 'Unknown (Timeout)', hostname='gateway.example')
+    other = ScanResult('192.0.2.1', 'up', [], 1.0, OS_NOT_PROBED)
+    merged = merge_results([other, lead])
+    assert merged.os_guess == 'Unknown (Timeout)'
+    assert merged.hostname == 'gateway.example'
+
+def test_discovery_relay_hands_batches_to_every_other_shard():
+    inboxes = [multiprocessing.Queue() for _ in range(2)]
+    lead, followers = DiscoveryRelay(outboxes=inboxes), [DiscoveryRelay(inbox=inbox) for inbox in inboxes]
+    assert lead.lead and not any(follower.lead for follower in followers)
+    lead.publish({'host.example': '192.0.2.1'}, {'192.0.2.1': 'up'})
+    for follower in followers:
+        assert asyncio.run(follower.receive()) == ({'host.example': '192.0.2.1'}, {'192.0.2.1': 'up'})
+
+@pytest.mark.parametrize('sharding', [[], ['--shard-ports']])
+def test_sharded_command_line_scan_saves_results(tmp_path, sharding):
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        port = listener.getsockname()[1]
+        output = tmp_path / 'results.json'
+        subprocess.run([sys.executable, 'network_scanner.py', '-t', '127.0.0.1', '127.0.0.2', '-p', f'{port - 2}-{port + 2}',
+                        '-Pn', '-w', '2', '-o', str(output)] + sharding, cwd=ROOT, check=True, capture_output=True, timeout=120)
+    results = json.loads(output.read_text())
+    assert [result['host'] for result in results] == ['127.0.0.1', '127.0.0.2']
+    assert [record['port'] for record in results[0]['ports']] == [port]
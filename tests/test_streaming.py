@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+import config
+from network_scanner import NDJSONWriter, Scanner, load_results_from_file
+from scan_result import PortFinding, ScanResult
+
+async def serve(address, banner):
+    """A listener on `address` that sends `banner` on connect (nothing when None) and waits."""
+    async def handle(reader, writer):
+        if banner:
+            writer.write(banner)
+            await writer.drain()
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(handle, address, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+@pytest.fixture
+def quick_services(monkeypatch):
+    monkeypatch.setattr(config.CONFIG, 'SERVICE_PROBE_TIMEOUT', 0.3)
+    monkeypatch.setattr(config.CONFIG, 'SERVICE_DETECTION_BUDGET', 0.6)
+    monkeypatch.setattr(config.CONFIG, 'FILTER_SAMPLE_SIZE', 0)
+
+async def stream(scanner, targets, ports):
+    """The scan's events, each with the time it arrived."""
+    return [(event, time.monotonic()) async for event in scanner.iter_scan(targets, ports)]
+
+def test_findings_stream_before_their_host_and_hosts_as_they_finish(quick_services):
+    async def main():
+        fast, fast_port = await serve('127.0.0.1', b"SSH-2.0-OpenSSH_8.9p1\r\n")
+        # A silent service keeps the second host in service detection for its whole budget
+        slow, slow_port = await serve('127.0.0.2', None)
+        scanner = Scanner(discovery=False, os_detection=False, reverse_dns=False)
+        async with fast, slow:
+            started = time.monotonic()
+            return fast_port, slow_port, started, await stream(scanner, ['127.0.0.2', '127.0.0.1'], f'{fast_port},{slow_port}')
+
+    fast_port, slow_port, started, events = asyncio.run(main())
+    kinds = [(type(event).__name__, event.host) for event, _ in events]
+    assert kinds == [('PortFinding', '127.0.0.1'), ('ScanResult', '127.0.0.1'),
+                     ('PortFinding', '127.0.0.2'), ('ScanResult', '127.0.0.2')]
+    assert events[0][0].port['port'] == fast_port and events[2][0].port['port'] == slow_port
+    # The fast host is reported while the slow one is still being scanned
+    assert events[1][1] - started < 0.3 <= events[3][1] - started
+
+def test_ndjson_stream_reloads_as_host_results(tmp_path):
+    ssh = {'port': 22, 'state': 'open', 'service': 'ssh', 'version': '8.9p1', 'product': 'OpenSSH'}
+    results = [ScanResult('192.0.2.1', 'up', [ssh], 1.5, 'Linux', port_counts={'open': 1, 'closed': 9}, timings={'ports': 1.0}),
+               ScanResult('192.0.2.2', 'down', [], 0.0, 'Unknown (host down)')]
+    path = tmp_path / 'scan.ndjson'
+    with open(path, 'w') as stream:
+        writer = NDJSONWriter(stream)
+        writer.write(PortFinding('192.0.2.1', ssh))
+        for result in results:
+            writer.write(result)
+    lines = path.read_text().splitlines()
+    assert [line.split(',', 1)[0] for line in lines] == ['{"type":"port"', '{"type":"host"', '{"type":"host"']
+    assert [result.to_dict() for result in load_results_from_file(str(path))] == [result.to_dict() for result in results]
+
+def test_cli_streams_a_loopback_scan_for_compare(tmp_path, quick_services):
+    pytest.importorskip('jinja2')  # cli imports scan_comparison, which renders reports with it
+    import cli
+    from port_spec import parse_ports
+
+    async def main():
+        server, port = await serve('127.0.0.1', b"SSH-2.0-OpenSSH_8.9p1\r\n")
+        async with server:
+            kept = await cli.stream_scan(['127.0.0.1'], parse_ports(str(port)), 'connect', False, str(path), 0, keep_results=True)
+        return port, kept
+
+    path = tmp_path / 'scan.ndjson'
+    port, kept = asyncio.run(main())
+    reloaded = cli.load_previous_results(str(path))
+    assert [result.to_dict() for result in reloaded] == [result.to_dict() for result in kept]
+    assert [record['port'] for record in reloaded[0].ports] == [port]
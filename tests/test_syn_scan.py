@@ -0,0 +1,63 @@
+import asyncio
+
+from metrics import METRICS
+from packets import TCP_ACK, TCP_RST, TCP_SYN, TCPReply
+from syn_scan import SynScanner
+
+class LossyListener:
+    """Drops the first probe to every port; answers later ones with a SYN-ACK from `open_ports` and an RST otherwise."""
+
+    is_open = True
+
+    def __init__(self, open_ports, silent_ports=()):
+        self.open_ports = set(open_ports)
+        self.silent_ports = set(silent_ports)
+        self.seen = set()
+        self.handler = None
+
+    def subscribe(self, port, handler):
+        self.handler = handler
+
+    def unsubscribe(self, port):
+        self.handler = None
+
+    async def send(self, packet, ip):
+        port = int.from_bytes(packet[22:24], 'big')
+        if (ip, port) not in self.seen:
+            self.seen.add((ip, port))
+            return
+        if port in self.silent_ports:
+            return
+        cookie = self.scanner.cookie(ip, port)
+        if port in self.open_ports:
+            self.handler(TCPReply(ip, port, self.scanner.source_port, 1, (cookie + 1) & 0xffffffff, TCP_SYN | TCP_ACK, 65535, 64, b''))
+        else:
+            self.handler(TCPReply(ip, port, self.scanner.source_port, 0, (cookie + 1) & 0xffffffff, TCP_RST | TCP_ACK, 0, 64, b''))
+
+def test_retried_probes_answered_later_are_not_timeouts():
+    listener = LossyListener(open_ports=[22], silent_ports=[81])
+    scanner = SynScanner(timeout=0.01, retries=1, source_port=50000, listener=listener)
+    listener.scanner = scanner
+    timeouts = METRICS.timeouts.values.get(('syn',), 0)
+    results = asyncio.run(scanner.scan(['127.0.0.1'], [22, 80, 81]))
+    assert results == {'127.0.0.1': {22: 'open'}}
+    assert scanner.closed == {'127.0.0.1': 1}
+    assert METRICS.timeouts.values.get(('syn',), 0) - timeouts == 1
+
+def test_retry_passes_send_only_unanswered_probes():
+    listener = LossyListener(open_ports=[22], silent_ports=[81])
+    sent = []
+    send = listener.send
+
+    async def record(packet, ip):
+        sent.append((ip, int.from_bytes(packet[22:24], 'big')))
+        await send(packet, ip)
+
+    listener.send = record
+    scanner = SynScanner(timeout=0.01, retries=2, source_port=50000, listener=listener)
+    listener.scanner = scanner
+    asyncio.run(scanner.scan(['127.0.0.1', '127.0.0.2'], [22, 80, 81]))
+    # Every probe once, all of them again after the first was dropped, then only the silent port
+    assert len(sent) == 6 + 6 + 2
+    assert sorted(sent[12:]) == [('127.0.0.1', 81), ('127.0.0.2', 81)]
+    assert scanner.answered_hosts() == {'127.0.0.1', '127.0.0.2'}
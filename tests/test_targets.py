@@ -0,0 +1,44 @@
+import pytest
+
+from targets import TargetSpec, expand_targets
+
+def test_cidr_ranges_and_lists():
+    spec = TargetSpec(['10.0.0.0/30', '10.0.0.8-9, 192.0.2.1'])
+    assert list(spec) == ['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.8', '10.0.0.9', '192.0.2.1']
+
+def test_overlaps_are_merged_and_exclusions_subtracted():
+    spec = TargetSpec(['10.0.0.0/29', '10.0.0.4-10.0.0.9', 'host.example'], exclude=['10.0.0.2-5', 'host.example'])
+    assert list(spec) == ['10.0.0.0', '10.0.0.1', '10.0.0.6', '10.0.0.7', '10.0.0.8', '10.0.0.9']
+
+def test_hostnames_come_first():
+    assert list(TargetSpec(['10.0.0.1', 'host.example'])) == ['host.example', '10.0.0.1']
+
+def test_ipv6_ranges():
+    assert list(TargetSpec(['2001:db8::/127', '2001:db8::10-2001:db8::11'])) == [
+        '2001:db8::', '2001:db8::1', '2001:db8::10', '2001:db8::11']
+
+def test_huge_ranges_are_not_expanded():
+    spec = TargetSpec(['2001:db8::/64'])
+    assert spec.count == 2 ** 64
+    assert list(spec.iter_range(2 ** 63, 2 ** 63 + 2)) == ['2001:db8:0:0:8000::', '2001:db8::8000:0:0:1']
+
+def test_iter_range_matches_iteration():
+    spec = TargetSpec(['host.example', '10.0.0.0/30', '10.0.1.0/31'])
+    assert list(spec.iter_range(1, 6)) == list(spec)[1:6]
+
+@pytest.mark.parametrize('count', [1, 2, 5, 64, 1000])
+def test_shuffled_is_a_permutation(count):
+    spec = TargetSpec([f'10.0.0.0-10.0.{(count - 1) >> 8}.{(count - 1) & 255}'])
+    assert spec.count == count
+    shuffled = list(spec.shuffled(seed=7))
+    assert sorted(shuffled) == sorted(spec)
+
+def test_shuffled_is_reproducible_and_actually_shuffles():
+    spec = TargetSpec(['10.0.0.0/24'])
+    assert list(spec.shuffled(seed=1)) == list(spec.shuffled(seed=1))
+    assert list(spec.shuffled(seed=1)) != list(spec)
+    assert list(spec.shuffled(seed=1)) != list(spec.shuffled(seed=2))
+
+def test_expand_targets():
+    assert list(expand_targets(['10.0.0.0/31'])) == ['10.0.0.0', '10.0.0.1']
+    assert sorted(expand_targets(['10.0.0.0/30'], randomize=True, seed=3)) == ['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3']
@@ -0,0 +1,40 @@
+import pytest
+
+from timing import HostTimingTable, RTTEstimator
+
+def test_first_sample_sets_srtt_and_half_variance():
+    estimator = RTTEstimator(1.0, 0.01, 10.0)
+    estimator.update(0.2)
+    assert estimator.srtt == pytest.approx(0.2)
+    assert estimator.rttvar == pytest.approx(0.1)
+    assert estimator.timeout == pytest.approx(0.2 + 4 * 0.1)
+
+def test_later_samples_are_smoothed():
+    estimator = RTTEstimator(1.0, 0.01, 10.0)
+    estimator.update(0.2)
+    estimator.update(0.4)
+    assert estimator.rttvar == pytest.approx(0.75 * 0.1 + 0.25 * 0.2)
+    assert estimator.srtt == pytest.approx(0.875 * 0.2 + 0.125 * 0.4)
+    assert estimator.samples == 2
+
+def test_initial_timeout_until_first_sample():
+    assert RTTEstimator(1.5, 0.01, 10.0).timeout == 1.5
+
+def test_timeout_is_clamped():
+    fast = RTTEstimator(1.0, 0.1, 10.0)
+    fast.update(0.001)
+    assert fast.timeout == 0.1
+    slow = RTTEstimator(1.0, 0.1, 2.0)
+    slow.update(5.0)
+    assert slow.timeout == 2.0
+
+def test_backoff_doubles_per_attempt_up_to_the_maximum():
+    table = HostTimingTable(0.5, 0.01, 3.0)
+    assert [table.timeout_for('10.0.0.1', attempt) for attempt in range(4)] == [0.5, 1.0, 2.0, 3.0]
+
+def test_hosts_are_tracked_separately():
+    table = HostTimingTable(1.0, 0.01, 10.0)
+    table.record('10.0.0.1', 0.05)
+    assert table.get('10.0.0.1').samples == 1
+    assert table.get('10.0.0.2').srtt is None
+    assert table.timeout_for('10.0.0.2') == 1.0
@@ -0,0 +1,104 @@
+import asyncio
+import socket
+import time
+
+import config
+from network_scanner import Scanner
+from service_detection import ServiceDatabase
+from udp_scan import IP_RECVERR, IPV6_RECVERR, SO_EE_ORIGIN_ICMP, SO_EE_ORIGIN_ICMP6, UDPScanner, _EXTENDED_ERR
+
+class ErrorQueue:
+    """Socket stand-in whose error queue holds the given (cmsg, address) entries."""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def recvmsg(self, bufsize, ancbufsize, flags):
+        if not self.entries:
+            raise BlockingIOError
+        ancdata, address = self.entries.pop(0)
+        return b'', ancdata, 0, address
+
+def icmp_error(level, option, origin, icmp_type, code):
+    return [(level, option, _EXTENDED_ERR.pack(111, origin, icmp_type, code, 0, 0, 0))]
+
+def drain(family, entries):
+    scanner = UDPScanner(ServiceDatabase([], {}))
+    scanner._drain_errors(family, ErrorQueue(entries))
+    return scanner
+
+def test_icmp_errors_classify_ipv4_ports():
+    v4 = lambda icmp_type, code: icmp_error(socket.IPPROTO_IP, IP_RECVERR, SO_EE_ORIGIN_ICMP, icmp_type, code)
+    scanner = drain(socket.AF_INET, [
+        (v4(3, 3), ('192.0.2.1', 53)),    # Port unreachable
+        (v4(3, 13), ('192.0.2.1', 161)),  # Administratively prohibited
+        (v4(3, 1), ('192.0.2.2', 123)),   # Host unreachable
+        (v4(11, 0), ('192.0.2.1', 500)),  # Time exceeded says nothing about the port
+        (v4(3, 4), ('192.0.2.1', 69)),    # Fragmentation needed neither
+    ])
+    assert scanner.closed == {'192.0.2.1': 1}
+    assert {key: record['state'] for key, record in scanner._results.items()} == {
+        ('192.0.2.1', 161): 'filtered', ('192.0.2.2', 123): 'filtered'}
+
+def test_icmp_errors_classify_ipv6_ports():
+    v6 = lambda icmp_type, code: icmp_error(socket.IPPROTO_IPV6, IPV6_RECVERR, SO_EE_ORIGIN_ICMP6, icmp_type, code)
+    scanner = drain(socket.AF_INET6, [
+        (v6(1, 4), ('2001:db8::1', 53, 0, 0)),   # Port unreachable
+        (v6(1, 1), ('2001:db8::1', 161, 0, 0)),  # Administratively prohibited
+        (v6(1, 3), ('2001:db8::2', 123, 0, 0)),  # Address unreachable
+        # An ICMPv4-origin error on the IPv6 socket is ignored
+        (icmp_error(socket.IPPROTO_IPV6, IPV6_RECVERR, SO_EE_ORIGIN_ICMP, 1, 4), ('2001:db8::1', 69, 0, 0)),
+    ])
+    assert scanner.closed == {'2001:db8::1': 1}
+    assert {key: record['state'] for key, record in scanner._results.items()} == {
+        ('2001:db8::1', 161): 'filtered', ('2001:db8::2', 123): 'filtered'}
+
+def test_repeated_port_unreachable_is_counted_once():
+    v4 = icmp_error(socket.IPPROTO_IP, IP_RECVERR, SO_EE_ORIGIN_ICMP, 3, 3)
+    scanner = drain(socket.AF_INET, [(v4, ('192.0.2.1', 53)), (v4, ('192.0.2.1', 53))])
+    assert scanner.closed == {'192.0.2.1': 1}
+
+def test_loopback_sweep_reports_open_closed_and_silent_ports():
+    class Echo(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, address):
+            self.transport.sendto(b'pong', address)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(Echo, local_addr=('127.0.0.1', 0))
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as unused:
+            silent.bind(('127.0.0.1', 0))
+            unused.bind(('127.0.0.1', 0))
+            ports = [transport.get_extra_info('sockname')[1], silent.getsockname()[1], unused.getsockname()[1]]
+            unused.close()  # Nothing listens there any more
+            scanner = UDPScanner(ServiceDatabase([], {}), timeout=0.2, retries=1)
+            try:
+                return ports, scanner, await scanner.scan(['127.0.0.1'], ports)
+            finally:
+                transport.close()
+
+    (echo, silent, closed), scanner, results = asyncio.run(main())
+    assert {port: record['state'] for port, record in results['127.0.0.1'].items()} == {echo: 'open'}
+    assert results['127.0.0.1'][echo]['banner'] == 'pong'
+    assert scanner.closed == {'127.0.0.1': 1}
+    assert silent not in results['127.0.0.1'] and closed not in results['127.0.0.1']
+
+def test_sweep_ends_at_the_port_scan_timeout(monkeypatch):
+    monkeypatch.setattr(config.CONFIG, 'PORT_SCAN_TIMEOUT', 0.2)
+
+    async def main():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent:
+            silent.bind(('127.0.0.1', 0))
+            scanner = Scanner(discovery=False, os_detection=False, reverse_dns=False, connect_timeout=1.0)
+            started = time.monotonic()
+            result, = await scanner.scan(['127.0.0.1'], f'U:{silent.getsockname()[1]}')
+            return result, time.monotonic() - started
+
+    # Unbounded, three passes would wait a second each for the silent port
+    result, elapsed = asyncio.run(main())
+    assert elapsed < 1.0
+    assert result.timed_out == ['ports'] and result.port_counts['open|filtered'] == 1
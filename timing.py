@@ -0,0 +1,168 @@
+import ipaddress
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+class RTTEstimator:
+    """Smoothed round-trip time and variance for one host, computed as TCP does for its RTO (RFC 6298)."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_timeout: float, min_timeout: float, max_timeout: float):
+        self.srtt: float | None = None
+        self.rttvar: float | None = None
+        self.samples = 0
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._timeout = initial_timeout
+
+    def update(self, rtt: float) -> None:
+        """Fold one measured round trip (in seconds) into the estimate."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.samples += 1
+        self._timeout = self.srtt + self.K * self.rttvar
+
+    @property
+    def timeout(self) -> float:
+        return min(max(self._timeout, self.min_timeout), self.max_timeout)
+
+class HostTimingTable:
+    """Per-host RTT estimators keyed by address."""
+
+    def __init__(self, initial_timeout: float, min_timeout: float, max_timeout: float):
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._hosts: Dict[str, RTTEstimator] = {}
+
+    def get(self, host: str) -> RTTEstimator:
+        estimator = self._hosts.get(host)
+        if estimator is None:
+            estimator = self._hosts[host] = RTTEstimator(self.initial_timeout, self.min_timeout, self.max_timeout)
+        return estimator
+
+    def timeout_for(self, host: str, attempt: int = 0) -> float:
+        """Probe timeout for `host`, doubled for every retransmission as TCP backs off."""
+        return min(self.get(host).timeout * (2 ** attempt), self.max_timeout)
+
+    def record(self, host: str, rtt: float) -> None:
+        self.get(host).update(rtt)
+
+class HostDeadline:
+    """Time limits for one host: an overall budget plus optional budgets per phase.
+
+    A phase's clock starts when the phase first asks for its remaining time. Work is bounded
+    cooperatively: callers shorten their own timeouts to what is left and skip work once a
+    phase has expired, so what finished in time is kept. Phases that ran out are listed in
+    `timed_out`.
+    """
+
+    def __init__(self, total: float = 0, phases: Dict[str, float] | None = None):
+        self._end = time.monotonic() + total if total else None
+        self._phases = phases or {}
+        self._phase_ends: Dict[str, float | None] = {}
+        self.timed_out: List[str] = []
+
+    def remaining(self, phase: str) -> float | None:
+        """Seconds left for `phase`, or None when neither it nor the host has a limit."""
+        if phase not in self._phase_ends:
+            limit = self._phases.get(phase)
+            self._phase_ends[phase] = time.monotonic() + limit if limit else None
+        ends = [end for end in (self._end, self._phase_ends[phase]) if end is not None]
+        return max(0.0, min(ends) - time.monotonic()) if ends else None
+
+    def bound(self, phase: str, timeout: float) -> float:
+        """`timeout` shortened to the time left for `phase`."""
+        remaining = self.remaining(phase)
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def expired(self, phase: str) -> bool:
+        """Whether `phase` is out of time; an expired phase is recorded in `timed_out`."""
+        if self.remaining(phase) != 0:
+            return False
+        self.expire(phase)
+        return True
+
+    def expire(self, phase: str) -> None:
+        if phase not in self.timed_out:
+            self.timed_out.append(phase)
+
+# Phases of a host's scan, in the order they happen; resolution, discovery and the SYN/UDP
+# sweeps run for a whole target batch at once, so their time is the batch's
+PHASES = ('resolve', 'discovery', 'queue', 'ports', 'service', 'os')
+
+class PhaseTimer:
+    """Wall time spent in each phase of one host's scan.
+
+    Phases may overlap (a connect scan identifies services while it still probes other ports),
+    and a phase may have several activities running at once; its clock runs while at least
+    one of them is.
+    """
+
+    def __init__(self, durations: Dict[str, float] | None = None):
+        self.durations: Dict[str, float] = dict(durations or {})
+        self._active: Dict[str, int] = {}
+        self._since: Dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+    def start(self, phase: str) -> None:
+        if not self._active.get(phase):
+            self._since[phase] = time.monotonic()
+        self._active[phase] = self._active.get(phase, 0) + 1
+
+    def stop(self, phase: str) -> None:
+        self._active[phase] -= 1
+        if not self._active[phase]:
+            self.add(phase, time.monotonic() - self._since.pop(phase))
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop(phase)
+
+class PhaseReport:
+    """Mean phase times per network segment (/24 for IPv4, /64 for IPv6), to see which phase
+    dominates where. Hosts that are not addresses are grouped under 'hostnames'."""
+
+    def __init__(self, prefix4: int = 24, prefix6: int = 64):
+        self.prefixes = {4: prefix4, 6: prefix6}
+        self._hosts: Dict[str, int] = {}
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def segment(self, host: str) -> str:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return 'hostnames'
+        return str(ipaddress.ip_network(f"{address}/{self.prefixes[address.version]}", strict=False))
+
+    def add(self, host: str, timings: Dict[str, float]) -> None:
+        if not timings:
+            return
+        segment = self.segment(host)
+        self._hosts[segment] = self._hosts.get(segment, 0) + 1
+        totals = self._totals.setdefault(segment, dict.fromkeys(PHASES, 0.0))
+        for phase, seconds in timings.items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """One row per segment: host count, mean seconds per phase and the dominant phase."""
+        rows = []
+        for segment, totals in self._totals.items():
+            hosts = self._hosts[segment]
+            means = {phase: seconds / hosts for phase, seconds in totals.items()}
+            rows.append({'segment': segment, 'hosts': hosts, 'phases': means,
+                         'dominant': max(means, key=means.get)})
+        return sorted(rows, key=lambda row: row['segment'])
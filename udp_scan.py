@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import socket
+import struct
+import time
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from metrics import METRICS
+from packets import address_family
+from port_spec import AnsweredPorts
+from probe_scheduler import TokenBucket
+from service_detection import ServiceDatabase, ServiceProbe
+
+logger = logging.getLogger(__name__)
+
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+
+# struct sock_extended_err: ee_errno, ee_origin, ee_type, ee_code, ee_pad, ee_info, ee_data
+_EXTENDED_ERR = struct.Struct('=IBBBBII')
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+
+# Per family: error queue option level and name, ICMP origin, destination unreachable type,
+# port unreachable code, and the unreachable codes that mean something is in the way
+# (network/host/protocol unreachable and administratively prohibited; for ICMPv6 no route,
+# prohibited, address unreachable, source policy and reject route)
+_ICMP_ERRORS = {
+    socket.AF_INET: (socket.IPPROTO_IP, IP_RECVERR, SO_EE_ORIGIN_ICMP, 3, 3, frozenset((0, 1, 2, 9, 10, 13))),
+    socket.AF_INET6: (socket.IPPROTO_IPV6, IPV6_RECVERR, SO_EE_ORIGIN_ICMP6, 1, 4, frozenset((0, 1, 3, 5, 6))),
+}
+
+class UDPScanner:
+    """UDP scanner sending every probe of a sweep from one unconnected datagram socket per address family.
+
+    Ports with a probe in the service database get its protocol payload (a DNS query, an NTP
+    request, an SNMP get, ...), others an empty datagram. A reply marks the port open and is
+    matched against the probe's signatures; an ICMP port unreachable, read from the socket's
+    error queue (IP_RECVERR), marks it closed and other ICMP unreachables filtered. Ports
+    that stay silent through every retransmission are 'open|filtered'. Closed ports are only
+    counted per address, in `closed`.
+    """
+
+    def __init__(self, database: ServiceDatabase, timeout: float = 1.0, retries: int = 1, batch_size: int = 256,
+                 rate: TokenBucket | None = None):
+        self.database = database
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_size = batch_size
+        self.rate = rate or TokenBucket(0)
+        self._sockets: Dict[int, socket.socket] = {}
+        self._ports: Dict[int, ServiceProbe | None] = {}  # Probe whose payload each port is sent
+        self._results: Dict[Tuple[str, int], Dict[str, Any]] = {}  # Open and filtered ports
+        self._answered = AnsweredPorts()
+        self.closed: Dict[str, int] = {}
+        self._attempt = 0
+        self._until: float | None = None
+        self.timed_out = False
+
+    def _open(self, family: int) -> socket.socket:
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        level, option = _ICMP_ERRORS[family][:2]
+        try:
+            # Unconnected UDP sockets only hear about ICMP errors through the error queue
+            sock.setsockopt(level, option, 1)
+        except OSError as e:
+            logger.warning(f"ICMP errors are not available for UDP probes, closed ports will show as open|filtered: {str(e)}")
+        return sock
+
+    def _on_readable(self, family: int, sock: socket.socket) -> None:
+        self._drain_errors(family, sock)
+        while True:
+            try:
+                data, address = sock.recvfrom(65535)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue  # A queued ICMP error reported through recvfrom; the error queue carries it too
+            ip, port = address[:2]
+            # A reply is the only proof of an open port, so it outranks an earlier ICMP error
+            if port in self._ports and self._results.get((ip, port), {}).get('state') != 'open':
+                if not self._answered.add(ip, port) and (ip, port) not in self._results:
+                    self.closed[ip] -= 1  # A port unreachable came first
+                self._results[(ip, port)] = self._describe_reply(port, data)
+                METRICS.reply('udp', 'reply')
+
+    def _drain_errors(self, family: int, sock: socket.socket) -> None:
+        level, option, icmp_origin, unreachable, port_unreachable, filtered_codes = _ICMP_ERRORS[family]
+        while True:
+            try:
+                _, ancdata, _, address = sock.recvmsg(512, 1024, MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug(f"Could not read the UDP error queue: {str(e)}")
+                return
+            for cmsg_level, kind, data in ancdata:
+                if cmsg_level != level or kind != option or len(data) < _EXTENDED_ERR.size:
+                    continue
+                _, origin, icmp_type, icmp_code, _, _, _ = _EXTENDED_ERR.unpack_from(data)
+                if origin != icmp_origin or icmp_type != unreachable or not address:
+                    continue
+                # The error's address is the destination of the datagram that drew it
+                ip, port = address[:2]
+                if icmp_code == port_unreachable:
+                    if self._answered.add(ip, port):
+                        self.closed[ip] = self.closed.get(ip, 0) + 1
+                    METRICS.reply('udp', 'port-unreachable')
+                elif icmp_code in filtered_codes:
+                    if self._answered.add(ip, port):
+                        self._results[(ip, port)] = {'port': port, 'protocol': 'udp', 'state': 'filtered'}
+                    METRICS.reply('udp', 'unreachable')
+
+    def _describe_reply(self, port: int, data: bytes) -> Dict[str, Any]:
+        probe = self._ports[port]
+        details = (probe.match(data) if probe is not None else None) or {}
+        details.pop('soft', None)
+        record = {
+            'port': port,
+            'protocol': 'udp',
+            'state': 'open',
+            'service': details.get('service') or self.database.service_name(port, 'udp'),
+            'version': details.get('version', 'Unknown')
+        }
+        for field in ('product', 'info', 'cpe'):
+            if field in details:
+                record[field] = details[field]
+        if not details:
+            record['banner'] = data[:80].decode('utf-8', errors='replace').strip()
+        return record
+
+    def _payload(self, port: int) -> bytes:
+        probe = self._ports[port]
+        return probe.payload if probe is not None else b''
+
+    def _out_of_time(self) -> bool:
+        """Whether the sweep's time limit has passed; the sweep is then recorded as timed out."""
+        if self._until is not None and time.monotonic() >= self._until:
+            self.timed_out = True
+        return self.timed_out
+
+    async def _send(self, probes: Iterable[Tuple[str, int]]) -> int:
+        sent = 0
+        batch: List[Tuple[str, int]] = []
+        for probe in probes:
+            batch.append(probe)
+            if len(batch) >= self.batch_size:
+                if self._out_of_time():
+                    return sent
+                sent += await self._flush(batch)
+                batch = []
+        if batch:
+            sent += await self._flush(batch)
+        return sent
+
+    async def _flush(self, batch: List[Tuple[str, int]]) -> int:
+        await self.rate.acquire(len(batch))
+        for ip, port in batch:
+            for _ in range(3):
+                try:
+                    self._sockets[address_family(ip)].sendto(self._payload(port), (ip, port))
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(0.001)  # Send buffer full; let it drain
+                except (ConnectionRefusedError, ConnectionResetError):
+                    continue  # Pending error of an earlier probe, already in the error queue
+                except OSError as e:
+                    logger.warning(f"Could not send UDP probe to {ip}:{port}: {str(e)}")
+                    break
+        METRICS.sent('udp', len(batch), retry=self._attempt > 0)
+        # Give the reader a turn between batches so replies are drained while we send
+        await asyncio.sleep(0)
+        return len(batch)
+
+    async def scan(self, addresses: Sequence[str], ports: Sequence[int],
+                   until: float | None = None) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        """Probe every address x port; returns {address: {port: record}} for the open and filtered
+        ports and counts closed ones in `closed`. Ports that did not answer are open|filtered.
+
+        With `until` (a time.monotonic() instant) the sweep stops there and sets `timed_out`."""
+        self._results = {}
+        self._answered = AnsweredPorts()
+        self.closed = {}
+        self._until = until
+        self.timed_out = False
+        self._ports = {}
+        for port in ports:
+            probes = self.database.probes_for(port, 0, 'udp')
+            self._ports[port] = probes[0] if probes and port in probes[0].ports else None
+        loop = asyncio.get_running_loop()
+        try:
+            for family in sorted({address_family(ip) for ip in addresses}):
+                sock = self._sockets[family] = self._open(family)
+                loop.add_reader(sock.fileno(), self._on_readable, family, sock)
+            # Only probes that drew no answer at all are retransmitted
+            for attempt in range(self.retries + 1):
+                self._attempt = attempt
+                sent = await self._send(self._answered.unanswered(addresses, ports))
+                if not sent:
+                    break
+                logger.info(f"UDP pass {attempt + 1}: sent {sent} probes")
+                # Wait out the replies, though never past the time limit
+                await asyncio.sleep(self.timeout if self._until is None else max(0.0, min(self.timeout, self._until - time.monotonic())))
+                if self._out_of_time():
+                    break
+            # A probe answered on a retransmission did not time out; only the ones never answered did
+            METRICS.reply('udp', 'timeout', sum(1 for _ in self._answered.unanswered(addresses, ports)))
+        finally:
+            for sock in self._sockets.values():
+                loop.remove_reader(sock.fileno())
+                sock.close()
+            self._sockets = {}
+
+        results: Dict[str, Dict[int, Dict[str, Any]]] = {ip: {} for ip in addresses}
+        for (ip, port), record in self._results.items():
+            if ip in results:
+                results[ip][port] = record
+        return results
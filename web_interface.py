@@ -1,13 +1,24 @@
 from aioflask import Flask, render_template, request, jsonify
 from flask_login import login_required, current_user
+from .config import get_config
 from .database import ScanDatabase
+from .metrics import METRICS
 from .network_scanner import Scanner
+from .probe_scheduler import TokenBucket
+from .profiler import LoopLagMonitor, SamplingProfiler, describe
+from .targets import TargetSpec
+from .timing import PHASES
 import json
 from typing import Dict, List, Any, Union, Tuple
 
 app = Flask(__name__)
 db = ScanDatabase()
 scanner = Scanner()
+# Scan requests per user, limited to API_RATE_LIMIT a minute
+scan_request_limits: Dict[int, TokenBucket] = {}
+# Sampling profile of the web process, toggled on and off through /profile
+profiler = SamplingProfiler()
+loop_lag = LoopLagMonitor()
 
 # Configure app settings here
 app.config['SECRET_KEY'] = 'your-secret-key'  # Change this to a real secret key
@@ -33,14 +44,19 @@ async def scan_results(scan_id: int) -> str:
 async def new_scan() -> Union[str, Dict[str, str]]:
     """Handle new scan requests."""
     if request.method == 'POST':
-        targets = request.form.get('targets', '').split(',')
+        targets = [target.strip() for target in request.form.get('targets', '').split(',') if target.strip()]
         ports = request.form.get('ports', '')
         
         if not targets or not ports:
             return jsonify({"status": "error", "message": "Invalid input. Please provide targets and ports."}), 400
+
+        rate_limit = get_config('API_RATE_LIMIT')
+        limiter = scan_request_limits.setdefault(current_user.id, TokenBucket(rate_limit / 60, burst=rate_limit))
+        if not limiter.try_acquire():
+            return jsonify({"status": "error", "message": "Too many scan requests. Please try again later."}), 429
         
         try:
-            results = await scanner.scan(targets, ports)
+            results = await scanner.scan(TargetSpec(targets), ports)
             await db.save_scan_results(current_user.id, targets, ports, [r.to_dict() for r in results])
             return jsonify({"status": "success", "message": "Scan completed and results saved."})
         except Exception as e:
@@ -48,6 +64,29 @@ async def new_scan() -> Union[str, Dict[str, str]]:
     
     return await render_template('new_scan.html')
 
+@app.route('/metrics')
+async def metrics() -> Tuple[str, int, Dict[str, str]]:
+    """Scanner metrics in the Prometheus text format; left open so scrapers need no login, and
+    therefore without the per-host latency series, whose labels would show other users' targets."""
+    return METRICS.render(per_host=False), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/profile', methods=['POST'])
+@login_required
+async def toggle_profile() -> Dict[str, str]:
+    """Start profiling the web process, or stop and write the collapsed stacks to PROFILE_OUTPUT."""
+    if not profiler.running:
+        profiler.samples.clear()
+        loop_lag.lags.clear()
+        loop_lag.worst = 0.0
+        profiler.start()
+        loop_lag.start()
+        return jsonify({"status": "success", "message": "Profiling started."})
+    loop_lag.stop()
+    profiler.stop()
+    output = get_config('PROFILE_OUTPUT')
+    profiler.write_collapsed(output)
+    return jsonify({"status": "success", "message": f"Profile: {describe(profiler, loop_lag)}", "output": output})
+
 @app.route('/analysis')
 @login_required
 async def analysis() -> str:
@@ -58,6 +97,7 @@ async def analysis() -> str:
     
     open_ports = 0
     most_common_ports: List[Tuple[int, int]] = []
+    phase_report: List[Dict[str, Any]] = []
     
     if scan_history:
         try:
@@ -69,11 +109,13 @@ async def analysis() -> str:
                     if port['state'] == 'open':
                         port_count[port['port']] = port_count.get(port['port'], 0) + 1
             most_common_ports = sorted(port_count.items(), key=lambda x: x[1], reverse=True)[:5]
+            phase_report = await db.get_phase_report(scan_history[0]['id'], current_user.id)
         except Exception as e:
             app.logger.error(f"Error processing scan results: {str(e)}")
 
     return await render_template('analysis.html', total_scans=total_scans, total_hosts=total_hosts,
-                                 open_ports=open_ports, most_common_ports=most_common_ports)
+                                 open_ports=open_ports, most_common_ports=most_common_ports,
+                                 phase_report=phase_report, phases=PHASES)
 
 if __name__ == '__main__':
     app.run(debug=True)